@@ -0,0 +1,41 @@
+"""Add BacktestState table
+
+Revision ID: 5b7e2c91d4a3
+Revises: 0208455daa63
+Create Date: 2026-10-17 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e2c91d4a3'
+down_revision: Union[str, Sequence[str], None] = '0208455daa63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 保存已完成回测的流式状态，导入更新的数据后可从断点继续
+    op.create_table('BacktestState',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('import_id', sa.Integer(), nullable=False, comment='回测所用的数据批次ID'),
+    sa.Column('config_id', sa.Integer(), nullable=False, comment='回测所用的策略ID'),
+    sa.Column('initial_capital', sa.Float(), nullable=False, comment='初始资金'),
+    sa.Column('last_date', sa.Date(), nullable=False, comment='已喂入的最后一根K线日期（尚未清仓）'),
+    sa.Column('bar_count', sa.Integer(), nullable=False, comment='已喂入的K线根数'),
+    sa.Column('state', sa.LargeBinary(), nullable=False, comment='BackTest.get_state() 的 pickle'),
+    sa.Column('updated_time', sa.DateTime(), nullable=True, comment='保存时间'),
+    sa.ForeignKeyConstraint(['import_id'], ['ImportedFiles.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['config_id'], ['GridConfig.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('BacktestState')
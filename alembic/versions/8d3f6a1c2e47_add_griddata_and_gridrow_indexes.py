@@ -0,0 +1,36 @@
+"""Add composite indexes on GridData(import_id, date) and GridRow(config_id)
+
+Revision ID: 8d3f6a1c2e47
+Revises: 5b7e2c91d4a3
+Create Date: 2026-10-17 16:40:12.318205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d3f6a1c2e47'
+down_revision: Union[str, Sequence[str], None] = '5b7e2c91d4a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 回测读取行情：WHERE import_id = ? ORDER BY date，只取 日期 / 开高低收；
+    # 索引带上这四列后为覆盖索引，load_ohlc 只需按索引顺序扫描，不回表也不排序
+    # （新库由 Base.metadata.create_all 建表时已带上这些索引，因此用 if_not_exists）
+    op.create_index('ix_GridData_import_id_date', 'GridData',
+                    ['import_id', 'date', 'open_price', 'high_price', 'low_price', 'close_price'],
+                    unique=False, if_not_exists=True)
+    # 读取 / 删除策略时按 config_id 取网格行
+    op.create_index('ix_GridRow_config_id', 'GridRow', ['config_id'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_GridRow_config_id', table_name='GridRow', if_exists=True)
+    op.drop_index('ix_GridData_import_id_date', table_name='GridData', if_exists=True)
@@ -0,0 +1,33 @@
+"""Add content_hash to ImportedFiles
+
+Revision ID: c3e91f0b7a52
+Revises: 8d3f6a1c2e47
+Create Date: 2026-10-17 21:05:37.642190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e91f0b7a52'
+down_revision: Union[str, Sequence[str], None] = '8d3f6a1c2e47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 导入行情时按文件内容指纹去重：同样的文件再次导入直接跳过，更新过的文件只追加新的日期
+    op.add_column('ImportedFiles', sa.Column('content_hash', sa.String(length=64), nullable=True,
+                                             comment='最近一次导入 / 追加的文件内容 SHA-256'))
+    op.create_index('ix_ImportedFiles_content_hash', 'ImportedFiles', ['content_hash'], unique=False, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ImportedFiles_content_hash', table_name='ImportedFiles', if_exists=True)
+    with op.batch_alter_table('ImportedFiles', schema=None) as batch_op:
+        batch_op.drop_column('content_hash')
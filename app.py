@@ -1,4 +1,7 @@
+import multiprocessing
 from service.cli import run_cli
 if __name__ == "__main__":
+    # 打包成 exe 后，批量导入的解析子进程会重新启动本程序；freeze_support 让子进程直接执行任务而不是再进入主菜单
+    multiprocessing.freeze_support()
     print("网格交易神器")
-    run_cli()
\ No newline at end of file
+    run_cli()
@@ -0,0 +1,111 @@
+"""
+GridData 索引基准：在临时 SQLite 库中按批次（每批约十年日线）不断追加模拟行情，
+在不同数据量下分别测量 有 / 无 (import_id, date) 覆盖索引 时回测读取一批行情与按 config_id 读取网格行的耗时。
+不会读写 data/zombiegrid.db。
+
+用法: python benchmark_griddata_index.py [--rows 100000 1000000 3000000] [--days 2500]
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import create_engine, select, insert, bindparam, text
+from dao.grid_data_structure import Base, IndexData, ImportedFiles, GridConfig, GridRow
+
+ROWS_PER_CONFIG = 20
+N_QUERIES = 30
+
+
+def append_imports(engine, first_import_id: int, n_imports: int, days: int):
+    """追加 n_imports 批模拟行情（每批 days 个交易日）及同样数量的网格策略"""
+    rng = np.random.default_rng(first_import_id)
+    start = date(2010, 1, 4)
+    dates = [start + timedelta(days=i) for i in range(days)]
+    with engine.begin() as conn:
+        for import_id in range(first_import_id, first_import_id + n_imports):
+            conn.execute(insert(ImportedFiles), [{
+                "id": import_id, "file_name": f"bench_{import_id}.json", "index_code": f"{import_id:06d}",
+                "import_time": datetime.utcnow(), "record_count": days,
+            }])
+            close = 1000 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+            conn.execute(insert(IndexData), [{
+                "import_id": import_id, "date": d, "index_code": f"{import_id:06d}",
+                "index_chinese_full_name": "基准测试指数", "index_chinese_short_name": "基准",
+                "index_english_full_name": "Benchmark Index",
+                "open_price": c, "high_price": c * 1.01, "low_price": c * 0.99, "close_price": c,
+                "change": 0.0, "change_percent": 0.0, "volume_m_shares": 0.0, "turnover": 0.0, "cons_number": 50,
+            } for d, c in zip(dates, close.tolist())])
+            conn.execute(insert(GridConfig), [{
+                "id": import_id, "name": f"bench_{import_id}", "a": 0.1, "b": 0.1,
+                "first_trigger_price": 1000.0, "total_rows": ROWS_PER_CONFIG, "buy_amount": 1000.0,
+            }])
+            conn.execute(insert(GridRow), [{
+                "config_id": import_id, "fall_percent": 0.0, "level_ratio": 1.0, "buy_trigger_price": 1000.0 - k,
+                "buy_price": 1000.0 - k, "buy_amount": 1000.0, "shares": 1.0, "sell_trigger_price": 1100.0 - k,
+                "sell_price": 1100.0 - k, "yield_rate": 0.1, "profit_amount": 100.0,
+            } for k in range(ROWS_PER_CONFIG)])
+
+
+def median_latency_ms(engine, stmt, ids) -> float:
+    """对每个 id 执行一次查询，返回耗时中位数（毫秒）"""
+    timings = []
+    with engine.connect() as conn:
+        for key in ids:
+            t0 = time.perf_counter()
+            conn.execute(stmt, {"key": key}).all()
+            timings.append((time.perf_counter() - t0) * 1000)
+    return float(np.median(timings))
+
+
+def set_indexes(engine, enabled: bool):
+    """创建或删除模型上声明的索引（GridData / GridRow）"""
+    for table in (IndexData.__table__, GridRow.__table__):
+        for index in table.indexes:
+            if enabled:
+                index.create(engine, checkfirst=True)
+            else:
+                index.drop(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GridData / GridRow 索引查询耗时基准")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 3_000_000], help="GridData 目标行数（递增）")
+    parser.add_argument("--days", type=int, default=2500, help="每批行情的交易日数")
+    args = parser.parse_args()
+
+    ohlc_stmt = (select(IndexData.date, IndexData.open_price, IndexData.high_price, IndexData.low_price, IndexData.close_price)
+                 .where(IndexData.import_id == bindparam("key"))
+                 .order_by(IndexData.date))
+    rows_stmt = select(GridRow).where(GridRow.config_id == bindparam("key"))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        set_indexes(engine, enabled=False)
+        n_imports = 0
+        print(f"{'GridData 行数':>14} | {'批次数':>6} | {'行情 无索引':>10} | {'行情 有索引':>10} | {'网格行 无索引':>12} | {'网格行 有索引':>12}")
+        for target in sorted(args.rows):
+            need = max(0, -(-target // args.days) - n_imports)
+            if need:
+                t0 = time.perf_counter()
+                append_imports(engine, n_imports + 1, need, args.days)
+                n_imports += need
+                print(f"  (追加 {need} 批用时 {time.perf_counter() - t0:.1f}s)")
+            ids = [random.randint(1, n_imports) for _ in range(N_QUERIES)]
+            set_indexes(engine, enabled=False)
+            ohlc_plain, rows_plain = median_latency_ms(engine, ohlc_stmt, ids), median_latency_ms(engine, rows_stmt, ids)
+            set_indexes(engine, enabled=True)
+            ohlc_indexed, rows_indexed = median_latency_ms(engine, ohlc_stmt, ids), median_latency_ms(engine, rows_stmt, ids)
+            set_indexes(engine, enabled=False)  # 追加数据时不维护索引，加快造数
+            print(f"{n_imports * args.days:>14,} | {n_imports:>6} | {ohlc_plain:>8.2f}ms | {ohlc_indexed:>8.2f}ms | "
+                  f"{rows_plain:>10.2f}ms | {rows_indexed:>10.2f}ms")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
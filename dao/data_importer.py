@@ -1,12 +1,283 @@
 import os
 import pandas as pd
+import numpy as np
 import json
-from sqlalchemy import create_engine
+import csv
+import glob
+import time
+import hashlib
+import itertools
+import re
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, List, Dict, Any
+from openpyxl import load_workbook
+from sqlalchemy import (create_engine, insert, update, select, func, literal, literal_column, case, or_, and_, distinct,
+                        Table, MetaData, Column)
 from sqlalchemy.orm import sessionmaker
 from .config import SQLALCHEMY_DATABASE_URI
-from datetime import datetime
+from datetime import datetime, date
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-from .grid_data_structure import IndexData, Base,GridConfig,GridRow, ImportedFiles
+from .grid_data_structure import IndexData, GridConfig,GridRow, ImportedFiles
+from .ohlc_cache import write_ohlc_cache
+from .db_function_library import ensure_schema
+
+# 行情批量写入时每次 executemany 的行数
+INSERT_BATCH_SIZE = 5000
+# 暂存待比较的行情时不需要的 GridData 列（主键与批次号写入 GridData 时再定）
+STAGING_SKIP = ("id", "import_id")
+# 增量读取 JSON 文件时每次读入的字符数
+JSON_READ_SIZE = 1 << 20
+# 批量导入目录时识别为行情文件的扩展名
+MARKET_FILE_EXTENSIONS = (".xlsx", ".xlsm", ".xls", ".csv", ".json")
+# 数字后面还可能接续的字符：解码出的数字之后紧跟一串这样的字符直到缓冲区末尾时，数字可能被读取边界截断
+NUMBER_TAIL = re.compile(r'[0-9.eE+\-]*')
+
+
+def parse_market_date(value) -> date:
+    """行情日期转 date：支持 YYYYMMDD 整数 / 字符串（Excel、JSON 里的写法）、ISO 日期字符串和 Excel 日期单元格"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if text.replace('.', '', 1).isdigit():
+        text = str(int(float(text)))  # 20240910.0 之类的数值写法
+    if len(text) == 8 and text.isdigit():
+        return date(int(text[:4]), int(text[4:6]), int(text[6:]))  # 比 strptime 快得多，非法日期同样抛出 ValueError
+    return date.fromisoformat(text[:10])
+
+
+def iter_chunks(records: Iterable[dict], size: int) -> Iterator[List[dict]]:
+    """把逐条产出的记录按 size 条一组切分，只在内存中保留当前一组"""
+    iterator = iter(records)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_excel_records(excel_file_path) -> Iterator[dict]:
+    """openpyxl 只读模式逐行读取第一个工作表，首行为表头，逐条产出 {表头: 值}（整行为空的跳过）"""
+    workbook = load_workbook(excel_file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        # 有些导出工具写入的表格范围 (dimension) 不准确，只读模式会据此少读行列，这里改为按实际内容读取
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        keys = [str(key).strip() if key is not None else None for key in header]
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            yield {key: value for key, value in zip(keys, values) if key is not None}
+    finally:
+        workbook.close()
+
+
+def iter_csv_records(csv_file_path) -> Iterator[dict]:
+    """逐行读取 CSV（UTF-8，可带 BOM），首行为表头，空单元格视为 None"""
+    with open(csv_file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        for record in csv.DictReader(file):
+            yield {key.strip(): (value if value != '' else None) for key, value in record.items() if key is not None}
+
+
+def iter_json_records(json_file_path, read_size: int = JSON_READ_SIZE) -> Iterator[dict]:
+    """
+    增量读取 JSON 数组文件（[{...}, {...}, ...]），逐条产出数组元素，不把整个文件载入内存
+    每次读入 read_size 个字符，用 JSONDecoder.raw_decode 从缓冲区里依次解码完整的元素；
+    元素被读取边界截断时再读一段接着解码，缓冲区里只保留尚未解码的部分
+    """
+    decoder = json.JSONDecoder()
+    with open(json_file_path, 'r', encoding='utf-8-sig') as file:
+        buffer = ""
+        position = 0
+        eof = False
+        started = False
+        expect_value = True  # 下一个应是数组元素（或 ]），否则应是 , 或 ]
+        count = 0
+
+        def skip_whitespace():
+            nonlocal position
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+
+        while True:
+            skip_whitespace()
+            if position == len(buffer) and not eof:
+                # 缓冲区已用完，丢掉已解码的部分再读下一段
+                buffer, position = file.read(read_size), 0
+                eof = not buffer
+                continue
+            if position == len(buffer):
+                raise ValueError("JSON文件不完整：数组没有以 ] 结束" if started else "JSON文件为空")
+            char = buffer[position]
+            if not started:
+                if char != '[':
+                    raise ValueError("JSON文件的顶层不是数组")
+                started = True
+                position += 1
+                continue
+            if char == ']':
+                if expect_value and count:
+                    raise ValueError("JSON文件格式错误：数组末尾多了逗号")
+                # 数组结束后只允许空白（与 json.load 一致），读完剩余内容逐段检查
+                rest = buffer[position + 1:]
+                while True:
+                    if rest.strip():
+                        raise ValueError("JSON文件格式错误：数组结束后还有多余内容")
+                    rest = file.read(read_size)
+                    if not rest:
+                        return
+            if not expect_value:
+                if char != ',':
+                    raise ValueError(f"JSON文件格式错误：数组元素之间缺少逗号（{char!r}）")
+                expect_value = True
+                position += 1
+                continue
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+                # 元素停在缓冲区末尾，或数字后面直到末尾都是可接续的字符（如 "1." 解码成 1）时，可能还没读完
+                truncated = not eof and NUMBER_TAIL.match(buffer, end).end() == len(buffer)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                truncated = True
+            if truncated:
+                # 元素被截断在缓冲区末尾：保留未解码部分，追加下一段后重试
+                more = file.read(read_size)
+                buffer, position = buffer[position:] + more, 0
+                eof = not more
+                continue
+            position = end
+            expect_value = False
+            count += 1
+            yield record
+
+
+def iter_xls_records(excel_file_path) -> Iterator[dict]:
+    """旧版 .xls 只能经 pandas 整表读取（openpyxl 不支持），NaN 转为 None"""
+    df = pd.read_excel(excel_file_path)
+    for record in df.to_dict('records'):
+        yield {str(key).strip(): (None if pd.isna(value) else value) for key, value in record.items()}
+
+
+def iter_market_file_records(file_path) -> Iterator[dict]:
+    """按扩展名选择逐条读取行情文件的方式，不支持的格式抛出 ValueError"""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in (".xlsx", ".xlsm"):
+        return iter_excel_records(file_path)
+    if extension == ".xls":
+        return iter_xls_records(file_path)
+    if extension == ".csv":
+        return iter_csv_records(file_path)
+    if extension == ".json":
+        return iter_json_records(file_path)
+    raise ValueError(f"不支持的行情文件格式: {extension or file_path}（支持 .xlsx / .xls / .csv / .json）")
+
+def market_row(item: dict) -> dict:
+    """把一条行情记录（键为 Excel 表头，如 '日期Date'、'开盘Open'）转换为 IndexData 的一行（不含 import_id）"""
+    return {
+        "date": parse_market_date(item.get('日期Date')),
+        "index_code": item.get('指数代码Index Code') if item.get('指数代码Index Code') is not None else "Unknown",
+        "index_chinese_full_name": item.get('指数中文全称Index Chinese Name(Full)'),
+        "index_chinese_short_name": item.get('指数中文简称Index Chinese Name'),
+        "index_english_full_name": item.get('指数英文全称Index English Name(Full)'),
+        "open_price": float(item.get('开盘Open') or 0),
+        "high_price": float(item.get('最高High') or 0),
+        "low_price": float(item.get('最低Low') or 0),
+        "close_price": float(item.get('收盘Close') or 0),
+        "change": float(item.get('涨跌Change') or 0),
+        "change_percent": float(item.get('涨跌幅(%)Change(%)') or 0),
+        "volume_m_shares": float(item.get('成交量（万手）Volume(M Shares)') or 0),
+        "turnover": float(item.get('成交金额（亿元）Turnover') or 0),
+        "cons_number": int(float(item.get('样本数量ConsNumber') or 0)),
+    }
+
+
+def file_content_hash(file_path, block_size: int = JSON_READ_SIZE) -> str:
+    """文件内容指纹：按块读取计算 SHA-256，与文件名、修改时间无关"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe_written(written: Dict[str, Any], source: str) -> str:
+    """DataImporter._write_market_rows() 结果的提示信息"""
+    if written["status"] == "new":
+        return f"成功从{source}导入 {written['record_count']} 条记录到GridData表（Import ID {written['import_id']}）"
+    if written["status"] == "appended":
+        return (f"{source}与 Import ID {written['import_id']} 的重叠日期完全一致：追加 {written['record_count']} 条新日期的记录，"
+                f"跳过 {written['skipped']} 条已有日期")
+    if written["status"] == "conflict":
+        return (f"⚠️ {source}与 Import ID {written['base_import_id']} 有 {written['conflicts']} 个日期的开高低收不一致（历史数据被修订过），"
+                f"已单独导入为新批次 Import ID {written['import_id']}（{written['record_count']} 条），请核对后选用")
+    return f"{source}没有新的数据（Import ID {written['import_id']} 已包含这些内容），跳过导入"
+
+
+def find_market_files(path_or_pattern: str) -> List[str]:
+    """目录：其中（不含子目录）所有行情文件；否则按 glob 通配符匹配。跳过 Excel 打开时生成的 ~$ 临时文件"""
+    if os.path.isdir(path_or_pattern):
+        candidates = [os.path.join(path_or_pattern, name) for name in os.listdir(path_or_pattern)]
+    else:
+        candidates = glob.glob(path_or_pattern)
+    return sorted(path for path in candidates
+                  if os.path.isfile(path)
+                  and os.path.splitext(path)[1].lower() in MARKET_FILE_EXTENSIONS
+                  and not os.path.basename(path).startswith("~$"))
+
+
+def parse_market_file(file_path: str) -> Dict[str, Any]:
+    """
+    读取并转换一整份行情文件（批量导入时在子进程中执行，不访问数据库）
+    返回 {"file_path", "content_hash", "index_code": 首条记录的指数代码, "rows": IndexData 行列表, "parse_seconds",
+          "error": 出错时的错误信息}
+    """
+    start = time.perf_counter()
+    parsed = {"file_path": file_path, "content_hash": None, "index_code": None, "rows": [], "error": None}
+    try:
+        parsed["content_hash"] = file_content_hash(file_path)
+        for item in iter_market_file_records(file_path):
+            if not parsed["rows"]:
+                parsed["index_code"] = item.get('指数代码Index Code')
+            parsed["rows"].append(market_row(item))
+        if not parsed["rows"]:
+            parsed["error"] = "文件为空或格式不正确"
+    except Exception as e:
+        parsed["rows"] = []
+        parsed["error"] = str(e)
+    parsed["parse_seconds"] = time.perf_counter() - start
+    return parsed
+
+
+def iter_parsed_market_files(file_paths: List[str], workers: int) -> Iterator[Dict[str, Any]]:
+    """
+    用 workers 个进程并行解析，按 file_paths 的顺序逐个产出 parse_market_file() 的结果（写库顺序固定，
+    同一目录重复导入得到同样的批次）；workers 为 1 时在本进程依次解析。
+    解析进程异常退出（进程池损坏）时，尚未取得结果的文件各自作为解析失败产出，不中断整个批量导入
+    """
+    if workers <= 1:
+        for file_path in file_paths:
+            yield parse_market_file(file_path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(parse_market_file, file_path) for file_path in file_paths]
+        for index, file_path in enumerate(file_paths):
+            try:
+                parsed = futures[index].result()
+            except BrokenProcessPool as e:
+                parsed = {"file_path": file_path, "content_hash": None, "index_code": None, "rows": [],
+                          "parse_seconds": 0.0, "error": f"解析进程异常退出: {e}"}
+            # 产出后即释放该 future 的引用，已写入数据库的文件内容随之回收
+            futures[index] = None
+            yield parsed
+
 
 class DataImporter:
     """
@@ -20,140 +291,342 @@ class DataImporter:
         """
         self.engine = create_engine(SQLALCHEMY_DATABASE_URI)
 
-        # 使用您在GridDataStructure.py中定义的表结构
-        Base.metadata.create_all(self.engine)
+        # 使用您在GridDataStructure.py中定义的表结构（旧库缺少的表 / 列 / 索引一并补齐）
+        ensure_schema(self.engine)
         self.Session = sessionmaker(bind=self.engine)
         self.session = self.Session()
-    def import_market_data_from_json(self, json_file_path, file_name=None):
+    @contextmanager
+    def _bulk_connection(self):
         """
-        直接从JSON文件导入数据到GridData表
-        导入时应先在ImportedFiles表中创建本次导入的记录，然后将import_id关联到GridData表中
-        :param json_file_path: JSON文件路径
+        批量写入用的连接：期间 PRAGMA synchronous = OFF，提交时不再逐次 fsync；回滚日志仍写在磁盘上，
+        程序中途崩溃不会损坏数据库（只有操作系统崩溃 / 断电才有风险），结束后恢复为默认的 FULL
+        """
+        with self.engine.connect() as connection:
+            is_sqlite = connection.dialect.name == "sqlite"
+            if is_sqlite:
+                connection.exec_driver_sql("PRAGMA synchronous = OFF")
+                connection.exec_driver_sql("PRAGMA cache_size = -65536")  # 64MB 页缓存
+                connection.commit()  # 结束执行 PRAGMA 时自动开始的事务，之后才能显式 begin()
+            try:
+                yield connection
+            finally:
+                if is_sqlite:
+                    connection.exec_driver_sql("PRAGMA synchronous = FULL")
+                    connection.exec_driver_sql("PRAGMA cache_size = -2000")
+                    connection.commit()
+
+    @contextmanager
+    def _bulk_transaction(self):
+        """批量写入用的连接与事务：整个导入在一个事务里提交（失败整体回滚）"""
+        with self._bulk_connection() as connection:
+            with connection.begin():
+                yield connection
+
+    def _write_market_rows(self, connection, row_chunks: Iterable[List[dict]], index_code, file_name,
+                           content_hash: str = None) -> Dict[str, Any]:
+        """
+        在 connection 当前事务中写入一份行情文件的内容（按内容指纹与日期去重）：
+        - 已有批次的 content_hash 与本文件相同：文件已导入过，什么都不写（status = "unchanged"）
+        - 否则先把整份文件逐块写入临时表，按文件的全部日期与同一指数的已有批次比较，取重叠日期最多的批次为基准（重叠数相同取最近导入的），
+          逐日比较开高低收：
+          - 没有重叠：新建批次（status = "new"）
+          - 重叠日期的价格有不一致（数据商修订过历史K线）：不改动基准批次，本文件单独新建批次（status = "conflict"）
+          - 完全一致：只把基准批次没有的日期追加进去，回填 record_count / date_range 并更新导入时间（status = "appended"）；
+            没有新日期时什么都不写（status = "unchanged"）
+        追加只会延长该批次的历史：新的导入时间使旧的列式缓存失效，之前保存的回测状态仍可按K线摘要核对后续算
+        写入后把该批次的 日期 / 开高低收 读回为列式行情缓存所需的数组
+        返回 {"status", "import_id", "base_import_id": 比较的基准批次, "record_count": 本次写入的行数,
+              "skipped": 跳过的已有日期行数, "conflicts": 价格不一致的日期数, "ohlc", "token"}，
+        status 不是 "unchanged" 时，提交后用 write_ohlc_cache(ohlc, token) 写缓存
         """
-        imported_file_record = None
+        import_time = datetime.utcnow()
+        written = {"status": "unchanged", "import_id": None, "base_import_id": None, "record_count": 0, "skipped": 0,
+                   "conflicts": 0, "ohlc": None, "token": None}
+        if content_hash is not None:
+            written["import_id"] = connection.execute(
+                select(ImportedFiles.id).where(ImportedFiles.content_hash == content_hash)
+                .order_by(ImportedFiles.id.desc()).limit(1)).scalar()
+            if written["import_id"] is not None:
+                return written
 
+        staging = Table("market_staging", MetaData(),
+                        *[Column(column.name, column.type) for column in IndexData.__table__.columns if column.name not in STAGING_SKIP],
+                        prefixes=["TEMPORARY"])
+        staging.create(connection)
         try:
-            # 读取JSON文件，创建导入记录
-            with open(json_file_path, 'r', encoding='utf-8') as file:
-                data = json.load(file)
+            staged = 0
+            for rows in row_chunks:
+                if rows:
+                    connection.execute(insert(staging), rows)
+                    staged += len(rows)
+
+            base = self._find_overlapping_batch(connection, index_code, staging)
+            if base is not None and not base[2]:
+                base_id = base[0]
+                written["import_id"] = base_id
+                written["base_import_id"] = base_id
+                # 文件内重复的日期只取第一条
+                fresh = and_(staging.c.date.not_in(select(IndexData.date).where(IndexData.import_id == base_id)),
+                             literal_column("rowid").in_(select(func.min(literal_column("rowid"))).select_from(staging)
+                                                         .group_by(staging.c.date)))
+                record_count = self._copy_staged_rows(connection, staging, base_id, fresh)
+                written["record_count"] = record_count
+                written["skipped"] = staged - record_count
+                if record_count == 0:
+                    return written
+                written["status"] = "appended"
+                write_id = base_id
+                total, min_date, max_date = connection.execute(
+                    select(func.count(), func.min(IndexData.date), func.max(IndexData.date))
+                    .where(IndexData.import_id == base_id)).one()
+                connection.execute(update(ImportedFiles).where(ImportedFiles.id == base_id).values(
+                    import_time=import_time,
+                    content_hash=content_hash,
+                    record_count=total,
+                    date_range=f"{min_date.strftime('%Y-%m-%d')} ~ {max_date.strftime('%Y-%m-%d')}",
+                ))
+            else:
+                write_id = self._insert_imported_file(connection, file_name, index_code, import_time, content_hash)
+                total = self._copy_staged_rows(connection, staging, write_id)
+                min_date, max_date = connection.execute(select(func.min(staging.c.date), func.max(staging.c.date))).one()
+                connection.execute(update(ImportedFiles).where(ImportedFiles.id == write_id).values(
+                    record_count=total,
+                    date_range=f"{min_date.strftime('%Y-%m-%d')} ~ {max_date.strftime('%Y-%m-%d')}" if total else None,
+                ))
+                written.update(import_id=write_id, record_count=total, status="new")
+                if base is not None:
+                    written.update(status="conflict", base_import_id=base[0], conflicts=base[2])
+        finally:
+            staging.drop(connection)
+
+        written["ohlc"] = self._read_back_ohlc(connection, write_id, total)
+        written["token"] = str(import_time)
+        return written
+
+    @staticmethod
+    def _copy_staged_rows(connection, staging, import_id: int, where=None) -> int:
+        """把临时表中的行（可按 where 过滤）按原顺序写入 GridData 的 import_id 批次，返回写入的行数"""
+        names = [column.name for column in staging.columns]
+        rows = select(literal(import_id), *staging.columns).order_by(literal_column("rowid"))
+        if where is not None:
+            rows = rows.where(where)
+        return connection.execute(insert(IndexData).from_select(["import_id"] + names, rows)).rowcount
+
+    @staticmethod
+    def _find_overlapping_batch(connection, index_code, staging):
+        """
+        同一指数的已有批次中，与临时表里整份文件日期重叠最多的一个（重叠数相同取最近导入的），
+        返回 (基准批次, 重叠日期数, 其中开高低收不一致的日期数)，没有重叠时返回 None
+        """
+        if index_code is None:
+            return None
+        batch_ids = select(ImportedFiles.id).where(ImportedFiles.index_code == str(index_code))
+        differs = or_(*(IndexData.__table__.c[name].is_distinct_from(staging.c[name])
+                        for name in ("open_price", "high_price", "low_price", "close_price")))
+        overlaps = connection.execute(
+            select(IndexData.import_id, func.count(distinct(staging.c.date)),
+                   func.count(distinct(case((differs, staging.c.date)))))
+            .select_from(staging.join(IndexData.__table__, IndexData.date == staging.c.date))
+            .where(IndexData.import_id.in_(batch_ids))
+            .group_by(IndexData.import_id)).all()
+        if not overlaps:
+            return None
+        base_id, overlap, conflicts = max(overlaps, key=lambda row: (row[1], row[0]))
+        return base_id, overlap, conflicts
+
+    @staticmethod
+    def _insert_imported_file(connection, file_name, index_code, import_time, content_hash) -> int:
+        """新建一条 ImportedFiles 记录（记录数与日期范围写完后回填），返回 import_id"""
+        return connection.execute(insert(ImportedFiles).values(
+            file_name=file_name,
+            index_code=index_code, # index_code 是xlsx里写的指数代码
+            import_time=import_time,
+            record_count=0,
+            content_hash=content_hash,
+        )).inserted_primary_key[0]
 
-            if not data:
-                print("JSON文件为空或格式不正确")
+    @staticmethod
+    def _read_back_ohlc(connection, import_id: int, record_count: int) -> Dict[str, Any]:
+        """回测只用 日期 / 开高低收 五列，从刚写入的数据按日期分批读回到预先分配的数组（走 (import_id, date) 覆盖索引）"""
+        ohlc = {"import_id": import_id, "date": np.empty(record_count, dtype="datetime64[D]")}
+        for column in ("open", "high", "low", "close"):
+            ohlc[column] = np.empty(record_count, dtype=np.float64)
+        result = connection.execution_options(yield_per=INSERT_BATCH_SIZE).execute(
+            select(IndexData.date, IndexData.open_price, IndexData.high_price, IndexData.low_price, IndexData.close_price)
+            .where(IndexData.import_id == import_id)
+            .order_by(IndexData.date))
+        position = 0
+        for partition in result.partitions():
+            stop = position + len(partition)
+            dates, open_p, high_p, low_p, close_p = zip(*partition)
+            ohlc["date"][position:stop] = dates
+            ohlc["open"][position:stop] = open_p
+            ohlc["high"][position:stop] = high_p
+            ohlc["low"][position:stop] = low_p
+            ohlc["close"][position:stop] = close_p
+            position = stop
+        return ohlc
+
+    def import_market_records(self, records: Iterable[dict], file_name=None, source="JSON文件",
+                              content_hash: str = None) -> bool:
+        """
+        流式导入行情记录：records 为逐条产出 {表头: 值} 的可迭代对象，每 INSERT_BATCH_SIZE 条转换并写入一次，
+        内存中只保留当前一批；ImportedFiles 记录先写入，记录数与日期范围边读边统计，最后回填
+        内容指纹与已导入文件相同时直接跳过；与同一指数已有批次重叠且价格一致时只追加该批次没有的日期，价格不一致时单独成批并提示（见 _write_market_rows）
+        整个导入一个事务，任何一条记录出错都整体回滚
+        :param source: 提示信息里的数据来源描述
+        :param content_hash: 文件内容指纹（file_content_hash()），None 时不按指纹去重
+        """
+        try:
+            chunks = iter_chunks(records, INSERT_BATCH_SIZE)
+            first_chunk = next(chunks, None)
+            if not first_chunk:
+                print(f"{source}为空或格式不正确")
                 return False
-            
-            records = []
-            min_date, max_date = None, None
-            first_record = data[0]
-            index_code_from_data = first_record.get('指数代码Index Code') # index_code 是xlsx里写的指数代码
-            
-            
-            imported_file_record = ImportedFiles(
-                file_name=file_name,
-                index_code = index_code_from_data,
-                import_time=datetime.utcnow(),
-                record_count=len(data)
-            )
-            self.session.add(imported_file_record)
-            self.session.flush()  # 获取自动生成的ID
-            new_import_id = imported_file_record.id
-
-            # 准备GridData记录并关联import_id
-
-            for item in data:
-                # --- 开始修改 ---
-                # 1. 获取日期整数
-                date_int = item.get('日期Date')
-
-                # 2. 将整数转换为datetime对象，再提取date部分
-                date_obj = datetime.strptime(str(date_int), '%Y%m%d').date()
-
-                if min_date is None or date_obj < min_date:
-                    min_date = date_obj
-                if max_date is None or date_obj > max_date:
-                    max_date = date_obj
-
-                
-
-                index_data = IndexData(
-                    import_id=new_import_id,
-                    date=date_obj, # <--- 使用转换后的日期对象
-                    # --- 结束修改 ---
-                    index_code=item.get('指数代码Index Code') if item.get('指数代码Index Code') is not None else "Unknown",
-                    index_chinese_full_name=item.get('指数中文全称Index Chinese Name(Full)'),
-                    index_chinese_short_name=item.get('指数中文简称Index Chinese Name'),
-                    index_english_full_name=item.get('指数英文全称Index English Name(Full)'),
-                    # index_english_short_name=item.get('指数英文简称Index English Name'),
-                    open_price=float(item.get('开盘Open') or 0),
-                    high_price=float( item.get('最高High') or 0),
-                    low_price=float(item.get('最低Low') or 0),
-                    close_price=float(item.get('收盘Close') or 0),
-                    change=float( item.get('涨跌Change') or 0),
-                    change_percent=float(item.get('涨跌幅(%)Change(%)') or 0),
-                    volume_m_shares=float(  item.get('成交量（万手）Volume(M Shares)') or 0),
-                    turnover=float(item.get('成交金额（亿元）Turnover') or 0),
-                    cons_number=int(item.get('样本数量ConsNumber') or 0)
-                )
-                records.append(index_data)
-
-            # 更新导入记录的日期范围
-            if min_date and max_date:
-                imported_file_record.date_range = f"{min_date.strftime('%Y-%m-%d')} ~ {max_date.strftime('%Y-%m-%d')}"
-                self.session.commit()  # 提交以保存导入记录的更新
-            
-            # 批量插入数据
-            self.session.add_all(records)
-            self.session.commit()
-            print(f"成功从JSON文件导入 {len(records)} 条记录到GridData表")
+
+            row_chunks = ([market_row(item) for item in chunk] for chunk in itertools.chain([first_chunk], chunks))
+            with self._bulk_transaction() as connection:
+                written = self._write_market_rows(connection, row_chunks, first_chunk[0].get('指数代码Index Code'),
+                                                  file_name, content_hash)
+            print(describe_written(written, source))
+
+            # 同时写一份列式行情缓存，之后回测直接内存映射读取，不再查询数据库
+            if written["status"] != "unchanged":
+                write_ohlc_cache(written["ohlc"], written["token"])
             return True
-            
+
         except Exception as e:
-            self.session.rollback()
+            print(f"从{source}导入数据时出错: {e}")
+            return False
+
+    def import_market_data_from_json(self, json_file_path, file_name=None):
+        """
+        直接从JSON文件导入数据到GridData表
+        导入时应先在ImportedFiles表中创建本次导入的记录，然后将import_id关联到GridData表中
+        JSON 数组逐条增量解析、按批写入（见 iter_json_records），多 GB 的文件也只占用一批记录的内存
+        :param json_file_path: JSON文件路径
+        """
+        try:
+            content_hash = file_content_hash(json_file_path)
+        except OSError as e:
             print(f"从JSON文件导入数据时出错: {e}")
             return False
-        
-    def import_grid_model(self, result: dict) -> bool:  
+        return self.import_market_records(iter_json_records(json_file_path), file_name, source="JSON文件",
+                                          content_hash=content_hash)
+
+    def import_market_data_from_file(self, file_path, file_name=None):
+        """
+        直接从 Excel (.xlsx / .xls)、CSV 或 JSON 文件导入行情，不再先转换成临时 JSON 文件
+        .xlsx 用 openpyxl 只读模式、.csv 用 csv 模块、.json 增量解析，边读边按批写入，峰值内存只与批大小有关
+        :param file_path: 行情文件路径（Excel / CSV 第一行为表头）
+        :param file_name: 记录在 ImportedFiles 中的文件名，默认取 file_path 的文件名
+        """
+        if file_name is None:
+            file_name = os.path.basename(file_path)
+        extension = os.path.splitext(file_path)[1].lower()
+        try:
+            records = iter_market_file_records(file_path)
+            content_hash = file_content_hash(file_path)
+        except (ValueError, OSError) as e:
+            print(e)
+            return False
+        source = {".csv": "CSV文件", ".json": "JSON文件"}.get(extension, "Excel文件")
+        return self.import_market_records(records, file_name, source=source, content_hash=content_hash)
+
+    def import_market_directory(self, path_or_pattern: str, workers: int = None) -> List[Dict[str, Any]]:
+        """
+        批量导入一个目录（或 glob 通配符）下的所有行情文件
+        解析（最慢的一步）在进程池中并行，默认使用全部 CPU 核；数据库写入只在本进程中按文件名顺序进行：
+        同一个批量写入连接，每个文件一个事务，某个文件出错只回滚该文件；去重规则同单个文件导入
+        返回每个文件一项的报告：{"file_name", "status": new / appended / conflict / unchanged, "import_id", "base_import_id",
+        "conflicts", "record_count": 解析出的记录数, "written_count": 实际写入的行数, "parse_seconds", "write_seconds", "error"}
+        """
+        file_paths = find_market_files(path_or_pattern)
+        if not file_paths:
+            print(f"没有找到行情文件: {path_or_pattern}")
+            return []
+        workers = max(1, min(workers or os.cpu_count() or 1, len(file_paths)))
+        print(f"共 {len(file_paths)} 个文件，使用 {workers} 个进程解析")
+
+        report = []
+        with self._bulk_connection() as connection:
+            for parsed in iter_parsed_market_files(file_paths, workers):
+                entry = {
+                    "file_name": os.path.basename(parsed["file_path"]),
+                    "status": None,
+                    "import_id": None,
+                    "base_import_id": None,
+                    "conflicts": 0,
+                    "record_count": len(parsed["rows"]),
+                    "written_count": 0,
+                    "parse_seconds": parsed["parse_seconds"],
+                    "write_seconds": 0.0,
+                    "error": parsed["error"],
+                }
+                if entry["error"] is None:
+                    start = time.perf_counter()
+                    try:
+                        with connection.begin():
+                            written = self._write_market_rows(connection, iter_chunks(parsed["rows"], INSERT_BATCH_SIZE),
+                                                              parsed["index_code"], entry["file_name"], parsed["content_hash"])
+                        entry["status"] = written["status"]
+                        entry["import_id"] = written["import_id"]
+                        entry["base_import_id"] = written["base_import_id"]
+                        entry["conflicts"] = written["conflicts"]
+                        entry["written_count"] = written["record_count"]
+                        if written["status"] != "unchanged":
+                            write_ohlc_cache(written["ohlc"], written["token"])
+                    except Exception as e:
+                        entry["error"] = str(e)
+                    entry["write_seconds"] = time.perf_counter() - start
+
+                report.append(entry)
+                if entry["error"] is None:
+                    print(f"[{len(report)}/{len(file_paths)}] {entry['file_name']}: 解析 {entry['parse_seconds']:.2f}s，"
+                          f"写入 {entry['write_seconds']:.2f}s，{describe_written(written, '文件')}")
+                else:
+                    print(f"[{len(report)}/{len(file_paths)}] {entry['file_name']}: 导入失败 - {entry['error']}")
+        return report
+
+    def import_grid_model(self, result: dict) -> bool:
+        """保存网格策略：GridConfig 一行 + GridRow 按批 executemany，一个事务提交"""
         try:
-            # Step 1: 创建 GridConfig 实例
             config_data = result["config"]
-            grid_config = GridConfig(
-            name=config_data.get("name"),
-            a=config_data["a"],
-            b=config_data["b"],
-            first_trigger_price=config_data["first_trigger_price"],
-            total_rows=config_data["total_rows"],
-            buy_amount=config_data["buy_amount"]
-        )
-
-            # Step 2: 创建 GridRow 实例列表
-            grid_rows = []
-            for row_data in result["rows"]:
-                row = GridRow(
-                fall_percent=row_data["fall_percent"],
-                level_ratio=row_data["level_ratio"],
-                buy_trigger_price=row_data["buy_trigger_price"],
-                buy_price=row_data["buy_price"],
-                buy_amount=row_data["buy_amount"],
-                shares=row_data["shares"],
-                sell_trigger_price=row_data["sell_trigger_price"],
-                sell_price=row_data["sell_price"],
-                yield_rate=row_data["yield_rate"],
-                profit_amount=row_data["profit_amount"]
-            )
-                grid_rows.append(row)
-
-            # Step 3: 关联并保存
-            grid_config.rows = grid_rows
-            self.session.add(grid_config)
-            self.session.commit()
-
-            print(f"网格配置已保存, ID: {grid_config.id}，共 {len(grid_config.rows)} 行")
+            with self._bulk_transaction() as connection:
+                # Step 1: 写入 GridConfig，取得自增 ID
+                config_id = connection.execute(insert(GridConfig).values(
+                    name=config_data.get("name"),
+                    a=config_data["a"],
+                    b=config_data["b"],
+                    first_trigger_price=config_data["first_trigger_price"],
+                    total_rows=config_data["total_rows"],
+                    buy_amount=config_data["buy_amount"],
+                )).inserted_primary_key[0]
+
+                # Step 2: 批量写入 GridRow
+                grid_rows = [{
+                    "config_id": config_id,
+                    "fall_percent": row_data["fall_percent"],
+                    "level_ratio": row_data["level_ratio"],
+                    "buy_trigger_price": row_data["buy_trigger_price"],
+                    "buy_price": row_data["buy_price"],
+                    "buy_amount": row_data["buy_amount"],
+                    "shares": row_data["shares"],
+                    "sell_trigger_price": row_data["sell_trigger_price"],
+                    "sell_price": row_data["sell_price"],
+                    "yield_rate": row_data["yield_rate"],
+                    "profit_amount": row_data["profit_amount"],
+                } for row_data in result["rows"]]
+                if grid_rows:
+                    connection.execute(insert(GridRow), grid_rows)
+
+            print(f"网格配置已保存, ID: {config_id}，共 {len(grid_rows)} 行")
             return True
 
         except Exception as e:
-            self.session.rollback()
             print(f"导入网格模型时出错: {e}")
             return False
-   
+
     def close(self):
         """
         关闭数据库会话
@@ -170,9 +643,9 @@ if __name__ == "__main__":
     # 创建导入器实例
     importer = DataImporter(SQLALCHEMY_DATABASE_URI)
     
-    # # 从JSON文件导入数据
-    json_file_path = "data/database_folder/399971perf.json"
-    importer.import_market_data_from_json(json_file_path)
+    # 从Excel文件直接导入数据（逐行读取，不经过中间JSON文件）
+    excel_file_path = "data/database_folder/399971perf.xlsx"
+    importer.import_market_data_from_file(excel_file_path)
     
     
 
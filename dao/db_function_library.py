@@ -1,25 +1,75 @@
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, select, inspect, text
 from dao import config
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import OperationalError
 from dao.config import SQLALCHEMY_DATABASE_URI
 from sqlalchemy.orm import sessionmaker
-from dao.grid_data_structure import IndexData, GridConfig, GridRow, Base, ImportedFiles
-from typing import List
+from dao.grid_data_structure import IndexData, GridConfig, GridRow, Base, ImportedFiles, BacktestState
+from typing import List, Dict, Any, Optional
+import pickle
+import numpy as np
+from dao.ohlc_cache import read_ohlc_cache, write_ohlc_cache, invalidate_ohlc_cache
+
+# 与 alembic/versions 中最新的迁移一致；ensure_schema 补齐旧库的结构后，把 alembic_version 标记为这个版本
+SCHEMA_REVISION = 'c3e91f0b7a52'
+_schema_checked = set()
+
+
+def ensure_schema(engine):
+    """
+    补齐旧数据库缺少的表 / 列 / 索引，保证之后的 ORM 查询可用（打包后的 exe 没法运行 alembic upgrade）：
+    缺少的表用 create_all 建立，已有表缺少的列用 ALTER TABLE ADD COLUMN 补上，模型中声明但库里没有的索引直接创建。
+    有改动且库中有 alembic_version 表时标记为 SCHEMA_REVISION，之后再运行 alembic upgrade head 不会重复执行这些迁移。
+    同一进程内每个数据库只检查一次
+    """
+    url = str(engine.url)
+    if url in _schema_checked:
+        return
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changed = False
+    with engine.begin() as connection:
+        missing_tables = [table for table in Base.metadata.sorted_tables if table.name not in existing_tables]
+        if missing_tables:
+            Base.metadata.create_all(connection, tables=missing_tables)
+            changed = True
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+                    changed = True
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    changed = True
+        if changed and "alembic_version" in existing_tables:
+            connection.execute(text("UPDATE alembic_version SET version_num = :revision"), {"revision": SCHEMA_REVISION})
+    if changed and existing_tables:
+        print("已将数据库结构升级到最新版本")
+    _schema_checked.add(url)
+
 
 def init_db():
     engine = create_engine(config.SQLALCHEMY_DATABASE_URI)
     try:
         with engine.connect() as connection:
             print("数据库连接成功")
-            return True
+        # 旧版本的数据库缺少新加的表 / 列时先补齐，否则之后的查询会直接报错
+        ensure_schema(engine)
+        return True
     except OperationalError:
         print("数据库连接失败，请检查配置(在config.py中,检查MySQL的用户名，密码，端口，数据库名等)")
         return None
 class DBSessionManager:
     def __init__(self):
         self.engine = create_engine(SQLALCHEMY_DATABASE_URI)
+        ensure_schema(self.engine)
         self.SessionLocal = sessionmaker(bind=self.engine)
         self.session = self.SessionLocal()
 
@@ -36,7 +86,8 @@ class DBSessionManager:
             'GridData': IndexData,
             'GridConfig': GridConfig,
             'GridRow': GridRow,
-            'ImportedFiles': ImportedFiles
+            'ImportedFiles': ImportedFiles,
+            'BacktestState': BacktestState
         }
         return table_map.get(table_name)
 
@@ -108,6 +159,42 @@ class DBSessionManager:
         records = self.session.query(ImportedFiles).all()
         return records
     
+    def load_ohlc(self, import_id: int, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        按日期顺序读取某数据批次的行情，只取回测用到的 日期 / 开高低收 五列
+        优先内存映射 data/cache/<import_id>/ 下的列式缓存（按导入时间校验）；未命中时执行一条 Core SELECT
+        （不构造 IndexData 对象、不经过 to_dict()），并顺带写入缓存
+        返回 {"import_id", "date": 日期列表, "open" / "high" / "low" / "close": 连续的 float64 数组}，出错时返回 None
+        """
+        stmt = (select(IndexData.date, IndexData.open_price, IndexData.high_price, IndexData.low_price, IndexData.close_price)
+                .where(IndexData.import_id == import_id)
+                .order_by(IndexData.date))
+        try:
+            with self.engine.connect() as connection:
+                import_time = connection.execute(
+                    select(ImportedFiles.import_time).where(ImportedFiles.id == import_id)).scalar()
+                token = str(import_time) if import_time is not None else None
+                if use_cache and token is not None:
+                    cached = read_ohlc_cache(import_id, token)
+                    if cached is not None:
+                        return cached
+                rows = connection.execute(stmt).all()
+        except Exception as e:
+            print(f"加载 Import ID {import_id} 的行情数据时出错: {e}")
+            return None
+        dates, open_p, high_p, low_p, close_p = zip(*rows) if rows else ((), (), (), (), ())
+        ohlc = {
+            "import_id": import_id,
+            "date": list(dates),
+            "open": np.array(open_p, dtype=np.float64),
+            "high": np.array(high_p, dtype=np.float64),
+            "low": np.array(low_p, dtype=np.float64),
+            "close": np.array(close_p, dtype=np.float64),
+        }
+        if use_cache and token is not None and rows:
+            write_ohlc_cache(ohlc, token)
+        return ohlc
+
     def delete_import_batch(self, import_id: int) -> bool:
         """根据 import_id 删除 ImportedFiles 记录及关联的 GridData 记录"""
         if not import_id:
@@ -125,6 +212,7 @@ class DBSessionManager:
             # 直接删除 ImportedFiles 记录，依赖外键的 ON DELETE CASCADE 自动删除 GridData
             self.session.delete(imported_file_record)
             self.session.commit()
+            invalidate_ohlc_cache(import_id)
             print("删除成功。")
             return True
         except Exception as e:
@@ -155,6 +243,49 @@ class DBSessionManager:
             print(f"❌ 删除 GridConfig ID {config_id} 的数据时出错: {e}")
             return False
     
+    def save_backtest_state(self, import_id: int, config_id: int, state: Dict[str, Any]) -> bool:
+        """
+        保存（覆盖）某数据批次 + 策略 + 初始资金 的回测状态，state 为 BackTest.get_state() 的结果
+        须在 finalize() 之前保存（或使用 finalize(keep_state=True)），保证状态未被清仓
+        """
+        pending = state.get("pending_bar")
+        if pending is None:
+            print("错误：回测状态中没有未清仓的K线，无法保存")
+            return False
+        try:
+            record = self.session.query(BacktestState).filter_by(
+                import_id=import_id, config_id=config_id, initial_capital=state["initial_capital"]).first()
+            if record is None:
+                record = BacktestState(import_id=import_id, config_id=config_id, initial_capital=state["initial_capital"])
+                self.session.add(record)
+            record.last_date = pending["date"]
+            record.bar_count = state["bar_index"] + 1
+            record.state = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+            self.session.commit()
+            return True
+        except Exception as e:
+            self.session.rollback()
+            print(f"保存回测状态时出错: {e}")
+            return False
+
+    def get_backtest_states(self, index_code: str, config_id: int, initial_capital: float) -> List[Dict[str, Any]]:
+        """
+        查询同一指数、同一策略、同一初始资金下保存过的回测状态（已反序列化），按 last_date 从新到旧排列
+        由调用方用 BackTest.resume() 判断能否在新数据上续算
+        """
+        try:
+            records = (self.session.query(BacktestState)
+                       .join(ImportedFiles, BacktestState.import_id == ImportedFiles.id)
+                       .filter(ImportedFiles.index_code == index_code,
+                               BacktestState.config_id == config_id,
+                               BacktestState.initial_capital == initial_capital)
+                       .order_by(BacktestState.last_date.desc())
+                       .all())
+            return [pickle.loads(record.state) for record in records]
+        except Exception as e:
+            print(f"查询回测状态时出错: {e}")
+            return []
+
     def close(self): # 确保有 close 方法
         """关闭数据库会话"""
         if self.session:
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date,ForeignKey,DateTime
+from sqlalchemy import Column, Integer, String, Float, Date,ForeignKey,DateTime,LargeBinary,Index
 from sqlalchemy.orm import relationship,declarative_base
 from datetime import datetime
 
@@ -19,6 +19,10 @@ class BaseModel:
 class ImportedFiles(Base, BaseModel):
     """ 导入的原始xlsx的信息，每一次导入都有一个主键id """
     __tablename__ = 'ImportedFiles'
+    # 导入时按内容指纹查找已导入过的文件
+    __table_args__ = (
+        Index('ix_ImportedFiles_content_hash', 'content_hash'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True, comment='单次导入的股价数据xlsx的主键ID')
     file_name = Column(String(255), nullable=True, comment='股价xlsx的文件名')
@@ -26,6 +30,7 @@ class ImportedFiles(Base, BaseModel):
     import_time = Column(DateTime, default=datetime.utcnow, comment='导入的时间')
     record_count = Column(Integer, nullable=True, comment='此次导入的记录数')
     date_range = Column(String(50), nullable=True, comment='数据日期范围("YYYY-MM-DD ~ YYYY-MM-DD")')
+    content_hash = Column(String(64), nullable=True, comment='最近一次导入 / 追加的文件内容 SHA-256')
 
     def __repr__(self):
         return f"<ImportedFiles(id={self.id}, file_name='{self.file_name}',index_code='{self.index_code}')>"
@@ -36,6 +41,10 @@ class IndexData(Base,BaseModel):
     存储导入的指数回测数据，每条有一个import_id属性记录来源于哪一次导入，属性有日期、指数代码等
     """
     __tablename__ = 'GridData'
+    # 回测按 import_id 取一批行情并按 date 排序，只用开高低收：覆盖索引，查询不回表、不排序
+    __table_args__ = (
+        Index('ix_GridData_import_id_date', 'import_id', 'date', 'open_price', 'high_price', 'low_price', 'close_price'),
+    )
     
     # 主键
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -89,6 +98,9 @@ class GridConfig(Base, BaseModel):
 class GridRow(Base, BaseModel):
     """ 存储每个策略，一个策略total_rows行 """
     __tablename__ = 'GridRow'
+    __table_args__ = (
+        Index('ix_GridRow_config_id', 'config_id'),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     config_id = Column(Integer, ForeignKey('GridConfig.id', ondelete="CASCADE"), nullable=False, comment="所属配置ID")
@@ -107,4 +119,24 @@ class GridRow(Base, BaseModel):
     config = relationship("GridConfig", back_populates="rows")
 
     def __repr__(self):
-        return f"<GridRow(config_id={self.config_id})>"
\ No newline at end of file
+        return f"<GridRow(config_id={self.config_id})>"
+
+
+class BacktestState(Base, BaseModel):
+    """
+    保存已完成回测的流式状态（BackTest.get_state() 的 pickle），一组 (数据批次, 策略, 初始资金) 一行
+    之后导入同一指数更新的数据时，可从 last_date 之后继续回测，无需从第一天重放
+    """
+    __tablename__ = 'BacktestState'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    import_id = Column(Integer, ForeignKey('ImportedFiles.id', ondelete="CASCADE"), nullable=False, comment='回测所用的数据批次ID')
+    config_id = Column(Integer, ForeignKey('GridConfig.id', ondelete="CASCADE"), nullable=False, comment='回测所用的策略ID')
+    initial_capital = Column(Float, nullable=False, comment='初始资金')
+    last_date = Column(Date, nullable=False, comment='已喂入的最后一根K线日期（尚未清仓）')
+    bar_count = Column(Integer, nullable=False, comment='已喂入的K线根数')
+    state = Column(LargeBinary, nullable=False, comment='BackTest.get_state() 的 pickle')
+    updated_time = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment='保存时间')
+
+    def __repr__(self):
+        return f"<BacktestState(import_id={self.import_id}, config_id={self.config_id}, last_date='{self.last_date}')>"
@@ -0,0 +1,67 @@
+import os
+import json
+import shutil
+from typing import Dict, Any, Optional
+import numpy as np
+from .config import base_dir
+
+# 按数据批次缓存的列式行情：data/cache/<import_id>/ 下每列一个 .npy 文件（日期为 datetime64[D]，开高低收为 float64），
+# 读取时用 np.load(mmap_mode='r') 内存映射，多个进程 / 多次运行读取同一批数据几乎没有开销。
+# meta.json 记录该批次的导入时间，读取时与 ImportedFiles 核对，删除后重新导入复用了同一个 import_id 时不会读到旧数据。
+
+CACHE_ROOT = os.path.join(base_dir, "data", "cache")
+_COLUMNS = ("date", "open", "high", "low", "close")
+
+
+def ohlc_cache_dir(import_id: int) -> str:
+    return os.path.join(CACHE_ROOT, str(import_id))
+
+
+def write_ohlc_cache(ohlc: Dict[str, Any], token: str) -> bool:
+    """
+    把 load_ohlc() 格式的行情写入缓存目录，token 为该批次的校验标识（导入时间）
+    先写到临时目录再整体改名，读取方不会看到写了一半的文件
+    """
+    import_id = ohlc["import_id"]
+    target = ohlc_cache_dir(import_id)
+    staging = f"{target}.tmp{os.getpid()}"
+    try:
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        np.save(os.path.join(staging, "date.npy"), np.array(ohlc["date"], dtype="datetime64[D]"))
+        for column in _COLUMNS[1:]:
+            np.save(os.path.join(staging, f"{column}.npy"), np.ascontiguousarray(ohlc[column], dtype=np.float64))
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({"import_id": import_id, "token": token, "count": len(ohlc["date"])}, file)
+        invalidate_ohlc_cache(import_id)
+        os.replace(staging, target)
+        return True
+    except OSError as e:
+        shutil.rmtree(staging, ignore_errors=True)
+        print(f"写入 Import ID {import_id} 的行情缓存时出错: {e}")
+        return False
+
+
+def read_ohlc_cache(import_id: int, token: str) -> Optional[Dict[str, Any]]:
+    """读取缓存（开高低收为只读的内存映射数组），不存在、不完整或 token 不一致时返回 None"""
+    directory = ohlc_cache_dir(import_id)
+    try:
+        with open(os.path.join(directory, "meta.json"), "r", encoding="utf-8") as file:
+            meta = json.load(file)
+        if meta.get("token") != token:
+            return None
+        result: Dict[str, Any] = {"import_id": import_id}
+        for column in _COLUMNS:
+            result[column] = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    # 日期转回 datetime.date 列表，与 load_ohlc() 从数据库读出的类型一致
+    result["date"] = result["date"].astype(object).tolist()
+    if len(result["date"]) != meta.get("count"):
+        return None
+    return result
+
+
+def invalidate_ohlc_cache(import_id: int):
+    """删除某批次的行情缓存（Windows 上文件仍被映射时可能删不掉，依靠 token 校验保证不会读到旧数据）"""
+    shutil.rmtree(ohlc_cache_dir(import_id), ignore_errors=True)
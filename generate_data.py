@@ -1,9 +1,12 @@
+import os
 import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from util.build_grid_model import generate_grid_from_input, print_structured_grid_result  # 直接导入你的函数
-from util.backtest import BackTest              # 直接导入你的类
+from util.backtest import backtest_many
+from util.backtest_engine import MarketArrays
+from util.shared_market import SharedMarketData
 from dao.db_function_library import DBSessionManager
-from dao.grid_data_structure import  IndexData
 from tqdm import tqdm
 
 class GridDataGenerator:
@@ -16,88 +19,159 @@ class GridDataGenerator:
         self.import_id = import_id
         self.n_samples = n_samples
         self.seed = seed
-        np.random.seed(seed)
-        self.grid_data = self.load_market_from_db()
-        if not self.grid_data:
+        self.market = self.load_market()
+        if self.market is None or len(self.market) == 0:
             raise ValueError(f"未找到 Import ID {import_id} 的行情数据")
         self.low_bound, self.high_bound = self.compute_trigger_bounds()
     
+    def load_market(self):
+        """按列读取行情（只取日期与开高低收），返回 MarketArrays，出错或无数据时返回 None"""
+        ohlc = DBSessionManager().load_ohlc(self.import_id)
+        if ohlc is None:
+            return None
+        if not ohlc["date"]:
+            print(f"\n❌ 未找到 Import ID {self.import_id} 的行情数据。")
+            return None
+        return MarketArrays.from_ohlc(ohlc)
+
     def load_market_from_db(self):
-        db_manager = DBSessionManager()
-        try:
-            with db_manager as session:
-                grid_data_list = session.query(IndexData)\
-                    .filter(IndexData.import_id == self.import_id)\
-                    .order_by(IndexData.date).all()
-            if not grid_data_list:
-                print(f"\n❌ 未找到 Import ID {self.import_id} 的行情数据。")
-                return []
-            grid_data = [row.to_dict() for row in grid_data_list]
-            return grid_data
-        except Exception as e:
-            print(f"\n加载行情数据时出错: {e}")
-            return []
+        """返回 BackTest 可用的行情字典列表（只含日期与开高低收字段）"""
+        market = self.load_market()
+        return market.to_grid_data() if market is not None else []
 
     def compute_trigger_bounds(self):
-        highs = [row['high_price'] for row in self.grid_data if 'high_price' in row]
-        lows  = [row['low_price'] for row in self.grid_data]
-        min_p = min(lows)
-        max_p = max(highs)
+        min_p = float(self.market.low.min())
+        max_p = float(self.market.high.max())
         # 10% ~ 60% 的网格低位区间
         low_bound  = min_p + (max_p - min_p) * 0.10
         high_bound = min_p + (max_p - min_p) * 0.60
         return low_bound, high_bound
 
-    def generate_samples(self):
-        """批量生成策略参数并回测"""
-        a_vals = np.random.uniform(0.05, 0.30, self.n_samples)
-        b_vals = np.random.uniform(0.05, 0.30, self.n_samples)
-        trigger_prices = np.random.uniform(self.low_bound, self.high_bound, self.n_samples)
-        model_rows = np.random.randint(5, 30, self.n_samples)
-        buy_amounts = np.random.uniform(1000, 50000, self.n_samples)
+    def generate_samples(self, workers: int = 1):
+        """
+        批量生成策略参数并回测
+        :param workers: 并行进程数，1 为在当前进程串行执行。
+                        样本按固定大小分块，每块用 (seed, 块号) 派生的独立随机数流生成参数，
+                        因此无论 workers 取多少，同一 seed 的输出都完全相同
+        """
+        chunks = [(c, start, min(start + SAMPLE_CHUNK_SIZE, self.n_samples))
+                  for c, start in enumerate(range(0, self.n_samples, SAMPLE_CHUNK_SIZE))]
+        tasks = [(c, start, stop, self.seed, self.low_bound, self.high_bound) for c, start, stop in chunks]
 
-        print(f"🚀 开始生成 {self.n_samples} 行数据（预计需要 10-30 分钟）...")
-        results = []
+        print(f"🚀 开始生成 {self.n_samples} 行数据（{len(chunks)} 块，{workers} 个进程）...")
+        chunk_results = [None] * len(chunks)
+        with tqdm(total=self.n_samples, desc="生成策略并回测") as pbar:
+            def collect(task, outcome):
+                chunk_results[task[0]], errors = outcome
+                for message in errors:
+                    tqdm.write(message)
+                pbar.update(task[2] - task[1])
 
-        for i in tqdm(range(self.n_samples), desc="生成与回测进度"):
-            try:
-                input_params = {
-                    "a": a_vals[i],
-                    "b": b_vals[i],
-                    "first_trigger_price": trigger_prices[i],
-                    "total_rows": model_rows[i],
-                    "buy_amount": buy_amounts[i]
-                }
-                grid_result = generate_grid_from_input(input_params)
-                grid_strategy = grid_result["rows"]
-                for idx, row in enumerate(grid_strategy):
-                    row["id"] = int(idx)
-
-                backtest = BackTest(grid_data=self.grid_data, grid_strategy=grid_strategy, verbose=False)
-                metrics = backtest.run_backtest()["metrics"]
-
-                results.append({
-                    'a': a_vals[i],
-                    'b': b_vals[i],
-                    '首行买入触发价': trigger_prices[i],
-                    '模型行数': model_rows[i],
-                    '买入金额': buy_amounts[i],
-                    '简单收益率': metrics.get("simple_return"),
-                    '策略 XIRR': metrics.get("xirr"),
-                    '最大回撤 (相对峰值)': metrics.get("max_drawdown_peak"),
-                    '最大回撤 (相对初始)': metrics.get("max_drawdown_initial"),
-                    '年化夏普比': metrics.get("sharpe"),
-                    '年化波动率': metrics.get("volatility")
-                })
-            except Exception as e:
-                tqdm.write(f"❌ 第 {i+1} 行失败: {str(e)[:100]}")
+            if workers <= 1:
+                for task in tasks:
+                    collect(task, _generate_chunk(self.market, *task))
+            else:
+                # 行情写入共享内存，子进程启动时只收到句柄并零拷贝挂载，之后每个任务只传块号与参数范围
+                with SharedMarketData.publish(self.market) as shared, \
+                        ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(shared.handle,)) as executor:
+                    futures = {executor.submit(_run_chunk, task): task for task in tasks}
+                    for future in as_completed(futures):
+                        collect(futures[future], future.result())
 
+        results = [row for rows in chunk_results for row in rows]
         df = pd.DataFrame(results)
         output_file = f'OutPut_{self.import_id}.xlsx'
         df.to_excel(output_file, index=False, engine='openpyxl')
         print(f"\n✅ 成功生成 {len(df)} 行数据，保存至 '{output_file}'")
         return df
 
+
+# 每个样本输出的回测指标
+SAMPLE_METRICS = ["simple_return", "xirr", "max_drawdown_peak", "max_drawdown_initial", "sharpe", "volatility"]
+
+# 每块样本数：固定值（与 workers 无关），各块的随机数流只取决于 seed 与块号
+SAMPLE_CHUNK_SIZE = 500
+
+# 子进程挂载的共享行情，由 _init_worker 在进程启动时设置（须保持引用，MarketArrays 直接指向共享内存）
+_worker_shared = None
+
+
+def _init_worker(handle):
+    global _worker_shared
+    _worker_shared = SharedMarketData.attach(handle)
+
+
+def _run_chunk(task):
+    """子进程入口：用共享内存中的行情回测一块样本"""
+    return _generate_chunk(_worker_shared.market(), *task)
+
+
+def _generate_chunk(market, chunk_index, start, stop, seed, low_bound, high_bound):
+    """
+    生成第 chunk_index 块（样本 start ~ stop-1）的策略参数并整批回测
+    返回 (结果行列表, 失败信息列表)
+    """
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(chunk_index,)))
+    n = stop - start
+    a_vals = rng.uniform(0.05, 0.30, n)
+    b_vals = rng.uniform(0.05, 0.30, n)
+    trigger_prices = rng.uniform(low_bound, high_bound, n)
+    model_rows = rng.integers(5, 30, n)
+    buy_amounts = rng.uniform(1000, 50000, n)
+
+    sample_indices = []
+    strategies = []
+    errors = []
+    for j in range(n):
+        try:
+            input_params = {
+                "a": a_vals[j],
+                "b": b_vals[j],
+                "first_trigger_price": trigger_prices[j],
+                "total_rows": model_rows[j],
+                "buy_amount": buy_amounts[j]
+            }
+            grid_result = generate_grid_from_input(input_params)
+            grid_strategy = grid_result["rows"]
+            for idx, row in enumerate(grid_strategy):
+                row["id"] = int(idx)
+            sample_indices.append(j)
+            strategies.append(grid_strategy)
+        except Exception as e:
+            errors.append(f"❌ 第 {start + j + 1} 行失败: {str(e)[:100]}")
+
+    # 同一段行情只解析一次，整块策略一起回测；整批出错时逐个重试，只跳过出错的样本（其余样本照常输出）
+    try:
+        metrics_rows = backtest_many(market, strategies, metrics=SAMPLE_METRICS).to_dict("records")
+    except Exception:
+        kept_indices, metrics_rows = [], []
+        for j, grid_strategy in zip(sample_indices, strategies):
+            try:
+                metrics_rows.append(backtest_many(market, [grid_strategy], metrics=SAMPLE_METRICS).to_dict("records")[0])
+                kept_indices.append(j)
+            except Exception as e:
+                errors.append(f"❌ 第 {start + j + 1} 行失败: {str(e)[:100]}")
+        sample_indices = kept_indices
+
+    results = []
+    for j, metrics in zip(sample_indices, metrics_rows):
+        results.append({
+            'a': a_vals[j],
+            'b': b_vals[j],
+            '首行买入触发价': trigger_prices[j],
+            '模型行数': model_rows[j],
+            '买入金额': buy_amounts[j],
+            '简单收益率': metrics.get("simple_return"),
+            '策略 XIRR': metrics.get("xirr"),
+            '最大回撤 (相对峰值)': metrics.get("max_drawdown_peak"),
+            '最大回撤 (相对初始)': metrics.get("max_drawdown_initial"),
+            '年化夏普比': metrics.get("sharpe"),
+            '年化波动率': metrics.get("volatility")
+        })
+    return results, errors
+
+
 if __name__ == "__main__":
     generator = GridDataGenerator(import_id=2, n_samples=10000)
-    df = generator.generate_samples()
\ No newline at end of file
+    df = generator.generate_samples(workers=os.cpu_count() or 1)
\ No newline at end of file
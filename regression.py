@@ -5,7 +5,7 @@ from util.build_grid_model import generate_grid_from_input
 from skopt import gp_minimize
 from skopt.space import Real, Integer
 from generate_data import GridDataGenerator
-from util.backtest import BackTest
+from util.result_cache import run_backtest_cached
 import os
 import joblib
 import warnings
@@ -151,9 +151,8 @@ class StrategyOptimizer:
         for idx, row in enumerate(grid_strategy):
             row["id"] = int(idx)
 
-        # 回测
-        backtest = BackTest(grid_data=grid_data, grid_strategy=grid_strategy, verbose=True)
-        metrics = backtest.run_backtest()["metrics"]
+        # 回测（同一策略在同一批行情上已回测过时直接取缓存的指标）
+        metrics = run_backtest_cached(grid_data, grid_strategy, verbose=True)["metrics"]
         return metrics
 
     def optimize_and_backtest(self, n_calls=100, n_initial_points=20, verbose=False, grid_data=None):
@@ -19,8 +19,9 @@ try:
 
     # 从 util 包导入
     from util.build_grid_model import generate_grid_from_input, print_structured_grid_result, save_grid_to_db
-    from util.init_to_json import excel_to_json # 导入 Excel 转 Json 函数
-    from util.backtest import BackTest # 导入 BackTest
+    from util.backtest import BackTest, infer_initial_capital # 导入 BackTest
+    from util.backtest_engine import MarketArrays
+    from util.result_cache import get_default_cache, result_key, market_checksum # 回测结果缓存
 
 except ImportError as e:
     print(f"启动时导入模块失败: {e}")
@@ -178,9 +179,10 @@ def handle_strategy_management():
 def handle_data_management():
     """处理回测数据管理子菜单"""
     data_menu = {
-        '1': ('导入行情数据 (.xlsx)', handle_import_market_data),
+        '1': ('导入行情数据 (.xlsx / .csv)', handle_import_market_data),
         '2': ('查看现有数据', handle_view_market_data),
         '3': ('删除行情数据 (按导入批次)', handle_delete_market_data),
+        '4': ('批量导入行情数据 (目录 / 通配符)', handle_bulk_import_market_data),
         # 'b': ('返回主菜单', None)
     }
     while True:
@@ -350,13 +352,13 @@ def handle_import_market_data():
     clear()
     print("【网格交易神器】>【回测数据管理】>【导入行情数据】\n")
     # print("（按 b 返回）\n")
-    print("请确保行情 Excel 文件第一行为表头，且包含以下列名:\n")
+    print("请确保行情 Excel / CSV 文件第一行为表头，且包含以下列名:\n")
     print("- 日期Date (格式: YYYYMMDD 整数)")
     print("- 指数代码Index Code")
     print("- 开盘Open, 最高High, 最低Low, 收盘Close")
     print("- 涨跌幅(%)Change(%)")
 
-    excel_file_path_raw = input("\n请粘贴 Excel 文件的绝对路径 (按 b 取消): ").strip()
+    excel_file_path_raw = input("\n请粘贴 Excel / CSV 文件的绝对路径 (按 b 取消): ").strip()
     if not excel_file_path_raw or excel_file_path_raw.lower() == 'b':
         print("\n操作已取消。"); time.sleep(0.5); return
     
@@ -364,40 +366,81 @@ def handle_import_market_data():
 
     if not os.path.exists(excel_file_path):
         print(f"\n❌ 文件路径不存在或无效: {excel_file_path}"); input("\n按任意键返回..."); return
-    if not (excel_file_path.lower().endswith(".xlsx") or excel_file_path.lower().endswith(".xls")):
-         print(f"\n❌ 文件似乎不是 Excel 文件 (.xlsx 或 .xls): {excel_file_path}"); input("\n按任意键返回..."); return
+    if not excel_file_path.lower().endswith((".xlsx", ".xls", ".csv")):
+         print(f"\n❌ 文件似乎不是 Excel / CSV 文件 (.xlsx、.xls 或 .csv): {excel_file_path}"); input("\n按任意键返回..."); return
 
     print(f"\n已选择文件: {excel_file_path}")
     original_filename = os.path.basename(excel_file_path)
-    data_folder = os.path.join("data", "database_folder")
-    os.makedirs(data_folder, exist_ok=True)
-    json_file_path = os.path.join(data_folder, f"{os.path.splitext(original_filename)[0]}_temp_import.json")
 
-    print("\n1. 正在将 Excel 转换为 JSON...")
-    convert_success = False
+    # 逐行读取并按批写入数据库，不再生成临时 JSON 文件
+    print("\n正在将行情数据导入数据库...")
+    importer = None
     try:
-        convert_success = excel_to_json(excel_file_path, json_file_path) # 依赖此函数
-        if convert_success: print(f"✅ JSON 文件已生成: {json_file_path}")
-        else: print("❌ Excel 转 JSON 失败。")
+        importer = DataImporter(SQLALCHEMY_DATABASE_URI)
+        import_success = importer.import_market_data_from_file(excel_file_path, original_filename)
+        if not import_success: print("❌ 数据导入数据库失败。")
     except Exception as e:
-        print(f"❌ Excel 转 JSON 时发生错误: {e}")
+        print(f"❌ 数据导入时发生严重错误: {e}")
+    finally:
+        if importer: importer.close()
+    input("\n按任意键返回...")
 
-    if not convert_success: input("\n按任意键返回..."); return
 
-    print("\n2. 正在将 JSON 数据导入数据库...")
+def handle_bulk_import_market_data():
+    """批量导入一个目录（或通配符匹配）下的全部行情文件：多进程解析，单连接逐文件写入"""
+    clear()
+    print("【网格交易神器】>【回测数据管理】>【批量导入行情数据】\n")
+    print("支持 .xlsx / .xls / .csv / .json，表头要求同【导入行情数据】。")
+    print("已导入过的文件会跳过；与已有批次日期重叠且价格一致的文件只追加新的日期，价格不一致时单独成批并提示。")
+    print("可输入目录（导入其中所有行情文件）或通配符，例如 D:\\data\\*perf.xlsx")
+
+    path_raw = input("\n请粘贴目录或通配符 (按 b 取消): ").strip()
+    if not path_raw or path_raw.lower() == 'b':
+        print("\n操作已取消。"); time.sleep(0.5); return
+    path_or_pattern = path_raw.strip('"').strip("'")
+
     importer = None
-    import_success = False
     try:
         importer = DataImporter(SQLALCHEMY_DATABASE_URI)
-        import_success = importer.import_market_data_from_json(json_file_path, original_filename)
-        if not import_success: print("❌ 数据导入数据库失败。")
+        start = time.perf_counter()
+        report = importer.import_market_directory(path_or_pattern)
+        elapsed = time.perf_counter() - start
     except Exception as e:
-        print(f"❌ 数据导入时发生严重错误: {e}")
+        print(f"❌ 批量导入时发生严重错误: {e}"); input("\n按任意键返回..."); return
     finally:
         if importer: importer.close()
-        if os.path.exists(json_file_path):
-            try: os.remove(json_file_path)
-            except Exception as e_clean: print(f"警告：清理临时 JSON 文件失败: {e_clean}")
+    if not report:
+        input("\n按任意键返回..."); return
+
+    status_text = {"new": "✅ 新批次", "appended": "✅ 追加", "conflict": "⚠️ 价格不一致", "unchanged": "⏭️ 无新数据"}
+    display_data = []
+    for entry in report:
+        seconds = entry["parse_seconds"] + entry["write_seconds"]
+        display_data.append([
+            entry["file_name"],
+            status_text.get(entry["status"], "❌ 失败"),
+            entry["record_count"],
+            entry["written_count"],
+            entry["parse_seconds"],
+            entry["write_seconds"],
+            entry["record_count"] / seconds if entry["error"] is None and seconds > 0 else None,
+            entry["import_id"] if entry["error"] is None else entry["error"],
+        ])
+    print()
+    print(tabulate(display_data, headers=["文件", "状态", "记录数", "写入行数", "解析(s)", "写入(s)", "记录/秒", "Import ID / 错误"],
+                   tablefmt="psql", floatfmt=".2f", missingval="-"))
+
+    for entry in report:
+        if entry["status"] == "conflict":
+            print(f"⚠️ {entry['file_name']} 与 Import ID {entry['base_import_id']} 有 {entry['conflicts']} 个日期的开高低收不一致，"
+                  f"已单独导入为 Import ID {entry['import_id']}，请核对后选用。")
+
+    failed = [entry for entry in report if entry["error"] is not None]
+    total_records = sum(entry["record_count"] for entry in report if entry["error"] is None)
+    total_written = sum(entry["written_count"] for entry in report)
+    print(f"\n共 {len(report)} 个文件：成功 {len(report) - len(failed)}，失败 {len(failed)}；"
+          f"处理 {total_records} 条记录（新写入 {total_written} 条），用时 {elapsed:.2f}s"
+          f"（{total_records / elapsed if elapsed > 0 else 0:.0f} 条/秒）")
     input("\n按任意键返回...")
 
 
@@ -570,14 +613,11 @@ def handle_backtest():
     selected_import_record = imported_files[data_choice - 1]
     selected_import_id = selected_import_record.id
 
-    grid_data = []
-    try:
-        with db_manager as session:
-            grid_data_list = session.query(IndexData).filter(IndexData.import_id == selected_import_id).order_by(IndexData.date).all()
-        if not grid_data_list: print(f"\n❌ 未找到 Import ID {selected_import_id} 的行情数据。"); input("\n按任意键返回..."); return
-        grid_data = [row.to_dict() for row in grid_data_list]
-    except Exception as e:
-        print(f"\n加载行情数据时出错: {e}"); input("\n按任意键返回..."); return
+    # 只按列读取日期与开高低收（load_ohlc 出错时会打印原因并返回 None）
+    ohlc = db_manager.load_ohlc(selected_import_id)
+    if ohlc is None: input("\n按任意键返回..."); return
+    if not ohlc["date"]: print(f"\n❌ 未找到 Import ID {selected_import_id} 的行情数据。"); input("\n按任意键返回..."); return
+    grid_data = MarketArrays.from_ohlc(ohlc).to_grid_data()
     
     # --- 步骤 3: 输入初始资金 ---
     clear()
@@ -607,8 +647,33 @@ def handle_backtest():
     print(f"数据: {selected_import_record.file_name or 'N/A'} (ID: {selected_import_id}, Code: {selected_import_record.index_code})")
     print("-" * 40 + "\n")
     try:
-        backtest = BackTest(grid_data, grid_strategy, initial_capital) # 假设 BackTest 接受字典列表
-        result = backtest.run_backtest() # 假设内部打印流水/快照
+        # 优先在已保存的回测状态上续算（同指数更新的数据只需处理新增的日期），否则从头回测（逐日循环，逐笔打印成交）
+        capital = initial_capital if initial_capital is not None else infer_initial_capital(grid_strategy)
+        # 同一策略、同样的初始资金、内容相同的行情已回测过时直接取缓存结果（含交易流水与每日快照）
+        result_cache = get_default_cache()
+        cache_key = result_key(grid_strategy, capital, market_checksum(grid_data))
+        result = result_cache.get(cache_key, with_frames=True)
+        if result is not None:
+            print("已命中回测结果缓存，跳过回测。\n")
+            # 与实际回测时一样打印交易流水与每日快照
+            BackTest([], grid_strategy, capital).print_trades_and_daily(result["df_trades"], result["df_daily"])
+        else:
+            backtest = None
+            for state in db_manager.get_backtest_states(selected_import_record.index_code, strategy_id, capital):
+                backtest = BackTest.resume(state, grid_data, grid_strategy)
+                if backtest is not None:
+                    print(f"已从保存的回测状态继续（{state['pending_bar']['date']} 之后 {len(grid_data) - state['bar_index'] - 1} 个交易日）\n")
+                    break
+            if backtest is not None:
+                result = backtest.finalize(keep_state=True) # 清仓只在副本上模拟，保存的状态可继续续算
+                state = backtest.get_state()
+            else:
+                backtest = BackTest(grid_data, grid_strategy, capital) # 假设 BackTest 接受字典列表
+                result = backtest.run_backtest() # 假设内部打印流水/快照
+                state = backtest.resumable_state() # 撤回最后一日的清仓，得到可续算的状态
+            if state is not None:
+                db_manager.save_backtest_state(selected_import_id, strategy_id, state)
+            result_cache.put(cache_key, result)
         df_trades = result.get("df_trades") if result else pd.DataFrame()
         df_daily = result.get("df_daily") if result else pd.DataFrame()
         # 确保即使键存在但值为 None 时也是 DataFrame
@@ -1,32 +1,67 @@
 import dao.db_function_library
-from typing import List, Dict, Any, Optional
+import hashlib
+from typing import List, Dict, Any, Optional, Union
 import pandas as pd
 import numpy as np
 import numpy_financial as nf
 import unicodedata
 from math import sqrt
-from scipy.optimize import newton
+from util.backtest_engine import (MarketArrays, GridArrays, PriceLevelIndex, PositionLedger, DailySnapshot, MetricsAccumulator,
+                                  LazyMetrics, METRIC_NAMES,
+                                  run_numpy_engine, run_row_engine, run_batch_engine, cash_never_binds, STATUS_BOUGHT, STATUS_CODES, ACTION_BUY, ACTION_SELL)
+from util.backtest_jit import run_jit_engine, NUMBA_AVAILABLE
+from util.xirr import xirr as solve_xirr, xirr_batch, years_since_first
+
+ENGINES = ("python", "numpy", "rows", "jit")
+OHLC_FIELDS = ("open_price", "high_price", "low_price", "close_price")
+
+
+def chain_bar_digest(digest: str, bar: Dict) -> str:
+    """把一根K线的日期与开高低收接到已有摘要之后（链式 SHA-256），流式回测只需保存一个十六进制串即可核对全部已喂入的K线"""
+    payload = "|".join([digest, str(bar.get("date"))] + [repr(float(bar.get(field))) for field in OHLC_FIELDS])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def infer_initial_capital(grid_strategy: List[Dict]) -> float:
+    """推断初始资金：优先使用每个格子的 buy_amount（若缺失则用 shares*buy_price）"""
+    return float(
+        sum(
+            float(s.get('buy_amount')) if s.get('buy_amount') not in (None, "")
+            else (float(s.get('shares', 0)) * float(s.get('buy_price', 0)))
+            for s in grid_strategy
+        )
+    )
 
 
 class BackTest:
-    def __init__(self, grid_data: List[Dict], grid_strategy: List[Dict], initial_capital: Optional[float] = None, verbose: bool = True):
+    def __init__(self, grid_data: List[Dict], grid_strategy: List[Dict], initial_capital: Optional[float] = None, verbose: bool = True,
+                 engine: str = "python", metrics: Optional[List[str]] = None, build_frames: bool = True):
         """
         回测网格交易策略的核心逻辑封装为类
         保留原有注释与变量名，尽量不改变外部接口命名
+        :param engine: "python" 逐日逐格循环（默认）；"numpy" 数组化引擎，结果结构与数值完全一致；
+                       "rows" 按格子分解并缓存每个格子的成交计划（现金不足时自动按 numpy 引擎回测）；
+                       "jit" Numba 编译内核（未安装 numba 时等同 "numpy"）。
+                       "python" 的 run_backtest 在 verbose=True 时始终逐日循环，逐笔打印 买入 / 卖出 / 资金不足；
+                       verbose=False 时不需要逐笔输出，现金充足时走 "rows"，否则已安装 numba 时走 "jit"，结果均逐位一致
+        :param metrics: 需要的指标名列表（见 METRIC_NAMES），None 表示全部；指标在首次访问时才计算并缓存
+        :param build_frames: False 时不构建 df_trades / df_daily（返回 None），适合只关心标量指标的参数扫描
         """
+        if engine not in ENGINES:
+            raise ValueError(f"不支持的回测引擎: {engine}，可选: {ENGINES}")
+        if metrics is not None:
+            unknown = [name for name in metrics if name not in METRIC_NAMES]
+            if unknown:
+                raise ValueError(f"不支持的指标: {unknown}，可选: {METRIC_NAMES}")
+        self.metric_names = METRIC_NAMES if metrics is None else tuple(metrics)
+        self.build_frames = build_frames
         self.grid_data = grid_data
         self.grid_strategy = grid_strategy
         self.verbose = verbose
+        self.engine = engine
         
 
-        # 推断初始资金：优先使用每个格子的 buy_amount（若缺失则用 shares*buy_price）
-        inferred_initial_capital = float(
-            sum(
-                float(s.get('buy_amount')) if s.get('buy_amount') not in (None, "")
-                else (float(s.get('shares', 0)) * float(s.get('buy_price', 0)))
-                for s in grid_strategy
-            )
-        )
+        inferred_initial_capital = infer_initial_capital(grid_strategy)
         
         if initial_capital is None:
             self.initial_capital = float(inferred_initial_capital)
@@ -38,27 +73,49 @@ class BackTest:
         # 默认把推断的初始现金放入 cash_balance，保持与之前文件一致的行为
         self.cash_balance = self.initial_capital  # 现金
         self.max_cash_used = 0.0  # 最大占用资金
-        self.cash_used = 0.0  # 当前占用资金
-        self.daily_records: List[Dict] = []   # 每日快照
-        self.series_assert_holdings: List[float] = []  # 持仓市值
-        # positions 结构：{ trigger: { strategy_id: {shares, status, ...} } }
-        self.positions: Dict[Any, Dict[int, Dict[str, Any]]] = {}
+        self.cash_used = 0.0  # 当前占用资金（即持仓成本，随每笔成交增减）
+        self.shares_held = 0.0  # 当前持股总数，随每笔成交增减，日终市值 = shares_held * 收盘价
+        self.daily = DailySnapshot(len(grid_data))  # 每日快照（预分配数组）
+        self.metrics_acc = MetricsAccumulator(self.initial_capital)  # 回撤 / 夏普 / 波动率的在线累加器
         self.sell_num= 0 #卖出次数
         self.buy_num = 0 #买入次数
         self.buy_fail_num = 0 #买入失败次数
         self.triggered_rows = 0 #触发的格子数
         self.triggered_set = set() #触发的格子集合
+        # 持仓台账：每个 (trigger, strategy_id) 一个槽位，状态为整数码；positions 属性可还原为原嵌套字典
+        self._init_ledger()
+        # 流式回测进度：已处理的K线根数、暂存的最新一根K线、已喂入K线（含暂存K线）的链式摘要
+        self.bar_index = 0
+        self.pending_bar = None
+        self.bars_digest = ""
+
+        # 初始资金 >= 各格买入金额之和且卖出价 >= 买入价时，买入永远不会因资金不足失败，
+        # run_backtest 直接走无资金约束的按格分解路径（engine="python" 时也一样，结果逐位一致）
+        self.cash_unconstrained = cash_never_binds(GridArrays(self.grid_strategy), self.initial_capital)
+
+        # 按价格排序的格子索引：中间日只需处理 买入触发价 / 卖出价 落在当日 [low, high] 内的格子
+        self.buy_level_index = PriceLevelIndex([s.get('buy_trigger_price') for s in self.grid_strategy])
+        self.sell_level_index = PriceLevelIndex([s.get('sell_price') for s in self.grid_strategy])
 
-        # 初始化 positions（将 grid_strategy 的格子写入 positions）
-        for s in self.grid_strategy:
-            trigger = s.get('buy_trigger_price')
-            sid = s.get('id')
-            if trigger is not None and sid is not None:
-                self.positions.setdefault(trigger, {})[sid] = {
-                    'shares': 0.0,
-                    'status': None,
-                    'last_action_date': None
-                }
+    def _init_ledger(self, ledger: Optional[PositionLedger] = None):
+        """
+        初始化台账（将 grid_strategy 的格子写入台账），槽位按触发价分组，与原 positions 的遍历顺序一致
+        传入 ledger 时直接使用（从状态恢复）
+        """
+        if ledger is None:
+            ledger = PositionLedger()
+            grouped: Dict[Any, List[Any]] = {}
+            for s in self.grid_strategy:
+                trigger = s.get('buy_trigger_price')
+                sid = s.get('id')
+                if trigger is not None and sid is not None:
+                    grouped.setdefault(trigger, []).append(sid)
+            for trigger, sids in grouped.items():
+                for sid in sids:
+                    ledger.add(trigger, sid)
+        self.ledger = ledger
+        # 每个格子对应的槽位（无效格子为 None），回测循环内直接按下标访问
+        self.row_slots = [self.ledger.slot(s.get('buy_trigger_price'), s.get('id')) for s in self.grid_strategy]
 
     def _display_width(self, s: Any) -> int:
         """返回字符串在等宽字体下的大致显示宽度（中文宽度按2算，英文按1算）"""
@@ -158,53 +215,28 @@ class BackTest:
 
     def xirr(self, cashflows, dates):
         """计算XIRR，cashflows为现金流数组，dates为对应日期数组"""
-        dates = pd.to_datetime(dates)
-        t0 = dates.min()
-        years = (dates - t0).days / 365.0
-
-        def npv(r):
-            return np.sum(cashflows / (1 + r) ** years)
-
-        try:
-            return newton(npv, 0.1)  # 初始猜测 10%
-        except RuntimeError:
-            return np.nan
+        irr = solve_xirr(cashflows, years_since_first(dates))
+        return np.nan if irr is None else irr
 
     def compute_xirr(self, df_trades: pd.DataFrame, df_daily: pd.DataFrame):
         """根据交易流水和每日净值计算策略XIRR"""
-        cashflows = []
-        dates = []
-
-        # 交易流水
-        for _, row in df_trades.iterrows():
-            if row["action"] == "买入":
-                cashflows.append(-row["amount"])
-                dates.append(pd.to_datetime(row["date"]))
-            elif row["action"] == "卖出":
-                cashflows.append(row["amount"])
-                dates.append(pd.to_datetime(row["date"]))
-                
-                
-        if len(cashflows) < 2:
+        if df_trades.empty or "action" not in df_trades.columns:
             return None
+        return self._xirr_from_arrays(df_trades["action"].to_numpy(), df_trades["amount"].to_numpy(dtype=float),
+                                      df_trades["date"])
 
-        # 根据日期排序现金流
-        cf_df = pd.DataFrame({"date": pd.to_datetime(dates), "cf": np.array(cashflows, dtype=float)})
-        cf_df = cf_df.sort_values("date")
-        cashflows_sorted = cf_df["cf"].to_numpy(dtype=float)
-        dates_sorted = cf_df["date"].to_list()
-
-        # 必须同时包含正负现金流
-        if not (np.any(cashflows_sorted > 0) and np.any(cashflows_sorted < 0)):
+    def _xirr_from_arrays(self, action: np.ndarray, amount: np.ndarray, dates):
+        """交易流水各列数组 -> XIRR：买入为负现金流，卖出为正现金流"""
+        is_buy = action == ACTION_BUY
+        mask = is_buy | (action == ACTION_SELL)
+        if mask.sum() < 2:
             return None
+        cashflows = np.where(is_buy, -amount, amount)[mask]
+        dates = pd.to_datetime(pd.Series(dates)).to_numpy()[mask]
 
-        try:
-            irr = self.xirr(cashflows_sorted, dates_sorted)
-            if np.isnan(irr):
-                return None
-            return float(irr)
-        except Exception:
-            return None
+        # 根据日期排序现金流
+        order = np.argsort(dates, kind="stable")
+        return solve_xirr(cashflows[order], years_since_first(dates[order]))
 
     def max_drawdown_from_peak(self, prices: pd.Series) -> Optional[float]:
         if prices is None or prices.empty:
@@ -293,6 +325,21 @@ class BackTest:
         vol = returns.std(ddof=1) * np.sqrt(periods_per_year)
         return float(vol)
 
+    @property
+    def daily_records(self) -> List[Dict]:
+        """每日快照的字典列表形式"""
+        return pd.DataFrame(self.daily.to_columns()).to_dict("records")
+
+    @property
+    def series_assert_holdings(self) -> List[float]:
+        """每日持仓市值"""
+        return self.daily.column("holding_value").tolist()
+
+    @property
+    def positions(self) -> Dict[Any, Dict[Any, Dict[str, Any]]]:
+        """持仓快照，结构：{ trigger: { strategy_id: {shares, status, last_action_date, buy_price} } }"""
+        return self.ledger.to_dict()
+
     def check_positions(self, current_date: Any, action: str, trigger_price: float, strategy_id: int) -> bool:
         """
         检查某个具体策略格子是否可以买入/卖出
@@ -301,23 +348,18 @@ class BackTest:
         - 必须买过才能卖
         - 不同格子互不影响
         """
-        if trigger_price not in self.positions or strategy_id not in self.positions[trigger_price]:
+        slot = self.ledger.slot(trigger_price, strategy_id)
+        if slot is None:
             return False
+        return self._check_slot(slot, current_date, action == "买入")
 
-        pos = self.positions[trigger_price][strategy_id]
-        last_date = pos.get("last_action_date")
-        status = pos.get("status")
-
-        if action == "买入":
-            if status is None or status == "卖出":  # 从未买过或已卖出
-                return True
-
-        elif action == "卖出":
-            if status == "买入" and last_date != current_date:
-                # 必须已经买过，且不能和买入是同一天
-                return True
-
-        return False
+    def _check_slot(self, slot: int, current_date: Any, is_buy: bool) -> bool:
+        """check_positions 的槽位版本，省去 (trigger, strategy_id) 查找"""
+        status = self.ledger.status[slot]
+        if is_buy:
+            return status != STATUS_BOUGHT  # 从未买过或已卖出
+        # 必须已经买过，且不能和买入是同一天
+        return status == STATUS_BOUGHT and self.ledger.last_action_date[slot] != current_date
 
     def operate_buy_or_sell(self,
                             action: str,
@@ -340,8 +382,8 @@ class BackTest:
 
             actual_shares = int(buy_amount / executed_price) if executed_price > 0 else 0
             buy_amount = actual_shares * executed_price  # 实际买入金额
-            self.update_position(trigger=trigger, strategy_id=strategy_id, shares=actual_shares, status="买入", current_date=date)
-            self.positions[trigger][strategy_id]["buy_price"] = executed_price
+            slot = self.update_position(trigger=trigger, strategy_id=strategy_id, shares=actual_shares, status="买入", current_date=date)
+            self.ledger.buy_price[slot] = executed_price
             row = {
                 "date": date,
                 "action": "买入",
@@ -363,12 +405,13 @@ class BackTest:
             return self.cash_used, self.max_cash_used, self.cash_balance
 
         if action == "卖出" and executed_price is not None:
-            pos = self.positions.get(trigger, {}).get(strategy_id)
-            if not pos or pos.get('status') != "买入":
+            slot = self.ledger.slot(trigger, strategy_id)
+            if slot is None or self.ledger.status[slot] != STATUS_BOUGHT:
                 if self.verbose:
                     print(f"警告：尝试卖出但无持仓，日期 {date}, 触发价 {trigger}, 策略ID {strategy_id}")
                 return self.cash_used, self.max_cash_used, self.cash_balance
-            sell_shares = pos.get('shares', 0) if pos else 0
+            sell_shares = self.ledger.shares[slot]
+            held_buy_price = self.ledger.buy_price[slot]
             sell_amount = sell_shares * executed_price
             self.update_position(trigger=trigger, strategy_id=strategy_id, shares=0.0, status="卖出", current_date=date)
             row = {
@@ -383,7 +426,7 @@ class BackTest:
             }
             self.operate.append(row)
             self.triggered_set.add(strategy_id)
-            self.cash_used -= pos.get('buy_price', 0) * sell_shares
+            self.cash_used -= (held_buy_price or 0) * sell_shares
             self.max_cash_used = max(self.max_cash_used, self.cash_used)
             self.cash_balance += sell_amount
             if self.verbose:
@@ -395,97 +438,338 @@ class BackTest:
 
         return self.cash_used, self.max_cash_used, self.cash_balance
 
-    def update_position(self, trigger, strategy_id, shares, status, current_date=None):
-        
-        if trigger not in self.positions:
-            self.positions[trigger] = {}
-
-        if strategy_id not in self.positions[trigger]:
+    def update_position(self, trigger, strategy_id, shares, status, current_date=None) -> int:
+        """更新（或新登记）某个格子的持仓，status 为 None / "买入" / "卖出"，返回槽位下标"""
+        status_code = STATUS_CODES[status]
+        slot = self.ledger.slot(trigger, strategy_id)
+        if slot is None:
             # 初始化
-            self.positions[trigger][strategy_id] = {
-                "shares": shares,
-                "status": status,
-                "last_action_date": current_date
-            }
-        else:
-            # 更新已有格子
-            pos = self.positions[trigger][strategy_id]
-            pos["shares"] = shares
-            pos["status"] = status
-            if current_date is not None:
-                pos["last_action_date"] = current_date
+            self.shares_held += shares
+            return self.ledger.add(trigger, strategy_id, shares, status_code, current_date)
+
+        # 更新已有格子
+        self.shares_held += shares - self.ledger.shares[slot]
+        self.ledger.shares[slot] = shares
+        self.ledger.status[slot] = status_code
+        if current_date is not None:
+            self.ledger.last_action_date[slot] = current_date
+        return slot
 
     def run_backtest(self) -> Dict:
         """
         回测主流程（保留原 run_backtest 的注释与行为）
+        等价于 start() 后逐根调用 on_bar()，最后 finalize()
+        engine="python" 且 verbose=True 时逐日循环（数组引擎没有资金不足等逐笔信息可打印），verbose=False 时按 engine 说明改走数组引擎
         """
-        for i, grid in enumerate(self.grid_data):
-            date = grid['date']
-            open_p = float(grid.get('open_price'))
-            low_p = float(grid.get('low_price'))
-            high_p = float(grid.get('high_price'))
-            close_p = float(grid.get('close_price'))
-
-            for strategy in self.grid_strategy:
-                buy_trigger = strategy.get('buy_trigger_price')
-                buy_price = strategy.get('buy_price')
-                sell_trigger = strategy.get('sell_trigger_price')
-                sell_price = strategy.get('sell_price')
-                buy_amount = float(strategy.get('buy_amount', 0))
-
-                # 跳过无效策略/触发价
-                if buy_trigger is None:
-                    continue
+        if self.engine != "python" or (not self.verbose and (self.cash_unconstrained or NUMBA_AVAILABLE)):
+            return self._run_backtest_numpy()
 
-                buy_executed_price = None # 实际成交价，None表示未成交
-                sell_executed_price = None # 实际卖出价，None表示未成交
-                # 第一天进行建仓
-                if i == 0:
-                    #检查是否允许买入
-                    # 1 开盘价已经低于等于触发价 -> 以开盘价按市价成交
-                    if open_p <= buy_trigger and open_p <= buy_price:
-                        buy_executed_price = open_p
-
-                    # 2 否则若当日曾下探到触发价（low <= buy_trigger <= high）
-                    #    则尝试以 limit 买入价成交（只有当买入价在当日区间时才认为成交）
-                    elif low_p <= buy_trigger <= high_p:
-                        # 买入价必须在当日区间内才认为能成交
-                        if (buy_price is not None) and (low_p <= buy_price <= high_p):
-                            buy_executed_price = buy_price
-                        else:
-                            # 买入价不可达（例如低于当日最低或高于最高），不成交
-                            buy_executed_price = None
+        self.start()
+        for grid in self.grid_data:
+            self.on_bar(grid)
+        return self.finalize()
+
+    # ---------- 流式（逐根K线）接口 ----------
+    def start(self):
+        """
+        开始一次新的流式回测：清空持仓、资金、流水与快照
+        之后用 on_bar() 逐根喂入K线，全部喂完后调用 finalize()
+        """
+        self.operate = []
+        self.cash_balance = self.initial_capital
+        self.max_cash_used = 0.0
+        self.cash_used = 0.0
+        self.shares_held = 0.0
+        self.daily = DailySnapshot(len(self.grid_data))
+        self.metrics_acc = MetricsAccumulator(self.initial_capital)
+        self.sell_num = 0
+        self.buy_num = 0
+        self.buy_fail_num = 0
+        self.triggered_rows = 0
+        self.triggered_set = set()
+        self._init_ledger()
+        self.bar_index = 0  # 已处理的K线根数
+        self.pending_bar = None  # 暂存的最新一根K线：只有确认后面还有K线时，才按常规交易日处理
+        self.bars_digest = ""  # 已喂入K线的日期与开高低收摘要，resume() 据此确认新数据是同一段历史的延长
+
+    def on_bar(self, bar: Dict):
+        """
+        喂入一根K线（字段同 IndexData.to_dict()：date/open_price/high_price/low_price/close_price）
+        最后一根K线要在 finalize() 中按清仓日处理，因此每次先处理上一根暂存的K线，再暂存本根
+        """
+        if self.pending_bar is not None:
+            self._process_bar(self.pending_bar, is_first=(self.bar_index == 0), is_last=False)
+            self.bar_index += 1
+        self.pending_bar = bar
+        if self.bars_digest is not None:
+            self.bars_digest = chain_bar_digest(self.bars_digest, bar)
+
+    def finalize(self, keep_state: bool = False) -> Dict:
+        """
+        把暂存的最后一根K线按清仓日处理（只有一根时按首日处理），计算并返回回测结果
+        keep_state=True 时只在副本上模拟清仓（"假如今天清仓"的视图），自身状态不变，之后仍可继续 on_bar()
+        """
+        if keep_state:
+            view = BackTest.from_state(self.get_state(), verbose=self.verbose)
+            view.grid_data = self.grid_data
+            return view.finalize()
+
+        if self.pending_bar is not None:
+            self._process_bar(self.pending_bar, is_first=(self.bar_index == 0), is_last=True)
+            self.bar_index += 1
+            self.pending_bar = None
+
+        return self._summarize()
+
+    def get_state(self) -> Dict[str, Any]:
+        """
+        导出流式回测的完整状态（只含 dict / list / 数值 / 日期等基础类型，可直接 pickle 保存）
+        配合 BackTest.from_state() 可在之后继续 on_bar()，无需重放历史K线
+        """
+        return {
+            "grid_strategy": self.grid_strategy,
+            "initial_capital": self.initial_capital,
+            "cash_balance": self.cash_balance,
+            "cash_used": self.cash_used,
+            "max_cash_used": self.max_cash_used,
+            "shares_held": self.shares_held,
+            "sell_num": self.sell_num,
+            "buy_num": self.buy_num,
+            "buy_fail_num": self.buy_fail_num,
+            "triggered_set": list(self.triggered_set),
+            "operate": [dict(row) for row in self.operate],
+            "ledger": {
+                "keys": [list(key) for key in self.ledger.keys],
+                "shares": list(self.ledger.shares),
+                "status": list(self.ledger.status),
+                "last_action_date": list(self.ledger.last_action_date),
+                "buy_price": list(self.ledger.buy_price),
+            },
+            "daily": {
+                "dates": list(self.daily.dates),
+                "values": self.daily.values[:len(self.daily)].tolist(),
+            },
+            "metrics_acc": self.metrics_acc.get_state(),
+            "bar_index": self.bar_index,
+            "pending_bar": dict(self.pending_bar) if self.pending_bar is not None else None,
+            "bars_digest": self.bars_digest,
+        }
+
+    def resumable_state(self) -> Optional[Dict[str, Any]]:
+        """
+        run_backtest() / finalize() 之后导出可续算的状态：等价于流式回测喂完全部K线、尚未清仓时的 get_state()
+        各引擎最后一日只做清仓卖出，撤回这些卖出即可，数组引擎算完后也能保存状态，不必为此改走逐日循环
+        """
+        n = len(self.daily)
+        if n == 0 or len(self.grid_data) < n:
+            return None
+        if n == 1:
+            # 只有一根K线：流式回测此时还没处理任何K线，只暂存了这一根
+            fresh = BackTest([], self.grid_strategy, self.initial_capital, verbose=False)
+            fresh.start()
+            fresh.on_bar(self.grid_data[0])
+            return fresh.get_state()
+
+        last_date = self.daily.dates[n - 1]
+        keep = len(self.operate)
+        while keep > 0 and self.operate[keep - 1]["date"] == last_date:
+            keep -= 1
+        operate = self.operate[:keep]
+
+        state = self.get_state()
+        ledger = state["ledger"]
+        action_dates = {}
+        for row in operate:
+            action_dates[self.ledger.slot(row["trigger"], row["strategy_id"])] = row["date"]
+        for row in self.operate[keep:]:
+            # 清仓前该格子仍是买入持有，最近一次操作是它之前的那笔买入
+            slot = self.ledger.slot(row["trigger"], row["strategy_id"])
+            ledger["shares"][slot] = row["shares"]
+            ledger["status"][slot] = STATUS_BOUGHT
+            ledger["last_action_date"][slot] = action_dates[slot]
+
+        values = self.daily.values[:n - 1]
+        columns = DailySnapshot.COLUMNS
+        metrics_acc = MetricsAccumulator(self.initial_capital)
+        metrics_acc.update_many(values[:, columns.index("holding_value")] + values[:, columns.index("cash_balance")])
+        digest = ""
+        for bar in self.grid_data[:n]:
+            digest = chain_bar_digest(digest, bar)
+        state.update({
+            "cash_balance": float(values[-1, columns.index("cash_balance")]),
+            "cash_used": float(values[-1, columns.index("cash_used")]),
+            "max_cash_used": float(values[-1, columns.index("max_cash_used")]),
+            "shares_held": sum(ledger["shares"]),
+            "triggered_set": list({row["strategy_id"] for row in operate if row["action"] == ACTION_SELL}),
+            "operate": [dict(row) for row in operate],
+            "daily": {"dates": list(self.daily.dates[:n - 1]), "values": values.tolist()},
+            "metrics_acc": metrics_acc.get_state(),
+            "bar_index": n - 1,
+            "pending_bar": dict(self.grid_data[n - 1]),
+            "bars_digest": digest,
+        })
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any], verbose: bool = False) -> "BackTest":
+        """根据 get_state() 的结果恢复一个可继续 on_bar() / finalize() 的回测实例"""
+        backtest = cls(grid_data=[], grid_strategy=state["grid_strategy"],
+                       initial_capital=state["initial_capital"], verbose=verbose)
+        backtest.cash_balance = state["cash_balance"]
+        backtest.cash_used = state["cash_used"]
+        backtest.max_cash_used = state["max_cash_used"]
+        backtest.shares_held = state["shares_held"]
+        backtest.sell_num = state["sell_num"]
+        backtest.buy_num = state["buy_num"]
+        backtest.buy_fail_num = state["buy_fail_num"]
+        backtest.triggered_set = set(state["triggered_set"])
+        backtest.operate = [dict(row) for row in state["operate"]]
+
+        ledger = PositionLedger()
+        saved = state["ledger"]
+        for j, key in enumerate(saved["keys"]):
+            slot = ledger.add(key[0], key[1], saved["shares"][j], saved["status"][j], saved["last_action_date"][j])
+            ledger.buy_price[slot] = saved["buy_price"][j]
+        backtest._init_ledger(ledger)
+
+        daily = state["daily"]
+        backtest.daily = DailySnapshot(len(daily["dates"]))
+        for date, values in zip(daily["dates"], daily["values"]):
+            backtest.daily.record(date, *values)
+        backtest.metrics_acc = MetricsAccumulator.from_state(state["metrics_acc"])
+
+        backtest.bar_index = state["bar_index"]
+        backtest.pending_bar = state["pending_bar"]
+        backtest.bars_digest = state.get("bars_digest")  # 旧版本保存的状态没有摘要，无法再核对（resume() 不接受）
+        return backtest
+
+    @classmethod
+    def resume(cls, state: Dict[str, Any], grid_data: List[Dict], grid_strategy: List[Dict],
+               verbose: bool = True) -> Optional["BackTest"]:
+        """
+        用已保存的状态在新的行情数据上继续回测，只喂入暂存K线之后的日期
+        新数据必须包含已喂入的全部K线（同日期同开高低收，按状态中的摘要逐根核对）且策略未被修改，否则返回 None，由调用方从头回测
+        """
+        pending = state.get("pending_bar")
+        bar_count = state["bar_index"] + (1 if pending is not None else 0)
+        if pending is None or state.get("bars_digest") is None or state["grid_strategy"] != grid_strategy \
+                or len(grid_data) < bar_count:
+            return None
+        digest = ""
+        for bar in grid_data[:bar_count]:
+            digest = chain_bar_digest(digest, bar)
+        if digest != state["bars_digest"]:
+            return None
+
+        backtest = cls.from_state(state, verbose=verbose)
+        backtest.grid_data = grid_data
+        for bar in grid_data[bar_count:]:
+            backtest.on_bar(bar)
+        return backtest
+
+    def _process_bar(self, grid: Dict, is_first: bool, is_last: bool):
+        """处理单根K线：首日建仓 / 常规网格触发 / 最后一日清仓，并记录当日快照"""
+        date = grid['date']
+        open_p = float(grid.get('open_price'))
+        low_p = float(grid.get('low_price'))
+        high_p = float(grid.get('high_price'))
+        close_p = float(grid.get('close_price'))
+
+        # 首日建仓、最后一日清仓需要检查全部格子；中间日的买入要求 low <= 买入触发价 <= high，
+        # 卖出要求 low <= 卖出价 <= high，因此只取两个价格索引中落在区间内的格子（按原顺序处理）
+        if is_first or is_last:
+            rows_today = range(len(self.grid_strategy))
+        else:
+            rows_today = self.buy_level_index.rows_between(low_p, high_p)
+            rows_today.extend(self.sell_level_index.rows_between(low_p, high_p))
+            rows_today = sorted(set(rows_today))
+
+        for k in rows_today:
+            strategy = self.grid_strategy[k]
+            buy_trigger = strategy.get('buy_trigger_price')
+            buy_price = strategy.get('buy_price')
+            sell_trigger = strategy.get('sell_trigger_price')
+            sell_price = strategy.get('sell_price')
+            buy_amount = float(strategy.get('buy_amount', 0))
+
+            # 跳过无效策略/触发价
+            if buy_trigger is None:
+                continue
+            slot = self.row_slots[k]
+            if slot is None:
+                slot = self.ledger.slot(buy_trigger, strategy.get('id'))
+
+            buy_executed_price = None # 实际成交价，None表示未成交
+            sell_executed_price = None # 实际卖出价，None表示未成交
+            # 第一天进行建仓
+            if is_first:
+                #检查是否允许买入
+                # 1 开盘价已经低于等于触发价 -> 以开盘价按市价成交
+                if open_p <= buy_trigger and open_p <= buy_price:
+                    buy_executed_price = open_p
+
+                # 2 否则若当日曾下探到触发价（low <= buy_trigger <= high）
+                #    则尝试以 limit 买入价成交（只有当买入价在当日区间时才认为成交）
+                elif low_p <= buy_trigger <= high_p:
+                    # 买入价必须在当日区间内才认为能成交
+                    if (buy_price is not None) and (low_p <= buy_price <= high_p):
+                        buy_executed_price = buy_price
                     else:
-                        # 开盘价高于触发价且当日未跌破触发价 -> 不建仓
+                        # 买入价不可达（例如低于当日最低或高于最高），不成交
                         buy_executed_price = None
-                    if buy_executed_price is not None:
-                        self.operate_buy_or_sell(
-                            action="买入",
-                            date=date,
-                            trigger=buy_trigger,
-                            strategy=strategy,
-                            executed_price=buy_executed_price,
-                            buy_amount=buy_amount,
-                            is_first_day=(i==0),
-                            is_last_day=(i==len(self.grid_data)-1),
-                        )
-                        continue  # 建仓后跳过卖出检查
-                #最后一天需要进行清仓
-                elif i == len(self.grid_data) - 1:
-                    # 清仓逻辑：卖出所有持仓
-                    pos = self.positions.get(buy_trigger, {}).get(strategy.get('id'))
-                    if pos and pos.get('status') == "买入":
-                        if (open_p>= sell_trigger) and (open_p >= sell_price):
-                            sell_executed_price = open_p
-                        elif high_p >= sell_trigger:
-                            if (sell_price is not None) and (low_p <= sell_price <= high_p):
-                                sell_executed_price = sell_price
-                            else:
-                                sell_executed_price = close_p
+                else:
+                    # 开盘价高于触发价且当日未跌破触发价 -> 不建仓
+                    buy_executed_price = None
+                if buy_executed_price is not None:
+                    self.operate_buy_or_sell(
+                        action="买入",
+                        date=date,
+                        trigger=buy_trigger,
+                        strategy=strategy,
+                        executed_price=buy_executed_price,
+                        buy_amount=buy_amount,
+                        is_first_day=is_first,
+                        is_last_day=is_last,
+                    )
+                    continue  # 建仓后跳过卖出检查
+            #最后一天需要进行清仓
+            elif is_last:
+                # 清仓逻辑：卖出所有持仓
+                if slot is not None and self.ledger.status[slot] == STATUS_BOUGHT:
+                    if (open_p>= sell_trigger) and (open_p >= sell_price):
+                        sell_executed_price = open_p
+                    elif high_p >= sell_trigger:
+                        if (sell_price is not None) and (low_p <= sell_price <= high_p):
+                            sell_executed_price = sell_price
                         else:
                             sell_executed_price = close_p
                     else:
+                        sell_executed_price = close_p
+                else:
+                    sell_executed_price = None
+                if sell_executed_price is not None:
+                    self.operate_buy_or_sell(
+                        action="卖出",
+                        date=date,
+                        trigger=buy_trigger,
+                        strategy=strategy,
+                        executed_price=sell_executed_price,
+                        buy_amount=buy_amount,
+                        is_first_day=is_first,
+                        is_last_day=is_last,
+                    )
+            # ---------- 非首日（按照常规网格触发逻辑） ----------
+            else:
+                # 卖出逻辑：当天曾冲高到卖出触发价且允许卖出
+                if high_p >= sell_trigger and slot is not None and self._check_slot(slot, date, is_buy=False):
+                    # 卖出触发价被触发，且允许卖出
+                    if (sell_price is not None) and (low_p <= sell_price <= high_p):
+                        # 卖出价在当日区间内，按卖出价成交
+                        sell_executed_price = sell_price
+                    else:
+                        # 卖出价不在当日区间内，不成交
                         sell_executed_price = None
+                    # 如果决定成交，登记持仓、记录流水、更新统计
                     if sell_executed_price is not None:
                         self.operate_buy_or_sell(
                             action="卖出",
@@ -494,136 +778,308 @@ class BackTest:
                             strategy=strategy,
                             executed_price=sell_executed_price,
                             buy_amount=buy_amount,
-                            is_first_day=(i==0),
-                            is_last_day=(i==len(self.grid_data)-1),
+                            is_first_day=is_first,
+                            is_last_day=is_last,
                         )
-                # ---------- 非首日（按照常规网格触发逻辑） ----------
-                else:
-                    # 卖出逻辑：当天曾冲高到卖出触发价且允许卖出
-                    if high_p >= sell_trigger and self.check_positions(date, "卖出", buy_trigger, strategy.get('id')):
-                        # 卖出触发价被触发，且允许卖出
-                        if (sell_price is not None) and (low_p <= sell_price <= high_p):
-                            # 卖出价在当日区间内，按卖出价成交
-                            sell_executed_price = sell_price
-                        else:
-                            # 卖出价不在当日区间内，不成交
-                            sell_executed_price = None
-                        # 如果决定成交，登记持仓、记录流水、更新统计
-                        if sell_executed_price is not None:
-                            self.operate_buy_or_sell(
-                                action="卖出",
-                                date=date,
-                                trigger=buy_trigger,
-                                strategy=strategy,
-                                executed_price=sell_executed_price,
-                                buy_amount=buy_amount,
-                                is_first_day=(i==0),
-                                is_last_day=(i==len(self.grid_data)-1),
-                            )
-                    #买入逻辑：当天曾下探到买入触发价且允许买入
-                    if low_p <= buy_trigger <= high_p and self.check_positions(date, "买入", buy_trigger, strategy.get('id')):
-                        if (buy_price is not None) and (low_p <= buy_price <= high_p):
-                            buy_executed_price = buy_price
-                        else:
-                            # 如果没有明确的 buy_price，或者 buy_price 不在区间，
-                            # 这里严谨处理：若无合适 buy_price，则不成交
-                            buy_executed_price = None
-                        # 如果决定成交，登记持仓、记录流水、更新统计
-                        if buy_executed_price is not None:
-                            self.operate_buy_or_sell(
-                                action="买入",
-                                date=date,
-                                trigger=buy_trigger,
-                                strategy=strategy,
-                                executed_price=buy_executed_price,
-                                buy_amount=buy_amount,
-                                is_first_day=(i==0),
-                                is_last_day=(i==len(self.grid_data)-1),
-                            )
-
-            # === 每日快照 ===
-            assert_holdings = sum(
-                pos.get("shares", 0) * close_p
-                for triggers in self.positions.values()
-                for pos in triggers.values()
-            )
-            self.series_assert_holdings.append(assert_holdings)
-
-            self.daily_records.append({
-                "date": date,
-                "open": open_p,
-                "high": high_p,
-                "low": low_p,
-                "close": close_p,
-                "cash_used": self.cash_used,
-                "max_cash_used": self.max_cash_used,
-                "holding_value": assert_holdings,
-                "cash_balance": self.cash_balance,
-                "total_value": assert_holdings + self.cash_balance,
-            })
-
-        df_trades = pd.DataFrame(self.operate)       # 交易流水
-        df_daily = pd.DataFrame(self.daily_records)  # 每日快照
-        
+                #买入逻辑：当天曾下探到买入触发价且允许买入
+                if low_p <= buy_trigger <= high_p and slot is not None and self._check_slot(slot, date, is_buy=True):
+                    if (buy_price is not None) and (low_p <= buy_price <= high_p):
+                        buy_executed_price = buy_price
+                    else:
+                        # 如果没有明确的 buy_price，或者 buy_price 不在区间，
+                        # 这里严谨处理：若无合适 buy_price，则不成交
+                        buy_executed_price = None
+                    # 如果决定成交，登记持仓、记录流水、更新统计
+                    if buy_executed_price is not None:
+                        self.operate_buy_or_sell(
+                            action="买入",
+                            date=date,
+                            trigger=buy_trigger,
+                            strategy=strategy,
+                            executed_price=buy_executed_price,
+                            buy_amount=buy_amount,
+                            is_first_day=is_first,
+                            is_last_day=is_last,
+                        )
+
+        # === 每日快照 ===
+        assert_holdings = self.shares_held * close_p
+        self.daily.record(date, open_p, high_p, low_p, close_p,
+                          self.cash_used, self.max_cash_used, assert_holdings, self.cash_balance)
+        self.metrics_acc.update(assert_holdings + self.cash_balance)
+
+    def _run_backtest_numpy(self) -> Dict:
+        """
+        数组化引擎：OHLC 与格子参数转为数组后调用 run_numpy_engine（engine="rows" 时为 run_row_engine，"jit" 时为 run_jit_engine），
+        再把结果回写到实例属性（operate / positions / 各计数器），与 python 引擎保持一致
+        """
+        market = MarketArrays.from_grid_data(self.grid_data)
+        grid = GridArrays(self.grid_strategy)
+        if self.engine == "rows" or (self.engine == "python" and self.cash_unconstrained):
+            result = run_row_engine(market, grid, self.initial_capital)
+        elif self.engine in ("jit", "python"):
+            result = run_jit_engine(market, grid, self.initial_capital)
+        else:
+            result = run_numpy_engine(market, grid, self.initial_capital)
+
+        self.operate = result["trades"]
+        self.cash_used = result["final_cash_used"]
+        self.max_cash_used = result["final_max_cash_used"]
+        self.cash_balance = result["final_cash_balance"]
+        self.buy_num = result["buy_num"]
+        self.sell_num = result["sell_num"]
+        self.buy_fail_num = result["buy_fail_num"]
+        self.triggered_set = result["triggered_set"]
+        self.shares_held = result["final_shares_held"]
+        for k, sid in enumerate(grid.ids):
+            if result["last_day"][k] < 0:
+                continue
+            slot = self.ledger.slot(grid.raw_buy_trigger[k], sid)
+            self.ledger.shares[slot] = result["shares"][k]
+            self.ledger.status[slot] = result["status"][k]
+            self.ledger.last_action_date[slot] = market.dates[result["last_day"][k]]
+            self.ledger.buy_price[slot] = result["buy_price"][k]
+
+        self.daily = DailySnapshot.from_columns(market.dates, {
+            "open": market.open,
+            "high": market.high,
+            "low": market.low,
+            "close": market.close,
+            "cash_used": result["cash_used"],
+            "max_cash_used": result["max_cash_used"],
+            "holding_value": result["holding_value"],
+            "cash_balance": result["cash_balance"],
+        })
+        self.metrics_acc = MetricsAccumulator(self.initial_capital)
+        self.metrics_acc.update_many(self.daily.column("total_value"))
+        return self._summarize()
+
+    def _summarize(self) -> Dict:
+        """
+        根据交易流水与每日快照组装返回值（各引擎共用）
+        指标为 LazyMetrics：计数器与净值当场取值，XIRR 等在首次访问时才计算；build_frames=False 时不构建 DataFrame
+        """
+        df_trades = None
+        df_daily = None
+        if self.build_frames or self.verbose:
+            df_trades = pd.DataFrame(self.operate)       # 交易流水
+            df_daily = pd.DataFrame(self.daily.to_columns())  # 每日快照
         # 交易流水
         if self.verbose:
             self.print_trades_and_daily(df_trades, df_daily)
-        final_net_value = df_daily["total_value"].iloc[-1]
-
-        # --- 计算指标 ---
-        xirr_portfolio = None
-        mdd_peak = None # 修改变量名
-        mdd_initial = None # 新增变量
-        sharpe = None
-        vol = None
-        value_column_for_metrics = "total_value"
-        simple_return = (final_net_value - self.initial_capital) / self.initial_capital
-
-        if not df_daily.empty:
-            daily_values = df_daily[value_column_for_metrics]
-            try: xirr_portfolio = self.compute_xirr(df_trades, df_daily)
-            except Exception: xirr_portfolio = None # 保持不变
-            try: mdd_peak = self.max_drawdown_from_peak(daily_values)
-            except Exception: mdd_peak = None
-            try: mdd_initial = self.max_drawdown_from_initial(daily_values, self.initial_capital)
-            except Exception: mdd_initial = None
-            try: sharpe = self.compute_sharpe_from_daily(df_daily, value_col=value_column_for_metrics, risk_free_rate_annual=0.03)
-            except Exception: sharpe = None # 保持不变
-            try: vol = self.annual_volatility(df_daily, value_col=value_column_for_metrics)
-            except Exception: vol = None # 保持不变
 
         self.triggered_rows = len(self.triggered_set)
+        # 绑定本次回测的结果对象（start() 会换新对象），之后再访问惰性指标也不受影响
+        operate = self.operate
+        acc = self.metrics_acc
+        initial_capital = self.initial_capital
+        has_daily = len(self.daily) > 0
+        final_net_value = self.daily.column("total_value")[-1]
+        counters = {
+            "initial_capital": initial_capital,
+            "final_net_value": final_net_value,
+            "simple_return": (final_net_value - initial_capital) / initial_capital,
+            "max_cash_used": self.max_cash_used,
+            "sell_num": self.sell_num,
+            "buy_num": self.buy_num,
+            "triggered_rows": self.triggered_rows,
+            "buy_fail_num": self.buy_fail_num,
+        }
+
+        def xirr_portfolio():
+            if not has_daily:
+                return None
+            try:
+                if df_trades is not None:
+                    return self.compute_xirr(df_trades, df_daily)
+                if not operate:
+                    return None
+                return self._xirr_from_arrays(np.array([t["action"] for t in operate]),
+                                              np.array([t["amount"] for t in operate], dtype=float),
+                                              [t["date"] for t in operate])
+            except Exception:
+                return None
+
+        # 回撤 / 夏普 / 波动率已在逐日回测时由 metrics_acc 在线累计，这里 O(1) 取值
+        calculators = {name: (lambda value=value: value) for name, value in counters.items()}
+        calculators.update({
+            "xirr": xirr_portfolio,
+            "max_drawdown_peak": lambda: acc.max_drawdown_from_peak() if has_daily else None,
+            "max_drawdown_initial": lambda: acc.max_drawdown_from_initial() if has_daily else None,
+            "sharpe": lambda: acc.sharpe(risk_free_rate_annual=0.03) if has_daily else None,
+            "volatility": lambda: acc.annual_volatility() if has_daily else None,
+        })
+        all_metrics = LazyMetrics(calculators, METRIC_NAMES)
 
         # --- 修改：run_backtest 内部打印 ---
         if self.verbose:
             print("\n--- 回测指标 (内部打印) ---") # 可以加个标题区分
-            print(f"策略 XIRR: {xirr_portfolio}")
-            print(f"简单收益率: {simple_return}")
-            print(f"初始资金: {self.initial_capital}")
+            print(f"策略 XIRR: {all_metrics['xirr']}")
+            print(f"简单收益率: {all_metrics['simple_return']}")
+            print(f"初始资金: {initial_capital}")
             print(f"最终总资产: {final_net_value}")
             print(f"最大占用资金: {self.max_cash_used}")
-            print(f"最大回撤 (相对峰值): {mdd_peak}")
-            print(f"最大回撤 (相对初始): {mdd_initial}")
-            print(f"年化夏普比 (rf=0.03): {sharpe}")
-            print(f"年化波动率: {vol}")
+            print(f"最大回撤 (相对峰值): {all_metrics['max_drawdown_peak']}")
+            print(f"最大回撤 (相对初始): {all_metrics['max_drawdown_initial']}")
+            print(f"年化夏普比 (rf=0.03): {all_metrics['sharpe']}")
+            print(f"年化波动率: {all_metrics['volatility']}")
         # --- 修改结束 ---
 
         return {
-            "df_trades": df_trades,
-            "df_daily": df_daily,
-            "metrics": {
-                "initial_capital": self.initial_capital,
-                "simple_return": simple_return,
-                "final_net_value": final_net_value,
-                "max_cash_used":self.max_cash_used,
-                "xirr": xirr_portfolio,
-                "max_drawdown_peak": mdd_peak,
-                "max_drawdown_initial": mdd_initial,
-                "sharpe": sharpe,
-                "volatility": vol,
-                "sell_num":self.sell_num,
-                "buy_num":self.buy_num,
-                "triggered_rows": self.triggered_rows,
-                "buy_fail_num": self.buy_fail_num,
+            "df_trades": df_trades if self.build_frames else None,
+            "df_daily": df_daily if self.build_frames else None,
+            "metrics": all_metrics.select(self.metric_names),
+        }
+
+def _segment_starts(keys: np.ndarray) -> np.ndarray:
+    """已排序的 keys 中每一段的起始下标"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+
+
+def backtest_many(grid_data: Union[List[Dict], MarketArrays], strategies: List[List[Dict]], initial_capital=None,
+                  max_rows_per_chunk: Optional[int] = None, metrics: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    批量回测：同一段行情只解析一次，一次性评估多组网格策略，返回一张指标表
+    （每行一个策略，列与 BackTest.run_backtest()["metrics"] 的键相同）。
+
+    :param grid_data: 行情数据（IndexData.to_dict() 列表，按日期排序），也可直接传 MarketArrays（如 SharedMarketData.market()）
+    :param strategies: 网格策略列表，每个元素即 BackTest 的 grid_strategy
+    :param initial_capital: None 表示按各策略推断；也可传入单个数值或与 strategies 等长的列表
+    :param max_rows_per_chunk: 每批同时模拟的格子总数上限，控制每批事件数组以及 天 x 策略 资金/持股流水矩阵的内存
+    :param metrics: 只输出这些指标列（见 METRIC_NAMES），None 表示全部；未请求 xirr 时跳过 XIRR 求解
+
+    现金充足（不会出现买入失败）的策略走批量内核，数值与逐个 BackTest 在浮点舍入误差内一致；
+    可能出现资金不足的策略自动回退到 BackTest(engine="jit") 精确回测（未安装 numba 时即 numpy 引擎）。
+    """
+    market = grid_data if isinstance(grid_data, MarketArrays) else MarketArrays.from_grid_data(grid_data)
+    n_days = len(market)
+    n_strategies = len(strategies)
+    if initial_capital is None:
+        capitals = [infer_initial_capital(s) for s in strategies]
+    elif np.ndim(initial_capital) == 0:
+        capitals = [float(initial_capital)] * n_strategies
+    else:
+        capitals = [float(c) for c in initial_capital]
+        if len(capitals) != n_strategies:
+            raise ValueError("initial_capital 的长度必须与 strategies 一致")
+
+    if metrics is not None:
+        unknown = [name for name in metrics if name not in METRIC_NAMES]
+        if unknown:
+            raise ValueError(f"不支持的指标: {unknown}，可选: {METRIC_NAMES}")
+    columns = list(METRIC_NAMES if metrics is None else metrics)
+    if n_strategies == 0 or n_days == 0:
+        return pd.DataFrame(columns=columns)
+
+    grids = [GridArrays(s) for s in strategies]
+    if max_rows_per_chunk is None:
+        # 按 天 x 格子 约 4M 一批，成交事件与 天 x 策略 的 float64 流水矩阵都随之受限
+        max_rows_per_chunk = max(1, 4_000_000 // max(n_days, 1))
+
+    day_ordinal = pd.to_datetime(pd.Series(market.dates)).to_numpy().astype('datetime64[D]').astype(np.int64)
+    rf_per_period = (1 + 0.03) ** (1.0 / 252) - 1.0
+    records: List[Optional[Dict[str, Any]]] = [None] * n_strategies
+    fallback: List[int] = []
+
+    start = 0
+    while start < n_strategies:
+        end = start
+        rows_in_chunk = 0
+        while end < n_strategies and (end == start or rows_in_chunk + len(grids[end]) <= max_rows_per_chunk):
+            rows_in_chunk += len(grids[end])
+            end += 1
+        chunk_caps = np.array(capitals[start:end], dtype=float)
+        res = run_batch_engine(market, grids[start:end], chunk_caps)
+        n_chunk = end - start
+
+        ev_owner, ev_day, ev_is_buy, ev_row = res["ev_owner"], res["ev_day"], res["ev_is_buy"], res["ev_row"]
+        ev_amount, ev_cost = res["ev_amount"], res["ev_cost"]
+
+        # --- 校验现金是否始终充足：当日开盘现金 - 当日此前已买入金额 >= 本笔名义买入金额 ---
+        unsafe = np.zeros(n_chunk, dtype=bool)
+        buy_idx = np.flatnonzero(ev_is_buy)
+        if len(buy_idx):
+            b_owner, b_day = ev_owner[buy_idx], ev_day[buy_idx]
+            b_amount = ev_amount[buy_idx]
+            b_nominal = np.concatenate([g.buy_amount for g in grids[start:end]])[ev_row[buy_idx]]
+            seg = _segment_starts(b_owner * n_days + b_day)
+            seg_id = np.repeat(np.arange(len(seg)), np.diff(np.append(seg, len(buy_idx))))
+            cum = np.cumsum(b_amount)
+            spent_before = cum - b_amount - (cum[seg] - b_amount[seg])[seg_id]
+            available = res["cash_start"][b_day, b_owner] - spent_before
+            margin = 1e-9 * np.maximum(1.0, np.abs(chunk_caps[b_owner]))
+            np.logical_or.at(unsafe, b_owner, available - b_nominal < margin)
+
+        # --- 最大占用资金：按成交顺序累加占用资金，取每个策略的最大值 ---
+        used_delta = np.where(ev_is_buy, ev_amount, -ev_cost)
+        max_cash_used = np.zeros(n_chunk)
+        if len(ev_owner):
+            seg = _segment_starts(ev_owner)
+            cum = np.cumsum(used_delta)
+            offset = np.repeat(cum[seg] - used_delta[seg], np.diff(np.append(seg, len(ev_owner))))
+            np.maximum.at(max_cash_used, ev_owner, cum - offset)
+
+        buy_num = np.bincount(ev_owner[ev_is_buy], minlength=n_chunk)
+        regular_sell = ~ev_is_buy & (ev_day != n_days - 1) if n_days > 1 else ~ev_is_buy
+        sell_num = np.bincount(ev_owner[regular_sell], minlength=n_chunk)
+        sold_rows = np.unique(ev_row[~ev_is_buy])
+        triggered_rows = np.bincount(res["row_owner"][sold_rows], minlength=n_chunk)
+
+        # --- 净值序列相关指标（公式与 BackTest 的各指标函数一致） ---
+        values = res["holding_value"] + res["cash_balance"]
+        final_net_value = values[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            simple_return = (final_net_value - chunk_caps) / chunk_caps
+            peak = np.maximum.accumulate(values, axis=0)
+            mdd_peak = ((values - peak) / peak).min(axis=0)
+            mdd_initial = np.minimum(0.0, ((values - chunk_caps) / chunk_caps).min(axis=0))
+            if n_days >= 2:
+                returns = values[1:] / values[:-1] - 1.0
+                ret_std = returns.std(axis=0, ddof=1) if n_days > 2 else np.full(n_chunk, np.nan)
+                excess_mean = (returns - rf_per_period).mean(axis=0)
+                sharpe = excess_mean / ret_std * sqrt(252)
+                volatility = ret_std * np.sqrt(252)
+
+        # --- XIRR：每个策略的成交现金流（已按日期排序），整批向量化求解 ---
+        xirr_values = np.full(n_chunk, np.nan)
+        if "xirr" in columns:
+            flows = np.where(ev_is_buy, -ev_amount, ev_amount)
+            ev_ordinal = day_ordinal[ev_day]
+            first_ordinal = np.full(n_chunk, np.iinfo(np.int64).max)
+            np.minimum.at(first_ordinal, ev_owner, ev_ordinal)
+            xirr_values = xirr_batch(flows, (ev_ordinal - first_ordinal[ev_owner]) / 365.0, ev_owner, n_chunk)
+
+        for j in range(n_chunk):
+            k = start + j
+            if unsafe[j]:
+                fallback.append(k)
+                continue
+            std_ok = n_days >= 2 and not np.isnan(ret_std[j]) and ret_std[j] != 0
+            records[k] = {
+                "initial_capital": capitals[k],
+                "simple_return": float(simple_return[j]),
+                "final_net_value": float(final_net_value[j]),
+                "max_cash_used": float(max_cash_used[j]),
+                "xirr": None if np.isnan(xirr_values[j]) else float(xirr_values[j]),
+                "max_drawdown_peak": float(mdd_peak[j]),
+                "max_drawdown_initial": float(mdd_initial[j]) if capitals[k] > 0 else None,
+                "sharpe": float(sharpe[j]) if std_ok else None,
+                "volatility": float(volatility[j]) if n_days >= 2 else None,
+                "sell_num": int(sell_num[j]),
+                "buy_num": int(buy_num[j]),
+                "triggered_rows": int(triggered_rows[j]),
+                "buy_fail_num": 0,
             }
-        }
\ No newline at end of file
+        start = end
+
+    # 可能资金不足的策略逐个精确回测
+    if fallback and isinstance(grid_data, MarketArrays):
+        grid_data = market.to_grid_data()
+    for k in fallback:
+        backtest = BackTest(grid_data, strategies[k], capitals[k], verbose=False, engine="jit",
+                            metrics=columns, build_frames=False)
+        records[k] = backtest.run_backtest()["metrics"].to_dict()
+
+    return pd.DataFrame(records, columns=columns)
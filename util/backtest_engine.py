@@ -0,0 +1,1118 @@
+from typing import List, Dict, Any, Optional, Callable, Iterable
+from collections import OrderedDict
+from collections.abc import Mapping
+import hashlib
+from bisect import bisect_left, bisect_right
+from math import sqrt
+from operator import itemgetter
+import numpy as np
+
+# 交易动作 / 备注，与 BackTest.operate_buy_or_sell 写入流水的文字保持一致
+ACTION_BUY = "买入"
+ACTION_SELL = "卖出"
+NOTE_FIRST_DAY = "首日建仓"
+NOTE_BUY = "触发买入"
+NOTE_SELL = "触发卖出"
+NOTE_LAST_DAY = "最后一日清仓"
+
+# 格子状态码：0 未买过，1 持仓中，2 已卖出
+STATUS_NONE = 0
+STATUS_BOUGHT = 1
+STATUS_SOLD = 2
+
+
+STATUS_CODES = {None: STATUS_NONE, ACTION_BUY: STATUS_BOUGHT, ACTION_SELL: STATUS_SOLD}
+STATUS_TEXT = {STATUS_NONE: None, STATUS_BOUGHT: ACTION_BUY, STATUS_SOLD: ACTION_SELL}
+
+
+class PositionLedger:
+    """
+    紧凑的持仓台账：每个格子占一个槽位，shares / status / last_action_date / buy_price
+    存在按槽位下标的并行列表中，status 使用整数状态码。
+    (触发价, 格子ID) -> 槽位 只在需要时查一次，回测循环内直接按槽位读写。
+    """
+    __slots__ = ("slot_of", "keys", "shares", "status", "last_action_date", "buy_price")
+
+    def __init__(self):
+        self.slot_of: Dict[tuple, int] = {}
+        self.keys: List[tuple] = []
+        self.shares: List[Any] = []
+        self.status: List[int] = []
+        self.last_action_date: List[Any] = []
+        self.buy_price: List[Optional[float]] = []  # None 表示从未买入过
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, trigger, strategy_id, shares=0.0, status=STATUS_NONE, current_date=None) -> int:
+        """登记新格子，返回槽位下标（已存在则直接返回原槽位）"""
+        key = (trigger, strategy_id)
+        slot = self.slot_of.get(key)
+        if slot is not None:
+            return slot
+        slot = len(self.keys)
+        self.slot_of[key] = slot
+        self.keys.append(key)
+        self.shares.append(shares)
+        self.status.append(status)
+        self.last_action_date.append(current_date)
+        self.buy_price.append(None)
+        return slot
+
+    def slot(self, trigger, strategy_id) -> Optional[int]:
+        return self.slot_of.get((trigger, strategy_id))
+
+    def to_dict(self) -> Dict[Any, Dict[Any, Dict[str, Any]]]:
+        """还原为 { trigger: { strategy_id: {shares, status, last_action_date[, buy_price]} } } 结构"""
+        positions: Dict[Any, Dict[Any, Dict[str, Any]]] = {}
+        for slot, (trigger, sid) in enumerate(self.keys):
+            pos = {
+                'shares': self.shares[slot],
+                'status': STATUS_TEXT[self.status[slot]],
+                'last_action_date': self.last_action_date[slot],
+            }
+            if self.buy_price[slot] is not None:
+                pos['buy_price'] = self.buy_price[slot]
+            positions.setdefault(trigger, {})[sid] = pos
+        return positions
+
+
+class DailySnapshot:
+    """
+    每日快照：数值列写入预分配的二维数组（容量不足时翻倍扩容），日期单独存列表，
+    取代逐日 append 字典；total_value 在导出时按 holding_value + cash_balance 计算
+    """
+    COLUMNS = ("open", "high", "low", "close", "cash_used", "max_cash_used", "holding_value", "cash_balance")
+    __slots__ = ("dates", "values", "size")
+
+    def __init__(self, capacity: int = 0):
+        self.dates: List[Any] = []
+        self.values = np.empty((max(int(capacity), 1), len(self.COLUMNS)), dtype=float)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_columns(cls, dates: List[Any], columns: Dict[str, np.ndarray]) -> "DailySnapshot":
+        snapshot = cls(len(dates))
+        snapshot.dates = list(dates)
+        snapshot.size = len(dates)
+        for j, name in enumerate(cls.COLUMNS):
+            snapshot.values[:snapshot.size, j] = columns[name]
+        return snapshot
+
+    def record(self, date, open_p, high_p, low_p, close_p, cash_used, max_cash_used, holding_value, cash_balance):
+        if self.size == len(self.values):
+            grown = np.empty((len(self.values) * 2, len(self.COLUMNS)), dtype=float)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size] = (open_p, high_p, low_p, close_p, cash_used, max_cash_used, holding_value, cash_balance)
+        self.dates.append(date)
+        self.size += 1
+
+    def column(self, name: str) -> np.ndarray:
+        if name == "total_value":
+            return self.column("holding_value") + self.column("cash_balance")
+        return self.values[:self.size, self.COLUMNS.index(name)]
+
+    def to_columns(self) -> Dict[str, Any]:
+        """按 BackTest 每日快照的列顺序返回 {列名: 数组}（date 为列表）"""
+        columns: Dict[str, Any] = {"date": self.dates}
+        for name in self.COLUMNS:
+            columns[name] = self.column(name)
+        columns["total_value"] = self.column("total_value")
+        return columns
+
+
+class MetricsAccumulator:
+    """
+    单遍在线指标：每产生一日总资产就更新一次峰值、两种最大回撤与日收益率的 Welford 均值/方差，
+    回测结束时 O(1) 得到最大回撤、年化夏普比与年化波动率，不再复制 / 排序 / pct_change 每日快照。
+    口径与 BackTest.max_drawdown_from_peak / max_drawdown_from_initial / compute_sharpe_from_daily /
+    annual_volatility 一致（简单收益、样本标准差 ddof=1）。
+    """
+    __slots__ = ("initial_capital", "count", "last_value", "peak", "mdd_peak", "min_value",
+                 "n_returns", "mean_return", "m2_return")
+
+    def __init__(self, initial_capital: float):
+        self.initial_capital = initial_capital
+        self.count = 0
+        self.last_value = None
+        self.peak = None
+        self.mdd_peak = None        # (value - peak) / peak 的最小值
+        self.min_value = None       # 总资产最小值，用于相对初始资金的回撤
+        self.n_returns = 0          # 有效日收益率个数
+        self.mean_return = 0.0
+        self.m2_return = 0.0        # 与均值差的平方和
+
+    def update(self, value: float):
+        self.count += 1
+        if self.peak is None or value > self.peak:
+            self.peak = value
+        if self.peak != 0:
+            drawdown = (value - self.peak) / self.peak
+            if self.mdd_peak is None or drawdown < self.mdd_peak:
+                self.mdd_peak = drawdown
+        if self.min_value is None or value < self.min_value:
+            self.min_value = value
+
+        prev = self.last_value
+        self.last_value = value
+        if prev is None:
+            return
+        if prev == 0:
+            if value == 0:
+                return  # 0/0 在 pct_change 中为 NaN，会被 dropna 丢弃
+            ret = float("inf") if value > 0 else float("-inf")
+        else:
+            ret = value / prev - 1
+        self.n_returns += 1
+        delta = ret - self.mean_return
+        self.mean_return += delta / self.n_returns
+        self.m2_return += delta * (ret - self.mean_return)
+
+    def update_many(self, values):
+        """
+        一次追加多日总资产（数组引擎回测结束后使用）：峰值 / 回撤 / 最小值按数组计算，
+        Welford 部分仍逐个收益率累计，结果与逐日调用 update() 逐位一致
+        """
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        prev_peak = values[0] if self.peak is None else max(self.peak, values[0])
+        peaks = np.maximum.accumulate(np.concatenate(([prev_peak], values[1:])))
+        nonzero = peaks != 0
+        if nonzero.any():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                drawdown = float(((values[nonzero] - peaks[nonzero]) / peaks[nonzero]).min())
+            if self.mdd_peak is None or drawdown < self.mdd_peak:
+                self.mdd_peak = drawdown
+        self.peak = float(peaks[-1])
+        min_value = float(values.min())
+        if self.min_value is None or min_value < self.min_value:
+            self.min_value = min_value
+
+        prev = values[:-1] if self.last_value is None else np.concatenate(([self.last_value], values[:-1]))
+        current = values[1:] if self.last_value is None else values
+        self.count += len(values)
+        self.last_value = float(values[-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = current / prev - 1
+            zero_prev = prev == 0
+            if zero_prev.any():
+                # 0/0 在 pct_change 中为 NaN，会被 dropna 丢弃；x/0 为 ±inf
+                returns = np.where(zero_prev, np.sign(current) * np.inf, returns)[~(zero_prev & (current == 0))]
+
+        n, mean, m2 = self.n_returns, self.mean_return, self.m2_return
+        for ret in returns.tolist():
+            n += 1
+            delta = ret - mean
+            mean += delta / n
+            m2 += delta * (ret - mean)
+        self.n_returns, self.mean_return, self.m2_return = n, mean, m2
+
+    def max_drawdown_from_peak(self) -> Optional[float]:
+        return self.mdd_peak
+
+    def max_drawdown_from_initial(self) -> Optional[float]:
+        if self.count == 0 or self.initial_capital <= 0:
+            return None
+        return float(min(0, (self.min_value - self.initial_capital) / self.initial_capital))
+
+    def return_std(self) -> Optional[float]:
+        if self.n_returns < 2:
+            return None
+        return sqrt(self.m2_return / (self.n_returns - 1))
+
+    def sharpe(self, risk_free_rate_annual: float = 0.0, periods_per_year: int = 252) -> Optional[float]:
+        std = self.return_std()
+        if std is None or std == 0 or np.isnan(std):
+            return None
+        rf_per_period = (1 + risk_free_rate_annual) ** (1.0 / periods_per_year) - 1.0
+        return float((self.mean_return - rf_per_period) / std * sqrt(periods_per_year))
+
+    def annual_volatility(self, periods_per_year: int = 252) -> Optional[float]:
+        # 同 BackTest.annual_volatility：不足两天为 None；有两天以上但收益率不足两个时样本标准差为 NaN（而不是 None）
+        if self.count < 2:
+            return None
+        std = self.return_std()
+        if std is None:
+            return float("nan")
+        return float(std * np.sqrt(periods_per_year))
+
+    def get_state(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "MetricsAccumulator":
+        acc = cls(state["initial_capital"])
+        for name in cls.__slots__:
+            setattr(acc, name, state[name])
+        return acc
+
+
+# BackTest.run_backtest()["metrics"] 的全部指标名（顺序即输出顺序）
+METRIC_NAMES = ("initial_capital", "simple_return", "final_net_value", "max_cash_used", "xirr",
+                "max_drawdown_peak", "max_drawdown_initial", "sharpe", "volatility",
+                "sell_num", "buy_num", "triggered_rows", "buy_fail_num")
+
+
+class LazyMetrics(Mapping):
+    """
+    惰性指标字典：只包含请求的指标名，首次访问时才调用对应的计算函数并缓存结果，
+    用法与普通 dict 相同（get / items / [] / ==），需要真正的 dict 时调用 to_dict()
+    """
+    __slots__ = ("_calculators", "_names", "_values")
+
+    def __init__(self, calculators: Dict[str, Callable[[], Any]], names: Optional[Iterable[str]] = None):
+        self._calculators = calculators
+        self._names = tuple(calculators) if names is None else tuple(names)
+        self._values: Dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._names:
+            raise KeyError(name)
+        if name not in self._values:
+            self._values[name] = self._calculators[name]()
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def select(self, names: Iterable[str]) -> "LazyMetrics":
+        """只保留部分指标的视图，与原对象共用计算函数与缓存"""
+        view = LazyMetrics(self._calculators, names)
+        view._values = self._values
+        return view
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: self[name] for name in self._names}
+
+
+def _to_float_array(values) -> np.ndarray:
+    """把可能含 None 的序列转成 float 数组（None -> NaN，NaN 参与比较恒为 False）"""
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+
+class PriceLevelIndex:
+    """
+    按价格排序的格子下标索引，二分查找价格落在 [low, high] 内的格子，
+    单根K线的开销为 O(log n + k)，k 为命中的格子数（None 价格的格子不入索引）
+    """
+    def __init__(self, prices: List[Optional[float]]):
+        pairs = sorted((float(p), k) for k, p in enumerate(prices) if p is not None)
+        self.levels = [p for p, _ in pairs]
+        self.rows = [k for _, k in pairs]
+
+    def rows_between(self, low: float, high: float) -> List[int]:
+        """返回价格在 [low, high] 内的格子下标（按价格排序）"""
+        return self.rows[bisect_left(self.levels, low):bisect_right(self.levels, high)]
+
+
+class MarketArrays:
+    """
+    行情的数组形式：日期列表 + open/high/low/close 四个 float 数组
+    由 IndexData.to_dict() 得到的 grid_data 一次性转换而来
+    """
+    def __init__(self, dates: List[Any], open_p: np.ndarray, high_p: np.ndarray, low_p: np.ndarray, close_p: np.ndarray,
+                 import_id: Optional[int] = None):
+        self.dates = dates
+        self.open = open_p
+        self.high = high_p
+        self.low = low_p
+        self.close = close_p
+        self.import_id = import_id
+        self._key = None
+        self._mid_touch = None
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def key(self) -> tuple:
+        """
+        行情标识：(import_id, 天数, OHLC 内容摘要)，用作逐格成交计划缓存键的一部分
+        带上内容摘要，截取的子区间或重新导入后复用的 import_id 不会误命中
+        """
+        if self._key is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for values in (self.open, self.high, self.low, self.close):
+                digest.update(np.ascontiguousarray(values).tobytes())
+            self._key = (self.import_id, len(self), digest.hexdigest())
+        return self._key
+
+    @property
+    def mid_touch(self) -> "FirstTouchIndex":
+        """中间日（第 1 ~ n-2 天）的首次触及索引，首次使用时构建"""
+        if self._mid_touch is None:
+            self._mid_touch = FirstTouchIndex(self.low[1:-1], self.high[1:-1])
+        return self._mid_touch
+
+    @classmethod
+    def from_grid_data(cls, grid_data: List[Dict]) -> "MarketArrays":
+        n = len(grid_data)
+        return cls(
+            import_id=grid_data[0].get('import_id') if grid_data else None,
+            dates=[grid['date'] for grid in grid_data],
+            open_p=np.fromiter(map(itemgetter('open_price'), grid_data), dtype=float, count=n),
+            high_p=np.fromiter(map(itemgetter('high_price'), grid_data), dtype=float, count=n),
+            low_p=np.fromiter(map(itemgetter('low_price'), grid_data), dtype=float, count=n),
+            close_p=np.fromiter(map(itemgetter('close_price'), grid_data), dtype=float, count=n),
+        )
+
+    @classmethod
+    def from_ohlc(cls, ohlc: Dict[str, Any]) -> "MarketArrays":
+        """由 DBSessionManager.load_ohlc() 的返回值构造（数组直接引用，不复制）"""
+        return cls(dates=ohlc["date"], open_p=ohlc["open"], high_p=ohlc["high"], low_p=ohlc["low"],
+                   close_p=ohlc["close"], import_id=ohlc.get("import_id"))
+
+    def to_grid_data(self) -> List[Dict]:
+        """还原为 BackTest 可用的行情字典列表（只含 date / import_id 与 OHLC 字段）"""
+        return [{
+            "import_id": self.import_id,
+            "date": d,
+            "open_price": o,
+            "high_price": h,
+            "low_price": l,
+            "close_price": c,
+        } for d, o, h, l, c in zip(self.dates, self.open.tolist(), self.high.tolist(), self.low.tolist(), self.close.tolist())]
+
+
+class FirstTouchIndex:
+    """
+    low / high 的区间最值稀疏表：min_low[j][i] = min(low[i : i + 2^j])，max_high 同理，构建 O(n log n)。
+    first_touch() 对一批 (起始日, 价位) 同时查询“起始日及之后第一个 low <= 下限且 high >= 上限的日子”，
+    每次查询 O(log n)，回测可以从一笔成交直接跳到该格子下一次可能成交的日子，而不必逐日扫描。
+    各层数组末尾用 +inf / -inf 补齐到同一长度，跳跃时无需判断越界（越过末尾即表示之后再无命中）。
+    """
+    def __init__(self, low: np.ndarray, high: np.ndarray):
+        self.n = len(low)
+        levels = max(self.n, 1).bit_length()
+        size = self.n + (1 << (levels + 1)) + 1
+        min_low = np.full(size, np.inf)
+        max_high = np.full(size, -np.inf)
+        min_low[:self.n] = low
+        max_high[:self.n] = high
+        self.min_low = [min_low]
+        self.max_high = [max_high]
+        for j in range(1, levels):
+            half = 1 << (j - 1)
+            prev_low, prev_high = self.min_low[-1], self.max_high[-1]
+            next_low, next_high = np.full(size, np.inf), np.full(size, -np.inf)
+            next_low[:-half] = np.minimum(prev_low[:-half], prev_low[half:])
+            next_high[:-half] = np.maximum(prev_high[:-half], prev_high[half:])
+            self.min_low.append(next_low)
+            self.max_high.append(next_high)
+
+    def _first(self, table: List[np.ndarray], start: np.ndarray, level: np.ndarray, at_most: bool) -> np.ndarray:
+        """倍增跳跃：从 start 起整块跳过不满足条件的日子，返回第一个 low <= level（或 high >= level）的下标，无则为 n"""
+        pos = start.copy()
+        for j in range(len(table) - 1, -1, -1):
+            values = table[j][pos]
+            pos += (1 << j) * ((values > level) if at_most else (values < level))
+        return np.minimum(pos, self.n)
+
+    def first_touch(self, start: np.ndarray, low_level: np.ndarray, high_level: np.ndarray) -> np.ndarray:
+        """返回 start 及之后第一个 low <= low_level 且 high >= high_level 的下标，无则为 n（价位为 NaN 时恒为 n）"""
+        start = np.asarray(start, dtype=np.int64)
+        result = np.full(len(start), self.n, dtype=np.int64)
+        if self.n == 0 or len(start) == 0:
+            return result
+        cur = start.copy()
+        active = (cur < self.n) & ~np.isnan(low_level) & ~np.isnan(high_level)
+        while active.any():
+            idx = np.flatnonzero(active)
+            first_low = self._first(self.min_low, cur[idx], low_level[idx], at_most=True)
+            first_high = self._first(self.max_high, cur[idx], high_level[idx], at_most=False)
+            # 两个条件各自最早满足的日子相同即为命中；否则较早的那个条件在较晚日子之前都无法同时满足
+            nxt = np.maximum(first_low, first_high)
+            hit = (first_low == first_high) & (nxt < self.n)
+            result[idx[hit]] = nxt[hit]
+            cur[idx] = nxt
+            active[idx] = ~hit & (nxt < self.n)
+        return result
+
+
+class GridArrays:
+    """
+    网格策略的数组形式，每个有效格子（有 buy_trigger_price 与 id）占一个下标
+    raw_* 保留原始值，用于写交易流水，保证与 BackTest 的流水字段完全一致
+    """
+    def __init__(self, grid_strategy: List[Dict]):
+        rows = [s for s in grid_strategy if s.get('buy_trigger_price') is not None and s.get('id') is not None]
+        self.ids = [s.get('id') for s in rows]
+        self.raw_buy_trigger = [s.get('buy_trigger_price') for s in rows]
+        self.raw_buy_price = [s.get('buy_price') for s in rows]
+        self.raw_sell_price = [s.get('sell_price') for s in rows]
+        self.buy_trigger = _to_float_array(self.raw_buy_trigger)
+        self.buy_price = _to_float_array(self.raw_buy_price)
+        self.sell_trigger = _to_float_array([s.get('sell_trigger_price') for s in rows])
+        self.sell_price = _to_float_array(self.raw_sell_price)
+        self.buy_amount = np.array([float(s.get('buy_amount', 0)) for s in rows], dtype=float)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def run_numpy_engine(market: MarketArrays, grid: GridArrays, initial_capital: float) -> Dict[str, Any]:
+    """
+    数组化的网格回测内核，规则与 BackTest.run_backtest 逐条对应：
+    - 首日：开盘价 <= 触发价且 <= 买入价时按开盘价成交，否则当日区间覆盖触发价与买入价时按买入价成交
+    - 中间日：同一格子先判断卖出再判断买入，买入当天不能卖出
+    - 最后一日：所有持仓清仓（开盘价 / 卖出价 / 收盘价）
+
+    触发条件先对 天 x 格子 整体做数组比较，逐日只遍历真正命中的格子；
+    现金按原有顺序逐笔记账，因此资金不足的判断与原引擎完全一致。
+    """
+    n_days = len(market)
+    n_rows = len(grid)
+    open_a, high_a, low_a, close_a = market.open, market.high, market.low, market.close
+    bt, bp, st, sp = grid.buy_trigger, grid.buy_price, grid.sell_trigger, grid.sell_price
+    buy_amounts = grid.buy_amount.tolist()
+
+    # 逐格状态用 Python 列表保存，标量读写比 numpy 下标快
+    status = [STATUS_NONE] * n_rows
+    shares: List[Any] = [0.0] * n_rows
+    held_buy_price = [0.0] * n_rows
+    last_day = [-1] * n_rows
+    # 每日持股总数的变化量，持仓市值 = 累计持股总数 * 收盘价
+    share_delta = np.zeros(n_days, dtype=float)
+
+    trade_day: List[int] = []
+    trade_row: List[int] = []
+    trades: List[Dict[str, Any]] = []
+    cash_balance = float(initial_capital)
+    cash_used = 0.0
+    max_cash_used = 0.0
+    buy_num = sell_num = buy_fail_num = 0
+    triggered = set()
+
+    # 逐日的资金状态只在有成交的日子记录，之后向前填充
+    state_day: List[int] = []
+    state_values: List[tuple] = []
+
+    def buy(i, k, executed_price, note):
+        nonlocal cash_balance, cash_used, max_cash_used, buy_num, buy_fail_num
+        buy_amount = buy_amounts[k]
+        if cash_balance < buy_amount:
+            buy_fail_num += 1
+            return
+        actual_shares = int(buy_amount / executed_price) if executed_price > 0 else 0
+        amount = actual_shares * executed_price
+        share_delta[i] += actual_shares - shares[k]
+        shares[k] = actual_shares
+        status[k] = STATUS_BOUGHT
+        last_day[k] = i
+        held_buy_price[k] = executed_price
+        trades.append({
+            "date": market.dates[i],
+            "action": ACTION_BUY,
+            "strategy_id": grid.ids[k],
+            "trigger": grid.raw_buy_trigger[k],
+            "executed_price": executed_price,
+            "shares": actual_shares,
+            "amount": amount,
+            "note": note,
+        })
+        trade_day.append(i)
+        trade_row.append(k)
+        cash_used += amount
+        max_cash_used = max(max_cash_used, cash_used)
+        cash_balance -= amount
+        buy_num += 1
+
+    def sell(i, k, executed_price, note, is_last_day):
+        nonlocal cash_balance, cash_used, max_cash_used, sell_num
+        sell_shares = shares[k]
+        sell_amount = sell_shares * executed_price
+        share_delta[i] -= sell_shares
+        shares[k] = 0.0
+        status[k] = STATUS_SOLD
+        last_day[k] = i
+        trades.append({
+            "date": market.dates[i],
+            "action": ACTION_SELL,
+            "strategy_id": grid.ids[k],
+            "trigger": grid.raw_buy_trigger[k],
+            "executed_price": executed_price,
+            "shares": sell_shares,
+            "amount": sell_amount,
+            "note": note,
+        })
+        trade_day.append(i)
+        trade_row.append(k)
+        triggered.add(grid.ids[k])
+        cash_used -= held_buy_price[k] * sell_shares
+        max_cash_used = max(max_cash_used, cash_used)
+        cash_balance += sell_amount
+        if not is_last_day:
+            sell_num += 1
+
+    if n_days > 0 and n_rows > 0:
+        # --- 首日建仓 ---
+        o, h, l = float(open_a[0]), float(high_a[0]), float(low_a[0])
+        first_open = ((o <= bt) & (o <= bp)).tolist()
+        first_limit = ((l <= bt) & (bt <= h) & (l <= bp) & (bp <= h)).tolist()
+        for k in range(n_rows):
+            if first_open[k]:
+                buy(0, k, o, NOTE_FIRST_DAY)
+            elif first_limit[k]:
+                buy(0, k, grid.raw_buy_price[k], NOTE_FIRST_DAY)
+        state_day.append(0)
+        state_values.append((cash_used, max_cash_used, cash_balance))
+
+        # --- 中间日：先整体算出 天 x 格子 的触发矩阵，逐日只遍历命中的格子 ---
+        if n_days > 2:
+            h2 = high_a[1:-1, None]
+            l2 = low_a[1:-1, None]
+            sell_hit = (h2 >= st) & (l2 <= sp) & (sp <= h2)
+            buy_hit = (l2 <= bt) & (bt <= h2) & (l2 <= bp) & (bp <= h2)
+            cand_days, cand_rows = np.nonzero(sell_hit | buy_hit)
+            cand_sell = sell_hit[cand_days, cand_rows].tolist()
+            cand_buy = buy_hit[cand_days, cand_rows].tolist()
+            cand_days = (cand_days + 1).tolist()
+            cand_rows = cand_rows.tolist()
+            n_cand = len(cand_days)
+            for j in range(n_cand):
+                i = cand_days[j]
+                k = cand_rows[j]
+                if cand_sell[j] and status[k] == STATUS_BOUGHT and last_day[k] != i:
+                    sell(i, k, grid.raw_sell_price[k], NOTE_SELL, False)
+                if cand_buy[j] and status[k] != STATUS_BOUGHT:
+                    buy(i, k, grid.raw_buy_price[k], NOTE_BUY)
+                # 当日最后一个候选格子处理完后记录资金状态
+                if j == n_cand - 1 or cand_days[j + 1] != i:
+                    state_day.append(i)
+                    state_values.append((cash_used, max_cash_used, cash_balance))
+
+        # --- 最后一日清仓 ---
+        if n_days > 1:
+            i = n_days - 1
+            o, h, l, c = float(open_a[i]), float(high_a[i]), float(low_a[i]), float(close_a[i])
+            for k in range(n_rows):
+                if status[k] != STATUS_BOUGHT:
+                    continue
+                if o >= st[k] and o >= sp[k]:
+                    executed_price = o
+                elif h >= st[k]:
+                    executed_price = grid.raw_sell_price[k] if l <= sp[k] <= h else c
+                else:
+                    executed_price = c
+                sell(i, k, executed_price, NOTE_LAST_DAY, True)
+            state_day.append(i)
+            state_values.append((cash_used, max_cash_used, cash_balance))
+
+    # --- 每日快照 ---
+    if state_day:
+        idx = np.searchsorted(np.array(state_day), np.arange(n_days), side='right') - 1
+        values = np.array(state_values, dtype=float)[idx]
+        daily_cash_used, daily_max_cash_used, daily_cash_balance = values[:, 0], values[:, 1], values[:, 2]
+    else:
+        daily_cash_used = np.zeros(n_days)
+        daily_max_cash_used = np.zeros(n_days)
+        daily_cash_balance = np.full(n_days, float(initial_capital))
+
+    # 持股数均为整数，累加无舍入误差，与逐笔维护持股总数的 python 引擎逐位一致
+    shares_held = np.cumsum(share_delta)
+    holding_value = shares_held * close_a
+
+    return {
+        "trades": trades,
+        "trade_day": np.array(trade_day, dtype=np.int64),
+        "trade_row": np.array(trade_row, dtype=np.int64),
+        "cash_used": daily_cash_used,
+        "max_cash_used": daily_max_cash_used,
+        "holding_value": holding_value,
+        "cash_balance": daily_cash_balance,
+        "status": status,
+        "shares": shares,
+        "buy_price": held_buy_price,
+        "last_day": last_day,
+        "final_cash_used": cash_used,
+        "final_max_cash_used": max_cash_used,
+        "final_cash_balance": cash_balance,
+        "final_shares_held": float(shares_held[-1]) if n_days else 0.0,
+        "buy_num": buy_num,
+        "sell_num": sell_num,
+        "buy_fail_num": buy_fail_num,
+        "triggered_set": triggered,
+    }
+
+
+class RowScheduleCache:
+    """
+    逐格成交计划的 LRU 缓存：键为 (买入触发价, 买入价, 卖出触发价, 卖出价, 买入金额, 行情标识)，
+    值为该格子在这段行情上的成交计划 (days, is_buy, prices, shares)。
+    参数扫描中大量策略共用相同的格子（如首行触发价与 a 相同、行数不同），命中后无需重新模拟。
+    """
+    def __init__(self, max_entries: int = 200_000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        schedule = self.entries.get(key)
+        if schedule is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return schedule
+
+    def put(self, key: tuple, schedule: tuple):
+        self.entries[key] = schedule
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# 进程内共享的成交计划缓存（BackTest(engine="rows") 默认使用）
+ROW_SCHEDULE_CACHE = RowScheduleCache()
+
+
+# 成交价来源：当日行情价（开盘 / 收盘）、格子的买入价、格子的卖出价
+PRICE_MARKET = 0
+PRICE_BUY = 1
+PRICE_SELL = 2
+
+
+def simulate_rows(market: MarketArrays, bt: np.ndarray, bp: np.ndarray, st: np.ndarray, sp: np.ndarray,
+                  amt: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    现金充足时一批格子各自的 买入 -> 卖出 -> 买入 ... 循环（规则同 run_numpy_engine），事件驱动：
+    每一轮所有格子同时用 FirstTouchIndex 跳到各自的下一笔成交日，开销与成交笔数成正比，而不是 天数 x 格子数。
+    返回全部成交事件（未排序）：row / day / is_buy / price / shares / cost / price_kind
+    """
+    n_days = len(market)
+    n_rows = len(bt)
+    ev_row, ev_day, ev_is_buy, ev_price, ev_shares, ev_cost, ev_kind = [], [], [], [], [], [], []
+
+    def record(rows, day, is_buy, price, shares, cost, kind):
+        ev_row.append(rows)
+        ev_day.append(np.broadcast_to(day, rows.shape).astype(np.int64))
+        ev_is_buy.append(np.full(rows.shape, is_buy))
+        ev_price.append(np.broadcast_to(price, rows.shape).astype(float))
+        ev_shares.append(shares)
+        ev_cost.append(cost)
+        ev_kind.append(np.broadcast_to(kind, rows.shape).astype(np.int8))
+
+    def shares_for(rows, price):
+        # 与 int(buy_amount / executed_price) 一致：正数向零取整，非正价格不买
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = np.where(price > 0, np.trunc(amt[rows] / price), 0.0)
+        return s
+
+    if n_days > 0 and n_rows > 0:
+        held = np.zeros(n_rows, dtype=bool)
+        held_shares = np.zeros(n_rows)
+        held_price = np.zeros(n_rows)
+
+        # --- 首日建仓 ---
+        o, h, l = market.open[0], market.high[0], market.low[0]
+        open_fill = (o <= bt) & (o <= bp)
+        limit_fill = ~open_fill & (l <= bt) & (bt <= h) & (l <= bp) & (bp <= h)
+        for mask, price, kind in ((open_fill, np.full(n_rows, o), PRICE_MARKET), (limit_fill, bp, PRICE_BUY)):
+            rows = np.flatnonzero(mask)
+            if len(rows):
+                p = price[rows]
+                s = shares_for(rows, p)
+                record(rows, 0, True, p, s, s * p, kind)
+                held[rows] = True
+                held_shares[rows] = s
+                held_price[rows] = p
+
+        # --- 中间日：逐轮跳到每个格子的下一笔成交 ---
+        if n_days > 2:
+            touch = market.mid_touch
+            n_mid = n_days - 2
+            # 买入：low <= min(触发价, 买入价) 且 high >= max(触发价, 买入价)
+            # 卖出：low <= 卖出价 且 high >= max(卖出触发价, 卖出价)（NaN 经 minimum / maximum 传递，永不触发）
+            buy_low, buy_high = np.minimum(bt, bp), np.maximum(bt, bp)
+            sell_low, sell_high = sp, np.maximum(st, sp)
+            # cur 为中间日下标（0 对应第 1 天）；持仓格子不能在买入当天卖出
+            cur = np.zeros(n_rows, dtype=np.int64)
+            active = np.arange(n_rows)
+            while len(active):
+                is_held = held[active]
+                # 持仓格子找下一个卖出日，空仓格子找下一个买入日
+                sell_rows = active[is_held]
+                buy_rows = active[~is_held]
+                nxt_sell = touch.first_touch(cur[sell_rows], sell_low[sell_rows], sell_high[sell_rows])
+                nxt_buy = touch.first_touch(cur[buy_rows], buy_low[buy_rows], buy_high[buy_rows])
+
+                ok = nxt_sell < n_mid
+                rows, days = sell_rows[ok], nxt_sell[ok]
+                if len(rows):
+                    p = sp[rows]
+                    s = held_shares[rows]
+                    record(rows, days + 1, False, p, s, held_price[rows] * s, PRICE_SELL)
+                    held[rows] = False
+                    held_shares[rows] = 0.0
+                    cur[rows] = days  # 卖出当天仍可再次买入
+
+                ok_b = nxt_buy < n_mid
+                rows_b, days_b = buy_rows[ok_b], nxt_buy[ok_b]
+                if len(rows_b):
+                    p = bp[rows_b]
+                    s = shares_for(rows_b, p)
+                    record(rows_b, days_b + 1, True, p, s, s * p, PRICE_BUY)
+                    held[rows_b] = True
+                    held_shares[rows_b] = s
+                    held_price[rows_b] = p
+                    cur[rows_b] = days_b + 1
+
+                active = np.concatenate((rows, rows_b))
+
+        # --- 最后一日清仓 ---
+        if n_days > 1:
+            i = n_days - 1
+            o, h, l, c = market.open[i], market.high[i], market.low[i], market.close[i]
+            rows = np.flatnonzero(held)
+            if len(rows):
+                at_open = (o >= st[rows]) & (o >= sp[rows])
+                at_sell = ~at_open & (h >= st[rows]) & (l <= sp[rows]) & (sp[rows] <= h)
+                p = np.where(at_open, o, np.where(at_sell, sp[rows], c))
+                s = held_shares[rows]
+                record(rows, i, False, p, s, held_price[rows] * s, np.where(at_sell, PRICE_SELL, PRICE_MARKET))
+
+    if ev_row:
+        return {
+            "row": np.concatenate(ev_row),
+            "day": np.concatenate(ev_day),
+            "is_buy": np.concatenate(ev_is_buy),
+            "price": np.concatenate(ev_price),
+            "shares": np.concatenate(ev_shares),
+            "cost": np.concatenate(ev_cost),
+            "price_kind": np.concatenate(ev_kind),
+        }
+    empty_int = np.empty(0, dtype=np.int64)
+    return {"row": empty_int, "day": empty_int, "is_buy": np.empty(0, dtype=bool), "price": np.empty(0),
+            "shares": np.empty(0), "cost": np.empty(0), "price_kind": np.empty(0, dtype=np.int8)}
+
+
+def simulate_row(market: MarketArrays, grid: GridArrays, k: int) -> tuple:
+    """
+    现金充足时单个格子的完整 买入 -> 卖出 -> 买入 ... 循环（规则同 run_numpy_engine），
+    返回成交计划 (days, is_buy, prices, shares)，价格与股数与逐格引擎写入流水的值完全相同
+    """
+    n_days = len(market)
+    bt, bp = grid.buy_trigger[k], grid.buy_price[k]
+    st, sp = grid.sell_trigger[k], grid.sell_price[k]
+    buy_amount = float(grid.buy_amount[k])
+    raw_bp, raw_sp = grid.raw_buy_price[k], grid.raw_sell_price[k]
+    days: List[int] = []
+    is_buy: List[bool] = []
+    prices: List[Any] = []
+    shares: List[Any] = []
+    if n_days == 0:
+        return days, is_buy, prices, shares
+
+    def buy(i, executed_price):
+        days.append(i)
+        is_buy.append(True)
+        prices.append(executed_price)
+        shares.append(int(buy_amount / executed_price) if executed_price > 0 else 0)
+
+    def sell(i, executed_price):
+        days.append(i)
+        is_buy.append(False)
+        prices.append(executed_price)
+        shares.append(shares[-1])
+
+    # --- 首日建仓 ---
+    o, h, l = float(market.open[0]), float(market.high[0]), float(market.low[0])
+    if o <= bt and o <= bp:
+        buy(0, o)
+    elif l <= bt <= h and l <= bp <= h:
+        buy(0, raw_bp)
+    held = bool(days)
+
+    # --- 中间日：在该格子的触发日列表上交替查找下一次卖出 / 买入 ---
+    if n_days > 2:
+        h2, l2 = market.high[1:-1], market.low[1:-1]
+        sell_days = (np.flatnonzero((h2 >= st) & (l2 <= sp) & (sp <= h2)) + 1).tolist()
+        buy_days = (np.flatnonzero((l2 <= bt) & (bt <= h2) & (l2 <= bp) & (bp <= h2)) + 1).tolist()
+        cur = 1
+        while True:
+            if held:
+                j = bisect_left(sell_days, cur)  # 买入当天不能卖出：cur 已是买入日的下一天
+                if j == len(sell_days):
+                    break
+                sell(sell_days[j], raw_sp)
+                held = False
+                cur = sell_days[j]  # 卖出当天仍可再次买入
+            else:
+                j = bisect_left(buy_days, cur)
+                if j == len(buy_days):
+                    break
+                buy(buy_days[j], raw_bp)
+                held = True
+                cur = buy_days[j] + 1
+
+    # --- 最后一日清仓 ---
+    if n_days > 1 and held:
+        i = n_days - 1
+        o, h, l, c = float(market.open[i]), float(market.high[i]), float(market.low[i]), float(market.close[i])
+        if o >= st and o >= sp:
+            sell(i, o)
+        elif h >= st:
+            sell(i, raw_sp if l <= sp <= h else c)
+        else:
+            sell(i, c)
+    return days, is_buy, prices, shares
+
+
+# 一次模拟的格子数达到该值时改用事件驱动的 simulate_rows（每轮的固定开销被大量格子摊薄），
+# 格子较少时逐格扫描触发日（simulate_row）更快
+EVENT_DRIVEN_MIN_ROWS = 512
+
+
+def row_schedules(market: MarketArrays, grid: GridArrays, rows: List[int]) -> List[tuple]:
+    """
+    计算 grid 中若干格子的成交计划 (days, is_buy, prices, shares)。
+    格子多时一起调用 simulate_rows，再拆成每个格子的计划，价格按来源换回格子的原始值（与逐格引擎写入流水的值完全相同），股数为 int
+    """
+    if len(rows) < EVENT_DRIVEN_MIN_ROWS:
+        return [simulate_row(market, grid, k) for k in rows]
+    idx = np.asarray(rows, dtype=np.int64)
+    events = simulate_rows(market, grid.buy_trigger[idx], grid.buy_price[idx], grid.sell_trigger[idx],
+                           grid.sell_price[idx], grid.buy_amount[idx])
+    order = np.lexsort((events["is_buy"], events["day"], events["row"]))  # 每个格子内按日期，同一天先卖后买
+    schedules = [([], [], [], []) for _ in rows]
+    for j, i, is_buy, price, shares, kind in zip(events["row"][order].tolist(), events["day"][order].tolist(),
+                                                 events["is_buy"][order].tolist(), events["price"][order].tolist(),
+                                                 events["shares"][order].tolist(), events["price_kind"][order].tolist()):
+        k = rows[j]
+        if kind == PRICE_BUY:
+            price = grid.raw_buy_price[k]
+        elif kind == PRICE_SELL:
+            price = grid.raw_sell_price[k]
+        days, buys, prices, share_list = schedules[j]
+        days.append(i)
+        buys.append(is_buy)
+        prices.append(price)
+        share_list.append(int(shares))
+    return schedules
+
+
+def cash_never_binds(grid: GridArrays, initial_capital: float) -> bool:
+    """
+    判断资金是否永远不会不足（买入检查 cash_balance < buy_amount 恒不成立）：
+    初始资金 >= 所有格子买入金额之和，且每个格子卖出价 >= 买入价（首日按开盘价买入时开盘价 <= 买入价），
+    此时每笔卖出的已实现盈亏非负，任一格子买入时的现金 >= 初始资金 - 其余格子占用 >= 本格买入金额
+    """
+    if len(grid) == 0:
+        return True
+    return bool(initial_capital >= float(np.sum(grid.buy_amount)) and np.all(grid.sell_price >= grid.buy_price))
+
+
+def run_row_engine(market: MarketArrays, grid: GridArrays, initial_capital: float,
+                   cache: Optional[RowScheduleCache] = None) -> Dict[str, Any]:
+    """
+    按格子分解的回测内核：现金充足时各格子互不影响，逐格取成交计划（优先查缓存），
+    再按 日期 -> 格子 -> 先卖后买 合并成交易序列。
+    资金记账不再逐笔进行：现金 / 占用资金按成交顺序用 cumsum 累加（与逐笔加减的浮点结果逐位一致），
+    再整体核对每笔买入前的现金是否 >= 买入金额；一旦有一笔不满足（格子之间不再独立），回退到 run_numpy_engine。
+    """
+    if cache is None:
+        cache = ROW_SCHEDULE_CACHE
+    n_days = len(market)
+    n_rows = len(grid)
+    market_key = market.key
+
+    keys = [(grid.raw_buy_trigger[k], grid.raw_buy_price[k], float(grid.sell_trigger[k]), grid.raw_sell_price[k],
+             float(grid.buy_amount[k]), market_key) for k in range(n_rows)]
+    schedules = [cache.get(key) for key in keys]
+    missing = [k for k in range(n_rows) if schedules[k] is None]
+    if missing:
+        for k, schedule in zip(missing, row_schedules(market, grid, missing)):
+            schedules[k] = schedule
+            cache.put(keys[k], schedule)
+
+    ev_day: List[int] = []
+    ev_row: List[int] = []
+    ev_buy: List[bool] = []
+    ev_price: List[Any] = []
+    ev_shares: List[Any] = []
+    for k in range(n_rows):
+        days, is_buy, prices, shares = schedules[k]
+        ev_day.extend(days)
+        ev_buy.extend(is_buy)
+        ev_price.extend(prices)
+        ev_shares.extend(shares)
+        ev_row.extend([k] * len(days))
+
+    # 同一天内按格子顺序处理，同一格子先卖后买（每个格子的成交计划本身已按时间排序）
+    day_a = np.array(ev_day, dtype=np.int64)
+    row_a = np.array(ev_row, dtype=np.int64)
+    buy_a = np.array(ev_buy, dtype=bool)
+    order = np.lexsort((buy_a, row_a, day_a))
+    day_a, row_a, buy_a = day_a[order], row_a[order], buy_a[order]
+    price_a = np.array(ev_price, dtype=float)[order]
+    shares_a = np.array(ev_shares, dtype=float)[order]
+    amount_a = shares_a * price_a
+    n_events = len(order)
+
+    # 卖出时占用资金按该格子上一笔买入的成交价释放；同一格子的成交买卖交替，上一笔即买入
+    prev_same_row = np.zeros(n_events, dtype=bool)
+    if n_events:
+        by_row = np.lexsort((np.arange(n_events), row_a))
+        same = row_a[by_row][1:] == row_a[by_row][:-1]
+        prev_index = np.full(n_events, -1, dtype=np.int64)
+        prev_index[by_row[1:][same]] = by_row[:-1][same]
+        prev_same_row = prev_index >= 0
+        release = np.where(prev_same_row, price_a[np.maximum(prev_index, 0)], 0.0) * shares_a
+    else:
+        release = np.empty(0)
+
+    # --- 资金：按成交顺序累加（np.cumsum 逐项顺序相加，与逐笔记账逐位一致） ---
+    cash_seq = np.cumsum(np.concatenate(([float(initial_capital)], np.where(buy_a, -amount_a, amount_a))))
+    used_seq = np.cumsum(np.concatenate(([0.0], np.where(buy_a, amount_a, -release))))
+    max_used_seq = np.maximum.accumulate(used_seq)
+    if n_events and np.any(buy_a & (cash_seq[:-1] < grid.buy_amount[row_a])):
+        return run_numpy_engine(market, grid, initial_capital)
+
+    # --- 交易流水 ---
+    last = n_days - 1
+    day_l, row_l, buy_l = day_a.tolist(), row_a.tolist(), buy_a.tolist()
+    price_l = [ev_price[e] for e in order.tolist()]
+    shares_l = [ev_shares[e] for e in order.tolist()]
+    amount_l = amount_a.tolist()
+    trades = [{
+        "date": market.dates[i],
+        "action": ACTION_BUY if is_buy else ACTION_SELL,
+        "strategy_id": grid.ids[k],
+        "trigger": grid.raw_buy_trigger[k],
+        "executed_price": executed_price,
+        "shares": trade_shares,
+        "amount": amount,
+        "note": (NOTE_FIRST_DAY if i == 0 else NOTE_BUY) if is_buy else (NOTE_LAST_DAY if i == last else NOTE_SELL),
+    } for i, k, is_buy, executed_price, trade_shares, amount
+        in zip(day_l, row_l, buy_l, price_l, shares_l, amount_l)]
+
+    # --- 每个格子的最终状态（取成交计划的最后一笔 / 最后一笔买入） ---
+    status = [STATUS_NONE] * n_rows
+    shares_final: List[Any] = [0.0] * n_rows
+    held_buy_price = [0.0] * n_rows
+    last_day = [-1] * n_rows
+    for i, k, is_buy, executed_price, trade_shares in zip(day_l, row_l, buy_l, price_l, shares_l):
+        last_day[k] = i
+        if is_buy:
+            status[k] = STATUS_BOUGHT
+            shares_final[k] = trade_shares
+            held_buy_price[k] = executed_price
+        else:
+            status[k] = STATUS_SOLD
+            shares_final[k] = 0.0
+
+    # --- 每日快照：取每天最后一笔成交后的资金状态，之后向前填充 ---
+    if n_events:
+        day_end = np.searchsorted(day_a, np.arange(n_days), side='right')  # 截至当日结束的成交笔数
+        daily_cash_balance = cash_seq[day_end]
+        daily_cash_used = used_seq[day_end]
+        daily_max_cash_used = max_used_seq[day_end]
+    else:
+        daily_cash_used = np.zeros(n_days)
+        daily_max_cash_used = np.zeros(n_days)
+        daily_cash_balance = np.full(n_days, float(initial_capital))
+
+    share_delta = np.zeros(n_days, dtype=float)
+    np.add.at(share_delta, day_a, np.where(buy_a, shares_a, -shares_a))
+    shares_held = np.cumsum(share_delta)
+    holding_value = shares_held * market.close
+
+    sell_a = ~buy_a
+    return {
+        "trades": trades,
+        "trade_day": day_a,
+        "trade_row": row_a,
+        "cash_used": daily_cash_used,
+        "max_cash_used": daily_max_cash_used,
+        "holding_value": holding_value,
+        "cash_balance": daily_cash_balance,
+        "status": status,
+        "shares": shares_final,
+        "buy_price": held_buy_price,
+        "last_day": last_day,
+        "final_cash_used": float(used_seq[-1]),
+        "final_max_cash_used": float(max_used_seq[-1]),
+        "final_cash_balance": float(cash_seq[-1]),
+        "final_shares_held": float(shares_held[-1]) if n_days else 0.0,
+        "buy_num": int(buy_a.sum()),
+        "sell_num": int((sell_a & (day_a != last)).sum()),
+        "buy_fail_num": 0,
+        "triggered_set": {grid.ids[k] for k in row_a[sell_a].tolist()},
+    }
+
+
+def run_batch_engine(market: MarketArrays, grids: List[GridArrays], initial_capitals: List[float]) -> Dict[str, Any]:
+    """
+    多个策略共用一段行情的批量回测内核（假设现金充足，各格子互不影响）。
+    所有策略的格子拼在一起交给 simulate_rows，每一轮同时跳到各自的下一笔成交，而不是逐日扫描。
+
+    返回每笔成交（按策略、日期、格子、先卖后买排序）以及每个策略的逐日现金/持股汇总。
+    现金是否真的充足由调用方根据 cash_start / day_buy_nominal 校验，不满足的策略需回退到单策略引擎。
+    """
+    n_days = len(market)
+    n_strategies = len(grids)
+    row_counts = np.array([len(g) for g in grids], dtype=np.int64)
+    owner = np.repeat(np.arange(n_strategies), row_counts)
+    bt = np.concatenate([g.buy_trigger for g in grids]) if n_strategies else np.empty(0)
+    bp = np.concatenate([g.buy_price for g in grids]) if n_strategies else np.empty(0)
+    st = np.concatenate([g.sell_trigger for g in grids]) if n_strategies else np.empty(0)
+    sp = np.concatenate([g.sell_price for g in grids]) if n_strategies else np.empty(0)
+    amt = np.concatenate([g.buy_amount for g in grids]) if n_strategies else np.empty(0)
+
+    events = simulate_rows(market, bt, bp, st, sp, amt)
+    ev_row, ev_day, ev_is_buy = events["row"], events["day"], events["is_buy"]
+    ev_price, ev_shares, ev_cost = events["price"], events["shares"], events["cost"]
+    ev_owner = owner[ev_row]
+    # 同一策略内按 日期 -> 格子 -> 先卖后买 排序，与逐格回测的成交顺序一致
+    order = np.lexsort((ev_is_buy, ev_row, ev_day, ev_owner))
+    ev_row, ev_day, ev_is_buy = ev_row[order], ev_day[order], ev_is_buy[order]
+    ev_price, ev_shares, ev_cost, ev_owner = ev_price[order], ev_shares[order], ev_cost[order], ev_owner[order]
+    ev_amount = ev_shares * ev_price
+
+    # --- 逐日、逐策略汇总 ---
+    cash_flow = np.zeros((n_days, n_strategies))
+    share_flow = np.zeros((n_days, n_strategies))
+    day_buy_nominal = np.zeros((n_days, n_strategies))
+    sign = np.where(ev_is_buy, -1.0, 1.0)
+    np.add.at(cash_flow, (ev_day, ev_owner), sign * ev_amount)
+    np.add.at(share_flow, (ev_day, ev_owner), -sign * ev_shares)
+    np.add.at(day_buy_nominal, (ev_day[ev_is_buy], ev_owner[ev_is_buy]), amt[ev_row[ev_is_buy]])
+    cash_balance = np.asarray(initial_capitals, dtype=float)[None, :] + np.cumsum(cash_flow, axis=0)
+    holding_value = np.cumsum(share_flow, axis=0) * market.close[:, None]
+    cash_start = np.vstack((np.asarray(initial_capitals, dtype=float)[None, :], cash_balance[:-1]))
+
+    return {
+        "row_owner": owner,
+        "ev_row": ev_row,
+        "ev_owner": ev_owner,
+        "ev_day": ev_day,
+        "ev_is_buy": ev_is_buy,
+        "ev_price": ev_price,
+        "ev_shares": ev_shares,
+        "ev_amount": ev_amount,
+        "ev_cost": ev_cost,
+        "cash_balance": cash_balance,
+        "holding_value": holding_value,
+        "cash_start": cash_start,
+        "day_buy_nominal": day_buy_nominal,
+    }
@@ -0,0 +1,237 @@
+from typing import Dict, Any, List
+import numpy as np
+from util.backtest_engine import (MarketArrays, GridArrays, run_numpy_engine, STATUS_BOUGHT, STATUS_SOLD,
+                                  ACTION_BUY, ACTION_SELL, NOTE_FIRST_DAY, NOTE_BUY, NOTE_SELL, NOTE_LAST_DAY,
+                                  PRICE_MARKET, PRICE_BUY, PRICE_SELL)
+
+# 可选的 Numba 编译内核：逐日逐格的成交与记账逻辑写成只操作 float 数组的函数，
+# 安装了 numba 时编译为机器码（run_jit_engine 自动使用），未安装时 run_jit_engine 直接调用 run_numpy_engine
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    numba = None
+    NUMBA_AVAILABLE = False
+
+# 成交备注代码，对应 NOTE_* 文字
+_NOTE_TEXT = (NOTE_FIRST_DAY, NOTE_BUY, NOTE_SELL, NOTE_LAST_DAY)
+_NOTE_FIRST_DAY, _NOTE_BUY, _NOTE_SELL, _NOTE_LAST_DAY = 0, 1, 2, 3
+
+
+def _grid_kernel(open_a, high_a, low_a, close_a, bt, bp, st, sp, buy_amounts, initial_capital):
+    """
+    网格回测内核，规则与记账顺序同 run_numpy_engine（浮点运算逐笔相同，结果逐位一致）：
+    - 首日：开盘价 <= 触发价且 <= 买入价时按开盘价成交，否则当日区间覆盖触发价与买入价时按买入价成交
+    - 中间日：逐个格子先判断卖出再判断买入，买入当天不能卖出
+    - 最后一日：所有持仓清仓（开盘价 / 卖出价 / 收盘价），不计入卖出次数
+    只使用 float / int 数组与标量，可直接交给 numba.njit 编译；成交记录写入按需倍增的缓冲区
+    """
+    n_days = len(open_a)
+    n_rows = len(bt)
+
+    status = np.zeros(n_rows, dtype=np.int64)
+    shares = np.zeros(n_rows, dtype=np.float64)
+    held_buy_price = np.zeros(n_rows, dtype=np.float64)
+    last_day = np.full(n_rows, -1, dtype=np.int64)
+    share_delta = np.zeros(n_days, dtype=np.float64)
+    daily_cash_used = np.zeros(n_days, dtype=np.float64)
+    daily_max_cash_used = np.zeros(n_days, dtype=np.float64)
+    daily_cash_balance = np.zeros(n_days, dtype=np.float64)
+
+    # 成交记录缓冲区，每行一笔：日下标 / 格子下标 / 是否买入 / 价格来源 / 备注代码 / 成交价 / 股数 / 金额（整数字段在 float64 中精确表示）
+    capacity = max(16, 2 * n_rows)
+    buf = np.empty((capacity, 8), dtype=np.float64)
+    n_trades = 0
+
+    cash_balance = initial_capital
+    cash_used = 0.0
+    max_cash_used = 0.0
+    buy_num = 0
+    sell_num = 0
+    buy_fail_num = 0
+
+    for i in range(n_days):
+        o = open_a[i]
+        h = high_a[i]
+        l = low_a[i]
+        c = close_a[i]
+        is_first = i == 0
+        is_last = i == n_days - 1 and n_days > 1
+        # 每根K线每个格子最多一卖一买，逐日先保证缓冲区还能放下 2 * n_rows 笔
+        # （扩容放在格子循环之外，内层循环不重新绑定数组，编译后没有额外的引用计数开销）
+        if n_trades + 2 * n_rows > capacity:
+            capacity = max(2 * capacity, n_trades + 2 * n_rows)
+            grown = np.empty((capacity, 8), dtype=np.float64)
+            grown[:n_trades] = buf[:n_trades]
+            buf = grown
+        for k in range(n_rows):
+            # --- 卖出：最后一日清仓 / 中间日触发卖出 ---
+            sell_price = 0.0
+            sell_kind = -1
+            if is_last:
+                if status[k] == STATUS_BOUGHT:
+                    if o >= st[k] and o >= sp[k]:
+                        sell_price = o
+                        sell_kind = PRICE_MARKET
+                    elif h >= st[k] and l <= sp[k] and sp[k] <= h:
+                        sell_price = sp[k]
+                        sell_kind = PRICE_SELL
+                    else:
+                        sell_price = c
+                        sell_kind = PRICE_MARKET
+            elif not is_first:
+                if h >= st[k] and l <= sp[k] and sp[k] <= h and status[k] == STATUS_BOUGHT and last_day[k] != i:
+                    sell_price = sp[k]
+                    sell_kind = PRICE_SELL
+            if sell_kind >= 0:
+                sell_shares = shares[k]
+                sell_amount = sell_shares * sell_price
+                share_delta[i] -= sell_shares
+                shares[k] = 0.0
+                status[k] = STATUS_SOLD
+                last_day[k] = i
+                buf[n_trades, 0] = i
+                buf[n_trades, 1] = k
+                buf[n_trades, 2] = 0
+                buf[n_trades, 3] = sell_kind
+                buf[n_trades, 4] = _NOTE_LAST_DAY if is_last else _NOTE_SELL
+                buf[n_trades, 5] = sell_price
+                buf[n_trades, 6] = sell_shares
+                buf[n_trades, 7] = sell_amount
+                n_trades += 1
+                cash_used -= held_buy_price[k] * sell_shares
+                max_cash_used = max(max_cash_used, cash_used)
+                cash_balance += sell_amount
+                if not is_last:
+                    sell_num += 1
+            if is_last:
+                continue
+
+            # --- 买入：首日建仓 / 中间日触发买入 ---
+            buy_price = 0.0
+            buy_kind = -1
+            if is_first:
+                if o <= bt[k] and o <= bp[k]:
+                    buy_price = o
+                    buy_kind = PRICE_MARKET
+                elif l <= bt[k] and bt[k] <= h and l <= bp[k] and bp[k] <= h:
+                    buy_price = bp[k]
+                    buy_kind = PRICE_BUY
+            elif status[k] != STATUS_BOUGHT and l <= bt[k] and bt[k] <= h and l <= bp[k] and bp[k] <= h:
+                buy_price = bp[k]
+                buy_kind = PRICE_BUY
+            if buy_kind >= 0:
+                buy_amount = buy_amounts[k]
+                if cash_balance < buy_amount:
+                    buy_fail_num += 1
+                    continue
+                actual_shares = float(int(buy_amount / buy_price)) if buy_price > 0 else 0.0
+                amount = actual_shares * buy_price
+                share_delta[i] += actual_shares - shares[k]
+                shares[k] = actual_shares
+                status[k] = STATUS_BOUGHT
+                last_day[k] = i
+                held_buy_price[k] = buy_price
+                buf[n_trades, 0] = i
+                buf[n_trades, 1] = k
+                buf[n_trades, 2] = 1
+                buf[n_trades, 3] = buy_kind
+                buf[n_trades, 4] = _NOTE_FIRST_DAY if is_first else _NOTE_BUY
+                buf[n_trades, 5] = buy_price
+                buf[n_trades, 6] = actual_shares
+                buf[n_trades, 7] = amount
+                n_trades += 1
+                cash_used += amount
+                max_cash_used = max(max_cash_used, cash_used)
+                cash_balance -= amount
+                buy_num += 1
+
+        daily_cash_used[i] = cash_used
+        daily_max_cash_used[i] = max_cash_used
+        daily_cash_balance[i] = cash_balance
+
+    counters = np.array([buy_num, sell_num, buy_fail_num], dtype=np.int64)
+    finals = np.array([cash_used, max_cash_used, cash_balance], dtype=np.float64)
+    return (buf[:n_trades].copy(), status, shares, held_buy_price, last_day, share_delta,
+            daily_cash_used, daily_max_cash_used, daily_cash_balance, counters, finals)
+
+
+if NUMBA_AVAILABLE:
+    # cache=True 把编译结果写到 __pycache__，之后启动无需重新编译
+    _grid_kernel_jit = numba.njit(cache=True)(_grid_kernel)
+else:
+    _grid_kernel_jit = None
+
+
+def run_jit_engine(market: MarketArrays, grid: GridArrays, initial_capital: float) -> Dict[str, Any]:
+    """
+    Numba 编译内核版的回测，返回值结构与 run_numpy_engine 相同，数值逐位一致
+    未安装 numba 时直接调用 run_numpy_engine
+    """
+    if not NUMBA_AVAILABLE:
+        return run_numpy_engine(market, grid, initial_capital)
+
+    n_days = len(market)
+    (buf, status_a, shares_a, _, last_day_a, share_delta,
+     daily_cash_used, daily_max_cash_used, daily_cash_balance, counters, finals) = _grid_kernel_jit(
+        np.ascontiguousarray(market.open, dtype=float), np.ascontiguousarray(market.high, dtype=float),
+        np.ascontiguousarray(market.low, dtype=float), np.ascontiguousarray(market.close, dtype=float),
+        grid.buy_trigger, grid.buy_price, grid.sell_trigger, grid.sell_price, grid.buy_amount,
+        float(initial_capital))
+
+    # --- 交易流水：限价成交写回格子的原始价格，股数为 int（与其他引擎写入流水的值完全相同） ---
+    t_day = buf[:, 0].astype(np.int64)
+    t_row = buf[:, 1].astype(np.int64)
+    day_l, row_l = t_day.tolist(), t_row.tolist()
+    buy_l = (buf[:, 2] == 1).tolist()
+    kind_l, note_l = buf[:, 3].astype(np.int64).tolist(), buf[:, 4].astype(np.int64).tolist()
+    price_l, shares_l, amount_l = buf[:, 5].tolist(), buf[:, 6].tolist(), buf[:, 7].tolist()
+    trades: List[Dict[str, Any]] = []
+    held_buy_price: List[Any] = [0.0] * len(grid)  # 各格子最近一笔买入的成交价（卖出后保留）
+    for i, k, is_buy, kind, note, executed_price, trade_shares, amount in zip(
+            day_l, row_l, buy_l, kind_l, note_l, price_l, shares_l, amount_l):
+        if kind == PRICE_BUY:
+            executed_price = grid.raw_buy_price[k]
+        elif kind == PRICE_SELL:
+            executed_price = grid.raw_sell_price[k]
+        if is_buy:
+            held_buy_price[k] = executed_price
+        trades.append({
+            "date": market.dates[i],
+            "action": ACTION_BUY if is_buy else ACTION_SELL,
+            "strategy_id": grid.ids[k],
+            "trigger": grid.raw_buy_trigger[k],
+            "executed_price": executed_price,
+            "shares": int(trade_shares),
+            "amount": amount,
+            "note": _NOTE_TEXT[note],
+        })
+
+    # 未持仓的格子持股为 0.0，持仓格子为 int，与 run_numpy_engine 一致
+    status_l = status_a.tolist()
+    shares = [int(s) if code == STATUS_BOUGHT else 0.0 for s, code in zip(shares_a.tolist(), status_l)]
+
+    shares_held = np.cumsum(share_delta)
+    buy_num, sell_num, buy_fail_num = counters.tolist()
+    final_cash_used, final_max_cash_used, final_cash_balance = finals.tolist()
+    return {
+        "trades": trades,
+        "trade_day": t_day,
+        "trade_row": t_row,
+        "cash_used": daily_cash_used,
+        "max_cash_used": daily_max_cash_used,
+        "holding_value": shares_held * market.close,
+        "cash_balance": daily_cash_balance,
+        "status": status_l,
+        "shares": shares,
+        "buy_price": held_buy_price,
+        "last_day": last_day_a.tolist(),
+        "final_cash_used": final_cash_used,
+        "final_max_cash_used": final_max_cash_used,
+        "final_cash_balance": final_cash_balance,
+        "final_shares_held": float(shares_held[-1]) if n_days else 0.0,
+        "buy_num": buy_num,
+        "sell_num": sell_num,
+        "buy_fail_num": buy_fail_num,
+        "triggered_set": {grid.ids[k] for k, is_buy in zip(row_l, buy_l) if not is_buy},
+    }
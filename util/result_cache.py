@@ -0,0 +1,199 @@
+import os
+import pickle
+import sqlite3
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Union
+import numpy as np
+from dao.config import base_dir
+from util.backtest_engine import MarketArrays
+from util.backtest import BackTest, infer_initial_capital
+
+# 回测结果缓存：同一个网格策略在同一批行情、同样的初始资金下结果完全确定，命中后不必重新运行 BackTest。
+# 两层：进程内 LRU（直接返回对象）+ 磁盘 SQLite（跨进程 / 跨次运行，按总字节数淘汰最久未使用的条目）
+
+# 回测规则或指标口径变化时递增，旧缓存自动失效
+CACHE_VERSION = 1
+DEFAULT_CACHE_PATH = os.path.join(base_dir, "data", "cache", "backtest_results.db")
+DEFAULT_MAX_MEMORY_ENTRIES = 64
+DEFAULT_MAX_DISK_BYTES = 256 * 1024 * 1024
+
+# 参与回测的格子字段（其他字段如备注、时间戳不影响结果，不计入键）
+_STRATEGY_FIELDS = ("id", "buy_trigger_price", "buy_price", "sell_trigger_price", "sell_price", "buy_amount", "shares")
+
+
+def market_checksum(grid_data: Union[List[Dict], MarketArrays]) -> str:
+    """行情内容校验和：日期 + OHLC 数组的摘要，同一批数据重新导入后仍能命中，数据有任何改动都不会误命中"""
+    market = grid_data if isinstance(grid_data, MarketArrays) else MarketArrays.from_grid_data(grid_data)
+    digest = hashlib.sha256()
+    digest.update(market.key[2].encode())
+    digest.update("|".join(str(d) for d in market.dates).encode())
+    return digest.hexdigest()
+
+
+def result_key(grid_strategy: List[Dict], initial_capital: Optional[float], checksum: str) -> str:
+    """缓存键：格子参数、初始资金（None 时取推断值）与行情校验和的 SHA-256"""
+    capital = float(initial_capital) if initial_capital is not None else infer_initial_capital(grid_strategy)
+    rows = [[row.get(field) for field in _STRATEGY_FIELDS] for row in grid_strategy]
+    payload = json.dumps([CACHE_VERSION, rows, repr(capital), checksum], default=str, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class BacktestResultCache:
+    """
+    回测结果缓存，值为 {"metrics": dict, "df_trades": DataFrame 或 None, "df_daily": DataFrame 或 None}
+    get(key, with_frames=True) 只在保存了两张表的条目上命中；只存了指标的条目仍可满足只要指标的查询
+    path=None 时只用进程内 LRU
+    """
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+                 max_disk_bytes: int = DEFAULT_MAX_DISK_BYTES):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS BacktestResult ("
+                    " key TEXT PRIMARY KEY,"
+                    " metrics BLOB NOT NULL,"
+                    " frames BLOB,"
+                    " size INTEGER NOT NULL,"
+                    " last_access REAL NOT NULL)")
+                conn.execute("CREATE INDEX IF NOT EXISTS ix_BacktestResult_last_access ON BacktestResult (last_access)")
+
+    @contextmanager
+    def _connect(self):
+        """打开缓存库连接，块结束时提交（异常时回滚）并关闭"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key: str, with_frames: bool = False) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(key)
+        if entry is not None and (not with_frames or entry["df_trades"] is not None):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self._copy(entry)
+
+        entry = self._disk_get(key, with_frames) if self.path is not None else None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._memory_put(key, entry)
+        self.hits += 1
+        return self._copy(entry)
+
+    def put(self, key: str, result: Dict[str, Any], with_frames: bool = True):
+        """保存回测结果（BackTest.run_backtest() 的返回值或同结构的字典）；with_frames=False 时只存指标"""
+        metrics = result["metrics"]
+        entry = {
+            "metrics": metrics.to_dict() if hasattr(metrics, "to_dict") else dict(metrics),
+            "df_trades": result.get("df_trades") if with_frames else None,
+            "df_daily": result.get("df_daily") if with_frames else None,
+        }
+        if entry["df_trades"] is None or entry["df_daily"] is None:
+            entry["df_trades"] = entry["df_daily"] = None
+        else:
+            # 存一份自己的副本，调用方之后修改传入的表不会改到缓存
+            entry["df_trades"] = entry["df_trades"].copy()
+            entry["df_daily"] = entry["df_daily"].copy()
+        self._memory_put(key, entry)
+        if self.path is not None:
+            self._disk_put(key, entry)
+
+    def clear(self):
+        """清空两层缓存"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM BacktestResult")
+
+    @staticmethod
+    def _copy(entry: Dict[str, Any]) -> Dict[str, Any]:
+        """返回给调用方的副本，指标字典或两张表被修改（加列、原地排序等）都不影响缓存"""
+        return {
+            "metrics": dict(entry["metrics"]),
+            "df_trades": entry["df_trades"].copy() if entry["df_trades"] is not None else None,
+            "df_daily": entry["df_daily"].copy() if entry["df_daily"] is not None else None,
+        }
+
+    def _memory_put(self, key: str, entry: Dict[str, Any]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_memory_entries:
+            self.entries.popitem(last=False)
+
+    def _disk_get(self, key: str, with_frames: bool) -> Optional[Dict[str, Any]]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT metrics, frames FROM BacktestResult WHERE key = ?", (key,)).fetchone()
+            if row is None or (with_frames and row[1] is None):
+                return None
+            conn.execute("UPDATE BacktestResult SET last_access = ? WHERE key = ?", (time.time(), key))
+        df_trades, df_daily = pickle.loads(row[1]) if row[1] is not None else (None, None)
+        return {"metrics": pickle.loads(row[0]), "df_trades": df_trades, "df_daily": df_daily}
+
+    def _disk_put(self, key: str, entry: Dict[str, Any]):
+        metrics_blob = pickle.dumps(entry["metrics"], protocol=pickle.HIGHEST_PROTOCOL)
+        frames_blob = None
+        if entry["df_trades"] is not None:
+            frames_blob = pickle.dumps((entry["df_trades"], entry["df_daily"]), protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(metrics_blob) + (len(frames_blob) if frames_blob is not None else 0)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO BacktestResult (key, metrics, frames, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (key, metrics_blob, frames_blob, size, time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """总大小超过 max_disk_bytes 时，按最近访问时间从旧到新删除，直到回到上限以内"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM BacktestResult").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM BacktestResult ORDER BY last_access").fetchall()
+        sizes = np.array([size for _, size in rows], dtype=np.int64)
+        n_drop = int(np.searchsorted(np.cumsum(sizes), total - self.max_disk_bytes)) + 1
+        conn.executemany("DELETE FROM BacktestResult WHERE key = ?", [(key,) for key, _ in rows[:n_drop]])
+
+
+# 进程内共享的默认结果缓存，首次使用时创建
+_default_cache: Optional[BacktestResultCache] = None
+
+
+def get_default_cache() -> BacktestResultCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BacktestResultCache()
+    return _default_cache
+
+
+def run_backtest_cached(grid_data: List[Dict], grid_strategy: List[Dict], initial_capital: Optional[float] = None,
+                        with_frames: bool = False, verbose: bool = False,
+                        cache: Optional[BacktestResultCache] = None) -> Dict[str, Any]:
+    """
+    带缓存的回测：命中时直接返回缓存的 metrics（with_frames=True 时连同 df_trades / df_daily），
+    未命中时运行 BackTest.run_backtest() 并写入缓存。返回值结构同 run_backtest()，metrics 为普通 dict
+    """
+    if cache is None:
+        cache = get_default_cache()
+    key = result_key(grid_strategy, initial_capital, market_checksum(grid_data))
+    cached = cache.get(key, with_frames=with_frames)
+    if cached is not None:
+        return cached
+    result = BackTest(grid_data, grid_strategy, initial_capital, verbose=verbose,
+                      build_frames=with_frames).run_backtest()
+    cache.put(key, result, with_frames=with_frames)
+    return {"metrics": result["metrics"].to_dict(), "df_trades": result["df_trades"], "df_daily": result["df_daily"]}
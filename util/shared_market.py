@@ -0,0 +1,110 @@
+from datetime import date, datetime, timedelta
+from multiprocessing import shared_memory
+from typing import List, Dict, Optional, Union
+import numpy as np
+from util.backtest_engine import MarketArrays
+
+# 多进程回测的共享行情：主进程把日期与 OHLC 数组一次性写入一块 multiprocessing.shared_memory，
+# 子进程只拿到 (名称, 天数, import_id, 日期类型) 这个很小的句柄，按名称挂载后直接在共享内存上构造 MarketArrays（零拷贝），
+# 不必把 IndexData.to_dict() 的整张字典列表 pickle 给每个进程
+
+# 共享内存布局：5 行 x n 天，依次为 日期(int64) / open / high / low / close(float64)
+# 日期为 date 时存序数（date.toordinal()），为 datetime 时存距 1970-01-01 的微秒数，挂载后还原为同样的类型
+_N_FIELDS = 5
+_DATE_KIND_DATE = "date"
+_DATE_KIND_DATETIME = "datetime"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _date_kind(dates: List) -> str:
+    """行情日期须全部为 date，或全部为不带时区的 datetime，否则子进程还原出的日期与主进程不相等"""
+    if all(isinstance(d, date) and not isinstance(d, datetime) for d in dates):
+        return _DATE_KIND_DATE
+    if all(isinstance(d, datetime) and d.tzinfo is None for d in dates):
+        return _DATE_KIND_DATETIME
+    raise TypeError("共享行情的日期须全部为 datetime.date，或全部为不带时区的 datetime.datetime")
+
+
+class SharedMarketData:
+    """
+    发布方：SharedMarketData.publish(grid_data 或 MarketArrays)，把 handle 传给子进程，全部子进程结束后 close() 并 unlink()
+    挂载方：SharedMarketData.attach(handle).market() 得到 MarketArrays，使用期间须保持该对象存活
+    可作为上下文管理器使用，退出时自动 close()（发布方同时 unlink()）
+    """
+    def __init__(self, shm: shared_memory.SharedMemory, n_days: int, import_id: Optional[int], owner: bool,
+                 date_kind: str = _DATE_KIND_DATE):
+        self.shm = shm
+        self.n_days = n_days
+        self.import_id = import_id
+        self.date_kind = date_kind
+        self.owner = owner
+        self._market = None
+
+    @classmethod
+    def publish(cls, grid_data: Union[List[Dict], MarketArrays]) -> "SharedMarketData":
+        """创建共享内存并写入行情，返回发布方对象"""
+        market = grid_data if isinstance(grid_data, MarketArrays) else MarketArrays.from_grid_data(grid_data)
+        n = len(market)
+        date_kind = _date_kind(market.dates)
+        # 长度为 0 的共享内存无法创建，至少申请 1 字节
+        shm = shared_memory.SharedMemory(create=True, size=max(1, _N_FIELDS * n * 8))
+        shared = cls(shm, n, market.import_id, owner=True, date_kind=date_kind)
+        ordinals, prices = shared._views()
+        if date_kind == _DATE_KIND_DATE:
+            ordinals[:] = [d.toordinal() for d in market.dates]
+        else:
+            ordinals[:] = [(d - _EPOCH) // timedelta(microseconds=1) for d in market.dates]
+        prices[0] = market.open
+        prices[1] = market.high
+        prices[2] = market.low
+        prices[3] = market.close
+        return shared
+
+    @classmethod
+    def attach(cls, handle: tuple) -> "SharedMarketData":
+        """按 publish 方给出的 handle 挂载已有的共享行情"""
+        name, n_days, import_id, date_kind = handle
+        return cls(shared_memory.SharedMemory(name=name), n_days, import_id, owner=False, date_kind=date_kind)
+
+    @property
+    def handle(self) -> tuple:
+        """传给子进程的句柄：(共享内存名称, 天数, import_id, 日期类型)"""
+        return self.shm.name, self.n_days, self.import_id, self.date_kind
+
+    def _views(self):
+        n = self.n_days
+        ordinals = np.ndarray((n,), dtype=np.int64, buffer=self.shm.buf)
+        prices = np.ndarray((_N_FIELDS - 1, n), dtype=np.float64, buffer=self.shm.buf, offset=n * 8)
+        return ordinals, prices
+
+    def market(self) -> MarketArrays:
+        """返回直接引用共享内存的 MarketArrays（OHLC 不复制，日期列表首次调用时还原并缓存）"""
+        if self._market is None:
+            ordinals, prices = self._views()
+            if self.date_kind == _DATE_KIND_DATE:
+                dates = [date.fromordinal(d) for d in ordinals.tolist()]
+            else:
+                dates = [_EPOCH + timedelta(microseconds=d) for d in ordinals.tolist()]
+            self._market = MarketArrays(
+                dates=dates,
+                open_p=prices[0], high_p=prices[1], low_p=prices[2], close_p=prices[3],
+                import_id=self.import_id,
+            )
+        return self._market
+
+    def close(self):
+        """断开本进程对共享内存的映射；之后不能再使用 market() 返回的数组"""
+        self._market = None
+        self.shm.close()
+
+    def unlink(self):
+        """释放共享内存（只应由发布方在所有子进程结束后调用）"""
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        self.unlink()
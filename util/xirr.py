@@ -0,0 +1,158 @@
+from typing import Optional, Sequence
+import numpy as np
+import pandas as pd
+from scipy.optimize import brentq
+
+# XIRR 求解：牛顿法（解析导数）为主，发散时在扫描出的变号区间内用 brentq 兜底；
+# xirr_batch 用数组一次性对成千上万组现金流同时做牛顿迭代（如 backtest_many 的批量回测）
+
+DEFAULT_GUESS = 0.1  # 初始猜测 10%
+DEFAULT_TOL = 1e-10
+DEFAULT_MAXITER = 50
+RESIDUAL_RTOL = 1e-6  # 收敛后净现值须小于各笔折现现金流绝对值之和的该比例，否则视为假收敛（如逼近 -1 时）
+
+# 兜底时用于寻找变号区间的收益率网格（须 > -1）
+_BRACKET_GRID = np.array([-0.9999, -0.999, -0.99, -0.95, -0.9, -0.75, -0.5, -0.3, -0.2, -0.1, 0.0,
+                          0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0, 10.0, 100.0, 1000.0])
+
+
+def years_since_first(dates: Sequence) -> np.ndarray:
+    """把现金流日期换算为距最早日期的年数（按 365 天/年）"""
+    dates = pd.to_datetime(pd.Series(dates))
+    return ((dates - dates.min()).dt.days / 365.0).to_numpy(dtype=float)
+
+
+def xnpv(rate: float, cashflows: np.ndarray, years: np.ndarray) -> float:
+    """按收益率 rate 折现的净现值"""
+    return float(np.sum(cashflows / (1 + rate) ** years))
+
+
+def xnpv_derivative(rate: float, cashflows: np.ndarray, years: np.ndarray) -> float:
+    """净现值对收益率的解析导数：d/dr Σ cf·(1+r)^-t = Σ -t·cf·(1+r)^(-t-1)"""
+    return float(np.sum(-years * cashflows / (1 + rate) ** (years + 1)))
+
+
+def _is_solvable(cashflows: np.ndarray) -> bool:
+    """至少两笔现金流，且必须同时包含正负现金流"""
+    return len(cashflows) >= 2 and bool(np.any(cashflows > 0)) and bool(np.any(cashflows < 0))
+
+
+def _newton(cashflows: np.ndarray, years: np.ndarray, guess: float, tol: float, maxiter: int) -> Optional[float]:
+    rate = guess
+    with np.errstate(all='ignore'):
+        for _ in range(maxiter):
+            f = xnpv(rate, cashflows, years)
+            df = xnpv_derivative(rate, cashflows, years)
+            if f == 0:
+                return rate
+            if df == 0 or not np.isfinite(f) or not np.isfinite(df):
+                return None
+            new_rate = rate - f / df
+            if new_rate <= -1:
+                new_rate = (rate - 1) / 2  # 越过 -1 时退到与 -1 的中点，保证 (1+r) > 0
+            if abs(new_rate - rate) <= tol * max(1.0, abs(new_rate)):
+                discounted = cashflows / (1 + new_rate) ** years
+                if abs(np.sum(discounted)) <= RESIDUAL_RTOL * np.sum(np.abs(discounted)):
+                    return new_rate
+                return None
+            rate = new_rate
+    return None
+
+
+def _bracketed(cashflows: np.ndarray, years: np.ndarray, guess: float, tol: float) -> Optional[float]:
+    """在收益率网格上找净现值变号的相邻区间，取离初始猜测最近的一个用 brentq 求根"""
+    with np.errstate(all='ignore'):
+        values = np.array([xnpv(r, cashflows, years) for r in _BRACKET_GRID])
+    finite = np.isfinite(values)
+    candidates = [i for i in range(len(_BRACKET_GRID) - 1)
+                  if finite[i] and finite[i + 1] and np.sign(values[i]) != np.sign(values[i + 1])]
+    if not candidates:
+        return None
+    i = min(candidates, key=lambda i: abs((_BRACKET_GRID[i] + _BRACKET_GRID[i + 1]) / 2 - guess))
+    if values[i] == 0:
+        return float(_BRACKET_GRID[i])
+    if values[i + 1] == 0:
+        return float(_BRACKET_GRID[i + 1])
+    try:
+        return float(brentq(xnpv, _BRACKET_GRID[i], _BRACKET_GRID[i + 1], args=(cashflows, years), xtol=tol))
+    except (ValueError, RuntimeError):
+        return None
+
+
+def xirr(cashflows, years, guess: float = DEFAULT_GUESS, tol: float = DEFAULT_TOL,
+         maxiter: int = DEFAULT_MAXITER) -> Optional[float]:
+    """
+    求解单组现金流的 XIRR，years 为各笔现金流距最早日期的年数（见 years_since_first）
+    无法求解（现金流不足、没有正负两种方向或找不到根）时返回 None
+    """
+    cashflows = np.asarray(cashflows, dtype=float)
+    years = np.asarray(years, dtype=float)
+    if not _is_solvable(cashflows):
+        return None
+    rate = _newton(cashflows, years, guess, tol, maxiter)
+    if rate is None:
+        rate = _bracketed(cashflows, years, guess, tol)
+    return None if rate is None or np.isnan(rate) else float(rate)
+
+
+def xirr_batch(cashflows, years, owners, n_sets: int, guess: float = DEFAULT_GUESS,
+               tol: float = DEFAULT_TOL, maxiter: int = DEFAULT_MAXITER) -> np.ndarray:
+    """
+    批量求解 XIRR：所有现金流展平为一维，owners[i] 表示第 i 笔现金流属于第几组（0 ~ n_sets-1）
+    各组同时做牛顿迭代（按组 bincount 汇总净现值与导数），未收敛的组再逐个走 xirr() 兜底
+    返回长度 n_sets 的数组，无解的组为 NaN
+    """
+    cashflows = np.asarray(cashflows, dtype=float)
+    years = np.asarray(years, dtype=float)
+    owners = np.asarray(owners, dtype=np.int64)
+    result = np.full(n_sets, np.nan)
+    if n_sets == 0 or len(cashflows) == 0:
+        return result
+
+    count = np.bincount(owners, minlength=n_sets)
+    has_pos = np.bincount(owners, weights=(cashflows > 0), minlength=n_sets) > 0
+    has_neg = np.bincount(owners, weights=(cashflows < 0), minlength=n_sets) > 0
+    valid = (count >= 2) & has_pos & has_neg
+
+    rate = np.full(n_sets, guess, dtype=float)
+    active = valid.copy()
+    with np.errstate(all='ignore'):
+        for _ in range(maxiter):
+            in_active = active[owners]
+            if not in_active.any():
+                break
+            cf, t, own = cashflows[in_active], years[in_active], owners[in_active]
+            base = 1 + rate[own]
+            discounted = cf / base ** t
+            f = np.bincount(own, weights=discounted, minlength=n_sets)
+            df = np.bincount(own, weights=-t * discounted / base, minlength=n_sets)
+            new_rate = rate - f / df
+            new_rate = np.where(f == 0, rate, new_rate)
+            new_rate = np.where(new_rate <= -1, (rate - 1) / 2, new_rate)
+            failed = active & ~np.isfinite(new_rate)
+            done = active & ~failed & (np.abs(new_rate - rate) <= tol * np.maximum(1.0, np.abs(new_rate)))
+            if done.any():
+                in_done = done[owners]
+                own = owners[in_done]
+                discounted = cashflows[in_done] / (1 + new_rate[own]) ** years[in_done]
+                residual = np.abs(np.bincount(own, weights=discounted, minlength=n_sets))
+                scale = np.bincount(own, weights=np.abs(discounted), minlength=n_sets)
+                false_root = done & ~(residual <= RESIDUAL_RTOL * scale)
+                failed |= false_root
+                done &= ~false_root
+            result[done] = new_rate[done]
+            rate = np.where(active & ~failed, new_rate, rate)
+            active &= ~(done | failed)
+
+    # 牛顿法未收敛（发散、导数为 0 或迭代次数用尽）的组逐个兜底
+    leftover = np.flatnonzero(valid & np.isnan(result))
+    if len(leftover):
+        order = np.argsort(owners, kind="stable")
+        starts = np.searchsorted(owners[order], leftover, side="left")
+        ends = np.searchsorted(owners[order], leftover, side="right")
+        for k, a, b in zip(leftover, starts, ends):
+            idx = order[a:b]
+            irr = xirr(cashflows[idx], years[idx], guess, tol, maxiter)
+            if irr is not None:
+                result[k] = irr
+    return result